@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+'''
+asyncio API, to build the environments of many projects concurrently
+
+``buildstrap()`` runs buildout in process, so a process can only build one
+environment at a time. ``buildstrap_async()`` generates the configuration in a
+worker thread, and runs buildout as a subprocess, streaming its output::
+
+    code = await buildstrap_async(['run', '-o', '/path/to/project/buildout.cfg',
+                                   'project', 'requirements.txt'])
+
+and ``gather_buildstrap()`` runs many of those, with a limit on how many run at
+once::
+
+    codes = await gather_buildstrap([['run', '-o', os.path.join(path, 'buildout.cfg'),
+                                      os.path.basename(path), 'requirements.txt']
+                                     for path in projects], jobs=4)
+
+Relative paths given in the arguments are relative to the process' current
+directory, which is shared by all the projects: give each project its output
+path (``-o``), relative to which the other paths are resolved.
+
+Cancelling a task (or having it time out) terminates its buildout subprocess.
+'''
+
+import os, sys, asyncio
+
+from functools import partial
+
+from buildstrap.buildstrap import (buildstrap, egg_store_session, generate_from_args, precompile_environment,
+                                   prepare_run, save_state)
+
+BUILDOUT_SCRIPT = 'import sys; from zc.buildout.buildout import main; main(sys.argv[1:])'
+
+# time given to a buildout subprocess to exit once terminated, before killing it
+TERMINATE_TIMEOUT = 5
+
+def parse_args(argv):
+    '''Parses command line arguments, the way the ``buildstrap`` command does
+
+    Raises:
+        ValueError: when the arguments do not match the usage
+    '''
+    from docopt import docopt, DocoptExit
+    from buildstrap import buildstrap as module
+    try:
+        return docopt(module.__doc__.format('buildstrap'), list(argv), help=False)
+    except DocoptExit as err:
+        raise ValueError(str(err)) from None
+
+def buildout_command(config, lock_path=None, executable=None):
+    '''Gives the command line running buildout on a configuration file, as a subprocess
+
+    Given a lock path, eggs are installed while holding that lock (cf
+    ``buildstrap.eggs.install_lock()``). Buildout runs on the given python
+    executable (defaults to the running one), which has to be able to import
+    ``zc.buildout``.
+    '''
+    executable = executable or sys.executable
+    if lock_path:
+        from buildstrap.eggs import LOCKED_BUILDOUT_SCRIPT
+        return [executable, '-c', LOCKED_BUILDOUT_SCRIPT, lock_path, '-c', config]
+    return [executable, '-c', BUILDOUT_SCRIPT, '-c', config]
+
+def print_output(line):
+    '''Default output of buildout's subprocess: printed on stdout'''
+    sys.stdout.write(line)
+    sys.stdout.flush()
+
+async def run_process(command, output=None):
+    '''Runs a subprocess, streaming its output line by line
+
+    When the task is cancelled, the subprocess is terminated (and killed, if it
+    did not exit after ``TERMINATE_TIMEOUT`` seconds).
+
+    Args:
+        command: command line to run
+        output: callable given each line of the subprocess' output (stdout and
+            stderr), defaults to printing it
+
+    Returns:
+        the exit code of the subprocess
+    '''
+    output = output or print_output
+    process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, limit=2**20)
+    try:
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            output(line.decode('utf-8', 'replace'))
+        return await process.wait()
+    finally:
+        if process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), TERMINATE_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+async def _in_thread(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+async def _run(args, output):
+    '''Generates the configuration, and runs buildout as a subprocess'''
+    parts, result = await _in_thread(generate_from_args, args)
+    if args['--verbose']:
+        output('{}: {}\n'.format(args['--output'], result))
+    prepared = await _in_thread(prepare_run, args, parts)
+    if prepared is None:
+        return 0
+    paths, state, _ = prepared
+
+    sessions = []
+    lock_path = None
+    if args.get('--eggs-cache'):
+        from buildstrap.eggs import EggsCache, format_run
+        eggs_cache = EggsCache(args['--eggs-cache'], parts['buildout'])
+        sessions.append(eggs_cache.session(paths['bin']))
+        lock_path = eggs_cache.lock_path
+    sessions.append(egg_store_session(args, paths, parts))
+    entered = []
+    try:
+        for session in sessions:
+            await _in_thread(session.__enter__)
+            entered.append(session)
+        if args.get('--parallel-parts'):
+            from buildstrap.parallel import PartFailed, install_parts
+            try:
+                await install_parts(args['--output'], parts, paths,
+                                    int(args['--jobs']) if args.get('--jobs') else None,
+                                    lambda part, line: output('{}: {}'.format(part, line)), lock_path,
+                                    args.get('--executable'))
+                code = 0
+            except PartFailed as err:
+                output('{}\n'.format(err))
+                code = 1
+        else:
+            code = await run_process(buildout_command(args['--output'], lock_path, args.get('--executable')),
+                                     output)
+    except BaseException:
+        for session in reversed(entered):
+            await asyncio.shield(_in_thread(session.__exit__, *sys.exc_info()))
+        raise
+    for session in reversed(entered):
+        if code == 0:
+            await _in_thread(session.__exit__, None, None, None)
+        else:
+            error = RuntimeError('buildout failed')
+            await _in_thread(session.__exit__, RuntimeError, error, None)
+    if code == 0 and args.get('--eggs-cache') and args['--verbose']:
+        output(format_run(eggs_cache.last_run) + '\n')
+    if code == 0:
+        await _in_thread(save_state, paths, state)
+        if not args.get('--no-compile'):
+            await _in_thread(precompile_environment, args, paths)
+    return code
+
+async def buildstrap_async(args, output=None, timeout=None):
+    '''Runs buildstrap on a project, asynchronously
+
+    The ``run`` action generates the configuration in a worker thread, and runs
+    buildout as a subprocess (as ``buildstrap()`` does, skipping it when none
+    of its inputs changed, and installing the parts concurrently with
+    ``--parallel-parts``). Other actions (and ``run --update-lock``, which
+    locks the versions, cf ``buildstrap.versions``, or ``run`` on several
+    interpreters, cf ``buildstrap.matrix``) run ``buildstrap()`` in a worker
+    thread.
+
+    Args:
+        args: command line arguments, either as a list, or as parsed by docopt
+        output: callable given each line of buildout's output (defaults to
+            printing it)
+        timeout: maximum time to run, in seconds
+
+    Returns:
+        the exit code: 0 on success, the exit code of buildout otherwise
+
+    Raises:
+        asyncio.TimeoutError: when the timeout expired (buildout is then terminated)
+        ValueError: when the arguments do not match the usage
+    '''
+    if isinstance(args, (list, tuple)):
+        args = parse_args(args)
+    if args['run'] and not args.get('--update-lock') and ',' not in (args['--interpreter'] or ''):
+        coroutine = _run(args, output or print_output)
+    else:
+        coroutine = _in_thread(buildstrap, args)
+    if timeout is None:
+        return await coroutine
+    return await asyncio.wait_for(coroutine, timeout)
+
+async def gather_buildstrap(projects, jobs=None, output=None, timeout=None, return_exceptions=True):
+    '''Runs buildstrap on many projects concurrently
+
+    Args:
+        projects: list of the command line arguments of each project (cf
+            ``buildstrap_async()``)
+        jobs: maximum number of projects running at once (defaults to the
+            number of CPUs)
+        output: callable given the arguments of the project (as parsed by
+            docopt) and each line of its buildout's output (defaults to
+            printing the line, prefixed with the package's name)
+        timeout: maximum time to run each project, in seconds
+        return_exceptions: if set, the exceptions (e.g. timeouts) are given
+            as the results of the failing projects, instead of being raised
+
+    Returns:
+        list of the exit codes (or exceptions) of the projects, in the same order
+    '''
+    semaphore = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+
+    def prefixed(args):
+        return lambda line: print_output('{}: {}'.format(args['<package>'], line))
+
+    async def limited(args):
+        if isinstance(args, (list, tuple)):
+            args = parse_args(args)
+        async with semaphore:
+            project_output = partial(output, args) if output else prefixed(args)
+            return await buildstrap_async(args, project_output, timeout)
+
+    return await asyncio.gather(*(limited(args) for args in projects),
+                                return_exceptions=return_exceptions)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+'''
+Batch mode: generate the buildout configuration of many projects in one process
+
+The manifest is a JSON file, holding a list of projects, each project being
+an object such as::
+
+    {
+        "package": "marvin",
+        "requirements": ["requirements.txt", "requirements-test.txt"],
+        "parts": ["pytest"],
+        "root": "packages/marvin"
+    }
+
+where ``package`` and ``requirements`` can also be given as comma separated
+strings (like on the command line), and ``root`` is relative to the manifest's
+directory. The buildout configuration is generated within the project's root.
+Any other argument (``--interpreter``, ``--env``, ``--bin``, ``--config``,
+``--output``, ``--force`` and ``--resolve``) is taken from the command line and shared by all
+projects, but ``interpreter``, ``src``, ``env``, ``bin`` and ``output`` can be
+overridden within each project.
+'''
+
+import os, json
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from buildstrap.buildstrap import build_parts, build_part_template, generate_buildout_config, get_template_index
+
+POOLS = {
+    'process': ProcessPoolExecutor,
+    'thread': ThreadPoolExecutor,
+}
+
+def load_manifest(path):
+    '''Loads the list of projects from a manifest file
+
+    Project roots are made relative to the manifest's directory.
+
+    Args:
+        path: path to the JSON manifest
+
+    Returns:
+        list of project dicts
+
+    Raises:
+        ValueError: if the manifest is not a list of projects
+    '''
+    with open(path, 'r') as manifest_file:
+        projects = json.load(manifest_file)
+    if not isinstance(projects, list) or not all(isinstance(p, dict) for p in projects):
+        raise ValueError('Manifest {} shall be a list of projects.'.format(path))
+    base_path = os.path.dirname(os.path.abspath(path))
+    for project in projects:
+        project['root'] = os.path.join(base_path, project.get('root', '.'))
+    return projects
+
+def project_name(project):
+    '''Gives a name to a project, for reporting'''
+    package = project.get('package', '')
+    if isinstance(package, list):
+        package = package[0] if package else ''
+    return package.split(',')[0] or project.get('root', '?')
+
+def generate_project(project, defaults):
+    '''Builds the parts and generates the buildout configuration of one project
+
+    Args:
+        project: project dict, as given by the manifest
+        defaults: dict of defaults for the projects' options
+
+    Returns:
+        tuple of the project name, the path of the generated configuration, the
+        result of ``generate_buildout_config()`` (``'failed'`` on failure) and
+        ``None`` on success or the error message on failure
+    '''
+    name = project_name(project)
+    output = os.path.join(project['root'], project.get('output', defaults['output']))
+    try:
+        if 'package' not in project or 'requirements' not in project:
+            raise ValueError('a project needs both a package and requirements.')
+        parts = build_parts(
+                project['package'],
+                project['requirements'],
+                project.get('parts', []),
+                project.get('interpreter', defaults['interpreter']),
+                defaults['config'],
+                None,
+                project.get('src', defaults['src']),
+                project.get('env', defaults['env']),
+                project.get('bin', defaults['bin']),
+                defaults.get('resolve', False),
+                output_dir=os.path.dirname(output))
+        result = generate_buildout_config(parts, output, defaults['force'])
+        return name, output, result, None
+    except Exception as err:
+        return name, output, 'failed', str(err) or err.__class__.__name__
+
+def batch_generate(projects, defaults, jobs=None, pool='process'):
+    '''Generates the buildout configuration of a list of projects
+
+    All the part templates used by the projects are loaded once in the current
+    process before starting the workers, and the template index is saved, so
+    that the workers share the warm template index (whether forked, or reading
+    it back from its file).
+
+    Args:
+        projects: list of project dicts
+        defaults: dict of defaults for the projects' options
+        jobs: number of workers (defaults to the number of CPUs)
+        pool: kind of worker pool, ``process`` or ``thread``
+
+    Returns:
+        list of ``generate_project()`` results, in the projects' order
+
+    Raises:
+        ValueError: if the kind of pool is unknown
+    '''
+    if pool not in POOLS:
+        raise ValueError('Unknown pool kind {}, shall be one of: {}'.format(pool, ', '.join(POOLS)))
+
+    for template_name in sorted({t for p in projects for t in p.get('parts', [])}):
+        try:
+            build_part_template(template_name, defaults['config'])
+        except FileNotFoundError:
+            pass # reported by the failing projects
+    get_template_index().save()
+
+    with POOLS[pool](max_workers=jobs or os.cpu_count()) as executor:
+        futures = [executor.submit(generate_project, project, defaults) for project in projects]
+        return [future.result() for future in futures]
+
+def batch(args):
+    '''Runs the ``batch`` action, and prints a summary of every project
+
+    Args:
+        args: command line arguments, as parsed by docopt
+
+    Returns:
+        0 if all projects succeeded, 1 otherwise
+    '''
+    projects = load_manifest(args['<manifest>'])
+    defaults = {
+        'interpreter': args['--interpreter'],
+        'config': args['--config'],
+        'src': args['--src'],
+        'env': args['--env'],
+        'bin': args['--bin'],
+        'output': args['--output'],
+        'force': args['--force'],
+        'resolve': args.get('--resolve', False),
+    }
+    jobs = int(args['--jobs']) if args.get('--jobs') else None
+
+    results = batch_generate(projects, defaults, jobs, args.get('--pool') or 'process')
+
+    failures = 0
+    for name, output, result, error in results:
+        if error is None:
+            print('{:<9} {} ({})'.format(result, name, output))
+        else:
+            failures += 1
+            print('{:<9} {}: {}'.format(result, name, error))
+    print('{} projects, {} succeeded, {} failed'.format(len(results), len(results) - failures, failures))
+
+    return 1 if failures else 0
@@ -3,17 +3,41 @@
 '''
 Buildstrap: generate and run buildout in your projects ::
 
-    Usage: {} [-v...] [options] [run|show|debug|generate] [-p part...]<package> <requirements>...
+    Usage: {0} [-v...] [options] serve
+           {0} [-v...] [options] batch <manifest>
+           {0} [-v...] [options] templates compile [<directory>]
+           {0} [-v...] [options] store gc
+           {0} [-v...] [options] snapshot (save|restore) [-p part...] <package> <requirements>...
+           {0} [-v...] [options] [run|show|debug|generate|watch|lock] [-p part...]<package> <requirements>...
 
     Options:
         run                         run buildout once buildout.cfg has been generated
         show                        show the buildout.cfg (same as using `-o -`)
         debug                       print internal representation of buildout config
         generate                    create the buildout.cfg file (default action)
+        watch                       generate and run again whenever the requirements,
+                                    setup.py or the templates change
+        lock                        run buildout and pin the versions it picked
+                                    in the versions file
+        batch                       create the buildout.cfg file of every project
+                                    listed in the manifest
+        templates compile           pack the part templates of the directory (defaults
+                                    to the configuration directory) into a bundle
+        snapshot save               pack the environment in an archive named after
+                                    a hash of the requirements, interpreter and parts
+        snapshot restore            unpack the archive matching the project's inputs
+                                    in place of the environment
+        store gc                    drop the eggs of the egg store no environment
+                                    uses anymore
+        serve                       start a daemon serving the generate, show and
+                                    debug actions of the next invocations
         <package>                   use this name for the package being developed
         <requirements>              use this requirements file as main requirements
+        <manifest>                  JSON file listing the projects to generate
+        <directory>                 directory of part templates
         -p,--part <part>            choose part template to use (use "list" to show all)
-        -i,--interpreter <python>   use this python version
+        -i,--interpreter <python>   use this python version (comma separated list to
+                                    build one environment per interpreter)
         -o,--output <buildout.cfg>  file to output [default: buildout.cfg]
         -r,--root <path>            path to the project root (where buildout.cfg will
                                     be generated) (defaults to ./)
@@ -23,9 +47,52 @@ Buildstrap: generate and run buildout in your projects ::
                                     relative to directory if not absolute
         -b,--bin <path>             path to the bin directory [default: bin]
                                     relative to directory if not absolute
+        --installed <file>          buildout's installed parts file (defaults to
+                                    .installed.cfg) relative to root if not absolute
         -f,--force                  force overwrite output file if it exists
+        --merge                     update the sections and options generated by
+                                    buildstrap within the existing output file,
+                                    keeping the other ones
+        --format <format>           output debug and show as json (one document) or
+                                    jsonl (one section per line)
+        --parallel-parts            install the parts that do not depend on each other
+                                    concurrently (up to --jobs at once)
+        --always-run                run buildout even if none of its inputs changed
+                                    since the last successful run
+        --no-compile                do not precompile the eggs and developed sources
+                                    to bytecode once buildout ran
+        --versions <file>           file holding the pinned versions, extended by the
+                                    configuration once it exists [default: versions.cfg]
+                                    relative to the configuration file if not absolute
+        --update-lock               pick the versions again when locking (or running),
+                                    instead of keeping the pinned ones
+        --resolve                   resolve the requirements files within buildstrap
+                                    and write the eggs list in the configuration
+        --prefetch                  fetch the required distributions concurrently
+                                    before running buildout
+        --find-links <urls>         comma separated list of find-links locations
+                                    to prefetch distributions from
+        --index <url>               simple index to prefetch distributions from
+        --eggs-cache <path>         use this eggs directory, shared between projects
+                                    (e.g. ~/.cache/buildstrap/eggs)
+        --store <path>              share the eggs of the environments through this
+                                    content addressed store (store gc defaults to
+                                    ~/.cache/buildstrap/store)
+        --debounce <seconds>        time to wait for a burst of changes to settle
+                                    when watching [default: 0.5]
+        --timings                   report the time spent in each phase as JSON on stderr
+        --profile <file>            dump the profiling statistics of the invocation
+                                    in this file (to be read with pstats)
         -c,--config <path>          path to the configuration directory
                                     [default: ~/.config/buildstrap]
+        -j,--jobs <n>               number of parallel workers (defaults to the
+                                    number of CPUs)
+        --pool <kind>               kind of workers for batch: process or thread
+                                    [default: process]
+        --snapshots <path>          directory holding the snapshots archives
+                                    [default: ~/.cache/buildstrap/snapshots]
+        --socket <path>             socket of the daemon (defaults to $BUILDSTRAP_SOCKET
+                                    or $XDG_RUNTIME_DIR/buildstrap.sock)
         -v,--verbose                increase verbosity
         -h,--help                   show this message
         --version                   show version
@@ -34,20 +101,68 @@ For more detailed help, please read the documentation
 on https://readthedocs.org/buildstrap
 '''
 
-import os, sys
+import os, sys, io, json, hashlib
 
 from contextlib import contextmanager
+from contextvars import ContextVar
 from collections import OrderedDict
-from configparser import ConfigParser
-from pprint import pprint
-from docopt import docopt
 
-from zc.buildout.configparser import parse
-from zc.buildout.buildout import main as buildout
+from buildstrap.timings import timed
+from buildstrap.utils import atomic_write, directory_lock
 
-import pkg_resources
+# Heavy dependencies (``zc.buildout``, ``pkg_resources``, ``docopt``, ``pprint``)
+# are imported within the functions that need them, so actions that do not run
+# buildout (``generate``, ``show``, ``debug``) start as fast as possible.
 
-__version__ = pkg_resources.require('buildstrap')[0].version
+def get_version():
+    '''Looks up the installed version of buildstrap
+
+    The metadata lookup is expensive (``pkg_resources`` even more so), so it is
+    only done when the version is actually needed.
+
+    Returns:
+        the version string of the installed buildstrap distribution
+    '''
+    try:
+        from importlib.metadata import version
+    except ImportError: # pragma: no cover (python < 3.8)
+        import pkg_resources
+        return pkg_resources.require('buildstrap')[0].version
+    return version('buildstrap')
+
+def __getattr__(name):
+    '''Resolves ``__version__`` on first access (cf ``get_version()``)'''
+    if name == '__version__':
+        return get_version()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def parse(fp, fpname):
+    '''Parses a buildout configuration file using buildout's own parser
+
+    Importing ``zc.buildout.configparser`` loads the whole ``zc.buildout`` package,
+    so it is only done when a template actually needs to be parsed.
+
+    Args:
+        fp: file object to parse
+        fpname: name of the file (used for error reporting)
+
+    Returns:
+        dict representation of the parsed sections
+    '''
+    from zc.buildout.configparser import parse as buildout_parse
+    return buildout_parse(fp, fpname)
+
+def buildout(args):
+    '''Runs buildout with the given command line arguments
+
+    ``zc.buildout.buildout`` is only imported here, as the ``run`` action is
+    the only one needing it.
+
+    Args:
+        args: list of command line arguments given to buildout
+    '''
+    from zc.buildout.buildout import main
+    return main(args)
 
 class ListBuildout(list):
     '''Makes it possible to print a list the way buildout expects it.
@@ -68,21 +183,27 @@ class ListBuildout(list):
     method. The default behaviour is the same as the standard list. But when within
     the context of the ``generate_context`` method, it prints lists as multiline string,
     one value per line, the way buildout expects it.
+
+    The rendering state is held in a context variable, so it's scoped to the
+    thread (or asyncio task) that entered the context: configurations can be
+    generated concurrently, and contexts can be nested.
     '''
-    _generating_state = False
+    _generating_state = ContextVar('buildstrap_generating_state', default=False)
 
     @classmethod
     @contextmanager
     def generate_context(cls):
-        '''Context manager to change the string conversion behaviour on this class'''
-        cls._generating_state = True
-        yield
-        cls._generating_state = False
+        '''Context manager to change the string conversion behaviour within the current context'''
+        token = cls._generating_state.set(True)
+        try:
+            yield
+        finally:
+            cls._generating_state.reset(token)
 
     def __str__(self):
         '''Replaces standard behaviour of list string output, so it prints as buildout
         expects when generating the buildout file'''
-        if self._generating_state is True:
+        if self._generating_state.get() is True:
             if len(self) == 1:
                 return self[0]
             else:
@@ -137,31 +258,303 @@ def build_part_target(target, packages=list(), interpreter=None):
     return part
 
 
-def list_part_templates(config_path):
+class TemplateIndex:
+    '''Persistent index of the part templates
+
+    Listing the template directories and parsing each template on every run gets
+    costly with large template libraries (or ones living on a network share). This
+    index keeps, for each template directory, its mtime and the list of its
+    ``.part.cfg`` files, and for each of those files, its path, size, mtime and
+    parsed sections.
+
+    The index is stored as JSON in the user's cache directory, and refreshed
+    incrementally:
+
+    * a directory is only listed again when its mtime changed,
+    * a template is only parsed again when its size or mtime changed,
+    * directories that do not exist anymore are dropped from the index.
+
+    So listing and resolving parts is a cheap lookup most of the time, and the
+    index only holds the template directories still in use.
+
+    Args:
+        path: path to the index file (defaults to ``default_path()``)
+    '''
+    format_version = 1
+
+    def __init__(self, path=None):
+        self.path = path or self.default_path()
+        self._directories = None
+        self._dirty = False
+        self._bundles = {}
+
+    @staticmethod
+    def default_path():
+        '''Path to the index file, within the XDG cache directory'''
+        cache_path = os.environ.get('XDG_CACHE_HOME', os.path.join('~', '.cache'))
+        return os.path.join(os.path.expanduser(cache_path), 'buildstrap', 'templates.json')
+
+    @property
+    def directories(self):
+        '''dict of the indexed directories, loaded from disk on first access'''
+        if self._directories is None:
+            self._directories = {}
+            try:
+                with open(self.path, 'r') as index_file:
+                    content = json.load(index_file)
+                if content.get('version') == self.format_version:
+                    self._directories = content['directories']
+            except (OSError, ValueError, KeyError, AttributeError):
+                pass
+            self._prune()
+        return self._directories
+
+    def _prune(self):
+        '''Drops the directories that do not exist anymore'''
+        for path in [path for path in self._directories if not os.path.isdir(path)]:
+            del self._directories[path]
+            self._dirty = True
+
+    def save(self):
+        '''Writes the index to disk, if it has been changed
+
+        The directories that have been removed since they were indexed are
+        dropped. The index being a cache, failing to write it is not an error.
+        '''
+        if not self._dirty:
+            return
+        self._prune()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with atomic_write(self.path) as index_file:
+                json.dump({'version': self.format_version, 'directories': self.directories}, index_file)
+            self._dirty = False
+        except OSError:
+            pass
+
+    def directory(self, path):
+        '''Lists the files of a template directory
+
+        The directory is only listed if its mtime differs from the indexed one,
+        and entries of the files that are still there are kept.
+
+        Args:
+            path: path to the template directory
+
+        Returns:
+            dict of file name to file entry, or None if the directory does not exist
+        '''
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        path = os.path.abspath(path)
+        record = self.directories.get(path)
+        if record is None or record['mtime'] != mtime:
+            old_files = record['files'] if record else {}
+            files = OrderedDict()
+            for fname in sorted(os.listdir(path)):
+                files[fname] = old_files.get(fname, {'path': os.path.join(path, fname),
+                                                     'size': None,
+                                                     'mtime': None,
+                                                     'sections': None})
+            record = {'mtime': mtime, 'files': files}
+            self.directories[path] = record
+            self._dirty = True
+        return record['files']
+
+    def sections(self, entry, name):
+        '''Gets the parsed sections of a template file
+
+        The file is parsed again only if its size or mtime changed since it has
+        last been indexed.
+
+        Args:
+            entry: the file entry, as given by ``directory()``
+            name: name of the template
+
+        Returns:
+            dict representation of the template's sections
+
+        Raises:
+            FileNotFoundError if the template file does not exist anymore
+        '''
+        stat = os.stat(entry['path'])
+        if entry['sections'] is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            with open(entry['path'], 'r') as template_file:
+                entry['sections'] = parse(template_file, name)
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime_ns
+            self._dirty = True
+        return entry['sections']
+
+    def bundle(self, path):
+        '''Gets the templates of a directory's bundle, if it has one
+
+        A loaded bundle is kept in memory (not within the index file) until its
+        file changes. An invalid bundle is ignored, with a warning, so the
+        directory is used as if it had none. A bundle older than some of the
+        directory's templates is still used, but with a warning, as it has to be
+        compiled again to take their changes into account.
+
+        Args:
+            path: path to the template directory
+
+        Returns:
+            dict of file name to parsed sections (cf ``load_template_bundle()``),
+            or None if the directory has no valid bundle
+        '''
+        bundle_path = os.path.join(path, TEMPLATE_BUNDLE)
+        try:
+            stat = os.stat(bundle_path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = self._bundles.get(bundle_path)
+        if cached is None or cached[0] != key:
+            try:
+                templates = load_template_bundle(bundle_path)
+            except (OSError, ValueError) as err:
+                print('Warning: ignoring template bundle {}: {}'.format(bundle_path, err), file=sys.stderr)
+                templates = None
+            else:
+                newer = [fname for fname in sorted(os.listdir(path)) if fname.endswith('.part.cfg')
+                         and os.stat(os.path.join(path, fname)).st_mtime_ns > stat.st_mtime_ns]
+                if newer:
+                    print('Warning: template bundle {} is older than {}, compile it again with '
+                          '`buildstrap templates compile`'.format(bundle_path, ', '.join(newer)), file=sys.stderr)
+            cached = self._bundles[bundle_path] = (key, templates)
+        return cached[1]
+
+TEMPLATE_BUNDLE = 'templates.bundle'
+TEMPLATE_BUNDLE_FORMAT = ('buildstrap-templates', 1)
+
+def _bundle_digest(templates):
+    return hashlib.sha256(json.dumps(templates, sort_keys=True).encode('utf-8')).hexdigest()
+
+def compile_template_bundle(path):
+    '''Packs the part templates of a directory into a single bundle file
+
+    All the ``.part.cfg`` files of the directory are parsed, and their sections
+    are stored as JSON within the ``templates.bundle`` file of the directory,
+    along with the format of the bundle, and a digest of its content::
+
+        {"format": "buildstrap-templates", "version": 1, "digest": "…",
+         "templates": {"foo.part.cfg": {"foo": {"recipe": "bar"}}}}
+
+    Once compiled, the directory's templates are listed and resolved out of the
+    bundle, with a single read and no parsing, so the bundle has to be compiled
+    again whenever the templates change.
+
+    Args:
+        path: path to the template directory
+
+    Returns:
+        tuple of the path to the bundle, and the number of templates it holds
+    '''
+    templates = OrderedDict()
+    for fname in sorted(os.listdir(path)):
+        if fname.endswith('.part.cfg'):
+            with open(os.path.join(path, fname), 'r') as template_file:
+                templates[fname] = parse(template_file, fname.replace('.part.cfg', ''))
+    bundle_path = os.path.join(path, TEMPLATE_BUNDLE)
+    with atomic_write(bundle_path) as bundle_file:
+        json.dump(OrderedDict([
+            ('format', TEMPLATE_BUNDLE_FORMAT[0]),
+            ('version', TEMPLATE_BUNDLE_FORMAT[1]),
+            ('digest', _bundle_digest(templates)),
+            ('templates', templates),
+        ]), bundle_file)
+    return bundle_path, len(templates)
+
+def load_template_bundle(bundle_path):
+    '''Loads and validates a template bundle (cf ``compile_template_bundle()``)
+
+    Args:
+        bundle_path: path to the bundle file
+
+    Returns:
+        dict of each template's file name to its parsed sections
+
+    Raises:
+        ValueError: when the bundle is not valid, or of another format version
+    '''
+    with open(bundle_path, 'r') as bundle_file:
+        content = json.load(bundle_file)
+    if not isinstance(content, dict) or content.get('format') != TEMPLATE_BUNDLE_FORMAT[0]:
+        raise ValueError('not a template bundle')
+    if content.get('version') != TEMPLATE_BUNDLE_FORMAT[1]:
+        raise ValueError('unsupported bundle version {!r}, compile it again'.format(content.get('version')))
+    templates = content.get('templates')
+    if (not isinstance(templates, dict)
+            or not all(fname.endswith('.part.cfg') and isinstance(sections, dict)
+                       and all(isinstance(options, dict) for options in sections.values())
+                       for fname, sections in templates.items())):
+        raise ValueError('malformed templates')
+    if content.get('digest') != _bundle_digest(templates):
+        raise ValueError('digest mismatch')
+    return templates
+
+_template_index = None
+
+def get_template_index():
+    '''Gets the process wide template index (cf ``TemplateIndex``)
+
+    The index is saved when the process exits, if it has been changed.
+    '''
+    global _template_index
+    if _template_index is None:
+        import atexit
+        _template_index = TemplateIndex()
+        atexit.register(_template_index.save)
+    return _template_index
+
+def template_paths(config_path):
+    '''Gives the template directories, by order of precedence
+
+    Args:
+        config_path: path to the user's part template directory
+
+    Returns:
+        list with the user's template directory, then the package's one
+    '''
+    paths = []
+    if config_path:
+        paths.append(os.path.expanduser(config_path))
+    paths.append(os.path.join(os.path.dirname(__file__), 'templates'))
+    return paths
+
+def list_part_templates(config_path, index=None):
     '''Iterates over the available part templates
 
     Will get through both package's templates path and user config path to
-    check for ``.part.cfg`` files.
+    check for ``.part.cfg`` files. Directory listings come from the template
+    index, so they are only done again when a directory changed, and a directory
+    holding a template bundle is listed out of its bundle.
 
     Args:
         config_path: path to the user's part template directory
+        index: ``TemplateIndex`` to use (defaults to the process wide one)
 
     Returns:
         iterator over the list of templates
 
     '''
-    user_config_path = os.path.join(os.path.expanduser(config_path))
-    pkg_config_path = os.path.join(os.path.dirname(__file__), 'templates')
+    index = index or get_template_index()
 
     templates = []
-    if os.path.exists(pkg_config_path):
-        templates += os.listdir(os.path.join(pkg_config_path))
-        print('Using parts from {}'.format(pkg_config_path), file=sys.stderr)
-    if os.path.exists(user_config_path):
-        templates += os.listdir(user_config_path)
-        print('Using parts from {}'.format(user_config_path), file=sys.stderr)
+    for path in reversed(template_paths(config_path)):
+        files = index.bundle(path)
+        if files is None:
+            files = index.directory(path)
+        if files is not None:
+            templates += files.keys()
+            print('Using parts from {}'.format(path), file=sys.stderr)
+    index.save()
 
     for fname in templates:
+        if fname == TEMPLATE_BUNDLE:
+            continue
         if 'list' in fname:
             print('Warning: a part template named list.cfg exists, and cannot be called. Please change its name!', file=sys.stderr)
         if '.part.cfg' in fname:
@@ -169,7 +562,7 @@ def list_part_templates(config_path):
         else:
             print('Warning: file named {} does not end with .part.cfg and is ignored!'.format(fname), file=sys.stderr)
 
-def build_part_template(name, config_path):
+def build_part_template(name, config_path, index=None):
     '''Creates a part out of a template file
 
     Will resolve a part file based on its name, by looking through both package's
@@ -179,9 +572,16 @@ def build_part_template(name, config_path):
     and will be parsed, and then added to the buildout file *as is*. It will also be
     named with the ``.part.cfg`` extension.
 
+    The parsed template is taken from the template index, so the file is only parsed
+    again when it changed. The index is not saved, so resolving many templates
+    does not rewrite it each time (cf ``TemplateIndex.save()``). When a template
+    directory holds a bundle, the template is taken from the bundle instead (cf
+    ``compile_template_bundle()``).
+
     Args:
         name: name of the template file (without extension)
         config_path: directory where to look for the template file
+        index: ``TemplateIndex`` to use (defaults to the process wide one)
 
     Returns:
         dict representation of a part
@@ -189,29 +589,39 @@ def build_part_template(name, config_path):
     Raises:
         FileNotFoundError if no template can be found.
     '''
+    index = index or get_template_index()
     template_name = '{}.part.cfg'.format(name)
-    template_path = os.path.join(os.path.expanduser(config_path))
 
-    try:
-        template_file = open(template_path, 'r')
-    except FileNotFoundError:
-        try:
-            template_path = os.path.join(os.path.dirname(__file__), 'templates', template_name)
-            template_file = open(template_path, 'r')
-        except FileNotFoundError:
-            template_file = None
-
-    if not template_file:
+    sections = None
+    for path in template_paths(config_path):
+        bundle = index.bundle(path)
+        if bundle is not None:
+            if template_name in bundle:
+                sections = bundle[template_name]
+                break
+            continue
+        entry = (index.directory(path) or {}).get(template_name)
+        if entry is not None:
+            try:
+                sections = index.sections(entry, name)
+                break
+            except FileNotFoundError:
+                continue
+
+    if sections is None:
         raise FileNotFoundError('Missing template file {}.part.cfg in {}'.format(name, config_path))
 
-    res = parse(open(template_path, 'r'), name)
+    res = OrderedDict()
     # make items order predictible
-    for k,v in res.items():
+    for k,v in sections.items():
         if isinstance(v, dict):
-            res[k] = OrderedDict(sorted(v.items(), key=lambda t: t[0]))
+            v = OrderedDict(sorted(v.items(), key=lambda t: t[0]))
+        res[k] = v
     return res
 
-def build_part_buildout(root_path=None, src_path=None, env_path=None, bin_path=None):
+
+def build_part_buildout(root_path=None, src_path=None, env_path=None, bin_path=None, download_cache=False,
+        eggs_path=None, versions_file=None, installed_path=None):
     '''Generates the buildout part
 
     This part is the entry point of a buildout configuration file, setting up
@@ -249,11 +659,34 @@ def build_part_buildout(root_path=None, src_path=None, env_path=None, bin_path=N
     For parameter ``bin_path`` and ``env_path``, it will respectively change path to the
     generated ``bin`` directory and ``env`` directory, after running buildout.
 
+    When ``download_cache`` is set, buildout's download cache is setup within the
+    ``env`` directory, which is where distributions get prefetched::
+
+        download-cache=${buildout:directory}/var/downloads
+
+    Parameter ``eggs_path`` replaces the ``eggs-directory`` within the environment,
+    so several projects can share the same eggs directory (cf ``buildstrap.eggs``).
+
+    Parameter ``versions_file`` makes the configuration extend the file holding
+    the pinned versions (cf ``buildstrap.versions``), relative to the configuration::
+
+        extends=versions.cfg
+
+    Parameter ``installed_path`` moves buildout's installed parts file (which
+    defaults to ``.installed.cfg`` in the root), so several configurations can
+    be installed within the same root (cf ``buildstrap.matrix``)::
+
+        installed=${buildout:directory}/var/python3.12/.installed.cfg
+
     Args:
         root_path: path string to the root of the project (from which all other paths are relative to)
         src_path: path string to the sources (where ``setup.py`` is)
         env_path: path string to the environment (where dependencies are downloaded)
         bin_path: path string to the runnable scripts
+        download_cache: if set, setup the download cache within the environment
+        eggs_path: path string to a shared eggs directory
+        versions_file: path string to the versions file to extend
+        installed_path: path string to buildout's installed parts file
 
     Returns:
         the buildout part as a dict
@@ -274,17 +707,27 @@ def build_part_buildout(root_path=None, src_path=None, env_path=None, bin_path=N
     if not os.path.isabs(bin_path):
         bin_path = os.path.join('${buildout:directory}', bin_path)
     buildout['develop'] = src_path if src_path else '.'
-    buildout['eggs-directory'] = os.path.join(env_path, 'eggs')
+    buildout['eggs-directory'] = eggs_path if eggs_path else os.path.join(env_path, 'eggs')
     buildout['develop-eggs-directory'] = os.path.join(env_path, 'develop-eggs')
     buildout['parts-directory'] = os.path.join(env_path, 'parts')
     buildout['develop-dir'] = os.path.join(env_path, 'develop')
     buildout['bin-directory'] = bin_path
+    if download_cache:
+        buildout['download-cache'] = os.path.join(env_path, 'downloads')
+    if versions_file:
+        buildout['extends'] = versions_file
+    if installed_path:
+        if not os.path.isabs(installed_path):
+            installed_path = os.path.join('${buildout:directory}', installed_path)
+        buildout['installed'] = installed_path
     buildout['requirements'] = ListBuildout([])
     return {'buildout': buildout}
 
 
 def build_parts(packages, requirements, part_templates=[], interpreter=None, 
-        config_path=None, root_path='.', src_path=None, env_path=None, bin_path=None):
+        config_path=None, root_path='.', src_path=None, env_path=None, bin_path=None,
+        resolve=False, download_cache=False, eggs_path=None, versions_file=None, installed_path=None,
+        template_index=None, output_dir=None):
     '''Builds up the different parts of the buildout configuration
 
     this is the workhorse of this code. It will build and return an internal
@@ -347,6 +790,19 @@ def build_parts(packages, requirements, part_templates=[], interpreter=None,
     the static path within the package, or from ``config_path``, which defaults to
     the user's home config directory.
 
+    When ``resolve`` is set, the requirements files are parsed by buildstrap itself
+    (cf ``buildstrap.requirements``), following includes and merging duplicates,
+    and the resulting list of eggs is written as is, so buildout does not have
+    to parse them on every run::
+
+        [buildout]
+        …
+        requirements-eggs = docopt
+                zc.buildout>=2.5
+
+    The ``gp.vcsdevelop`` extension is then only kept when some requirements are
+    editable or VCS urls, given through the ``vcs-extend-develop`` value.
+
     Args:
         packages: the list of packages to target as first part (list or comma separated string)
         requirements: the list of requirements to target as first part (list or comma separated string)
@@ -357,9 +813,22 @@ def build_parts(packages, requirements, part_templates=[], interpreter=None,
         src_path: path string to the sources (where ``setup.py`` is)
         env_path: path string to the environment (where dependencies are downloaded)
         bin_path: path string to the runnable scripts
+        resolve: if set, resolve the requirements files within buildstrap
+        download_cache: if set, setup the download cache within the environment
+        eggs_path: path string to a shared eggs directory
+        versions_file: path string to the file holding the pinned versions
+        installed_path: path string to buildout's installed parts file
+        template_index: index of the part templates (defaults to the process wide
+            one, cf ``get_template_index()``)
+        output_dir: path string to the directory of the configuration file, which
+            the root path is relative to, where the requirements files are
+            resolved from (defaults to the current directory)
 
     Returns:
         OrderedDict instance configured with all parts.
+
+    Raises:
+        RequirementConflict: when resolving requirements that cannot be all satisfied
     '''
     parts = OrderedDict()
     targets = []
@@ -378,7 +847,8 @@ def build_parts(packages, requirements, part_templates=[], interpreter=None,
 
     first_part_name = packages[0]
 
-    parts.update(build_part_buildout(root_path, src_path, env_path, bin_path))
+    parts.update(build_part_buildout(root_path, src_path, env_path, bin_path, download_cache, eggs_path, versions_file,
+                                     installed_path))
 
     # build main package part
     parts.update(build_part_target(first_part_name, packages, interpreter))
@@ -386,53 +856,653 @@ def build_parts(packages, requirements, part_templates=[], interpreter=None,
 
     parts.update(build_part_target(first_part_name, packages, interpreter))
 
-    for template_name in part_templates or []:
-        parts[template_name] = build_part_template(template_name, config_path)[template_name]
-        targets.append(template_name)
-
-    for r in requirements:
-        parts['buildout']['requirements'] += ListBuildout([os.path.join('${buildout:develop}', r)])
+    with timed('templates'):
+        for template_name in part_templates or []:
+            parts[template_name] = build_part_template(template_name, config_path, template_index)[template_name]
+            targets.append(template_name)
+        if part_templates:
+            (template_index or get_template_index()).save()
+
+    if resolve:
+        from buildstrap.requirements import resolve_requirements
+        base_path = os.path.join(output_dir or '.', root_path or '.', src_path or '.')
+        resolved = resolve_requirements([os.path.join(base_path, r) for r in requirements])
+        del parts['buildout']['requirements']
+        parts['buildout']['requirements-eggs'] = ListBuildout(resolved.eggs)
+        if resolved.vcs:
+            parts['buildout']['vcs-extend-develop'] = ListBuildout(resolved.vcs)
+        else:
+            del parts['buildout']['extensions']
+    else:
+        for r in requirements:
+            parts['buildout']['requirements'] += ListBuildout([os.path.join('${buildout:develop}', r)])
     parts['buildout']['parts'] = ListBuildout(targets)
     parts['buildout']['package'] = ' '.join(packages)
 
     return parts
 
+def file_digest(path):
+    '''Computes the SHA-256 digest of a file's content
+
+    The content is hashed as bytes, so files in any encoding can be hashed (the
+    generated configuration being hashed as UTF-8 encoded bytes, cf
+    ``_DigestWriter``).
+
+    Args:
+        path: path to the file
+
+    Returns:
+        the hexadecimal digest string
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def format_option(value):
+    '''Formats an option's value the way buildout expects it
+
+    ``ListBuildout`` values are output one item per line, and any other value
+    is converted into a string, the same way ``ConfigParser`` does. Continuation
+    lines are indented.
+
+    Args:
+        value: value of the option
+
+    Returns:
+        the value, as to be written after the ``=``
+    '''
+    if isinstance(value, ListBuildout):
+        value = '\n'.join(value)
+    return str(value).replace('\n', '\n\t')
+
+def write_buildout_config(parts, out):
+    '''Writes the buildout configuration, streaming it out of the parts
+
+    Each option is written as soon as it is formatted, without copying the
+    whole configuration within a ``ConfigParser`` first. The output is the
+    same as the one of ``ConfigParser.write()`` after a ``read_dict(parts)``:
+    options' names are lower cased, and each section ends with an empty line.
+    Options parsed out of buildout's ``+=`` and ``-=`` assignments (named
+    ``option +`` and ``option -``) are written back as such.
+
+    Args:
+        parts: dict based representation of the buildout file to generate
+        out: file-like object to write the configuration to
+    '''
+    for section, options in parts.items():
+        out.write('[{}]\n'.format(section))
+        for key, value in options.items():
+            name = str(key).lower()
+            out.write('{}{}= {}\n'.format(name, '' if name.endswith((' +', ' -')) else ' ', format_option(value)))
+        out.write('\n')
+
+class _DigestWriter:
+    '''File-like object computing the digest of what is written to it'''
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data.encode('utf-8'))
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+def render_buildout_config(parts):
+    '''Renders the buildout configuration as a string
+
+    Args:
+        parts: dict based representation of the buildout file to generate
+
+    Returns:
+        the content of the buildout configuration file
+    '''
+    content = io.StringIO()
+    write_buildout_config(parts, content)
+    return content.getvalue()
+
 def generate_buildout_config(parts, output, force=False):
     '''Generates the buildout configuration
 
-    Using the custom ``ListBuildout`` context, lists will be printed as multilines.
-    If output is set to ``-`` it will print to stdout the file.
+    Lists given as ``ListBuildout`` will be printed as multilines (cf
+    ``write_buildout_config()``). If output is set to ``-`` it will print to
+    stdout the file.
+
+    When the output file exists, the digest of the configuration is computed
+    first, and the file is only written when its content differs, so its mtime
+    is left untouched when nothing changed. The file is written aside, then
+    renamed over the output, so it's never seen half written, and an advisory
+    lock on the output's directory is held from the check of the existing file
+    until it's written, so concurrent generations of the same configuration
+    happen one after the other (cf ``buildstrap.utils``).
 
     Args:
         parts: dict based representation of the buildout file to generate
         output: name of the file to output
         force: if set, it won't care whether the file exists
 
+    Returns:
+        ``None`` when printing to stdout, otherwise ``'created'`` when the file
+        did not exist, ``'updated'`` when it has been overwritten, or
+        ``'unchanged'`` when it already had the generated content.
+
     Raises:
         FileExistsError: when a file already exists.
     '''
-    with ListBuildout.generate_context():
-        parser = ConfigParser()
-        parser.read_dict(parts)
+    if output == '-':
+        write_buildout_config(parts, sys.stdout)
+        return
 
-        if output == '-':
-            parser.write(sys.stdout)
-            return
+    with directory_lock(os.path.dirname(os.path.abspath(output))):
+        return _write_buildout_config(parts, output, force)
 
-        if not force and os.path.exists(output):
+def _write_buildout_config(parts, output, force):
+    '''Writes the configuration file, unless it already has the generated content
+
+    To be called while holding the lock on the output's directory (cf
+    ``generate_buildout_config()``).
+    '''
+    result = 'created'
+    if os.path.exists(output):
+        digest = _DigestWriter()
+        write_buildout_config(parts, digest)
+        if file_digest(output) == digest.hexdigest():
+            return 'unchanged'
+        if not force:
             raise FileExistsError('\n'.join([
                     'Cannot overwrite {}: file already exists! Use --force if necessary.'.format(output),
                     'As a buildout configuration exists, you might want to run buildout directly!'
                     ]))
+        result = 'updated'
 
-        with open(output, 'w') as out:
-            parser.write(out)
+    with atomic_write(output) as out:
+        write_buildout_config(parts, out)
+    return result
+
+def merge_generate_buildout_config(parts, output):
+    '''Merges the generated parts within the existing configuration file, and writes it
+
+    The existing file is read, merged (cf ``merge_buildout_config()``) and
+    written back while holding the lock on the output's directory, so that
+    concurrent merges happen one after the other, each one merging within the
+    configuration written by the previous one.
+
+    Args:
+        parts: dict based representation of the generated configuration
+        output: path to the configuration file
+
+    Returns:
+        tuple of the merged configuration, and of the result of the generation
+        (cf ``generate_buildout_config()``)
+    '''
+    if output == '-':
+        return parts, generate_buildout_config(parts, output)
+    with directory_lock(os.path.dirname(os.path.abspath(output))):
+        parts = merge_buildout_config(parts, output)
+        return parts, _write_buildout_config(parts, output, force=True)
+
+# section of the merged configurations, recording the options buildstrap
+# generated within each of its sections (cf ``merge_parts()``)
+MERGE_SECTION = 'buildstrap'
+
+def merge_parts(existing, parts):
+    '''Merges the generated parts within an existing configuration
+
+    Buildstrap owns the sections it generates, and the options it generates
+    within them: those are updated, while other sections and options are kept
+    as they are, in their order. New sections and options are added after the
+    existing ones. The options that buildstrap generated on the previous merge
+    but does not generate anymore (e.g. ``requirements-eggs`` when not
+    resolving anymore, or an option removed from a part template) are removed,
+    as are the sections left empty (e.g. the part of a template that is not
+    selected anymore), and the ``parts`` option keeps the existing parts that
+    are still defined by a kept section. The generated options are recorded
+    within the ``[buildstrap]`` section, one option per section, so options
+    written by hand (such as ``extends``) are always kept.
+
+    Args:
+        existing: dict representation of the existing configuration, as parsed
+            by ``parse()``
+        parts: dict based representation of the generated configuration
+
+    Returns:
+        OrderedDict of the merged configuration
+    '''
+    generated_before = {section: set(keys.split()) for section, keys in existing.get(MERGE_SECTION, {}).items()}
+    merged = OrderedDict()
+    for section, options in existing.items():
+        generated = parts.get(section, {})
+        removed = generated_before.get(section, set()) - set(generated)
+        merged_options = OrderedDict()
+        for key, value in options.items():
+            if key in generated:
+                merged_options[key] = generated[key]
+            elif key not in removed:
+                merged_options[key] = value
+        for key, value in generated.items():
+            merged_options.setdefault(key, value)
+        if merged_options or section in parts or not removed:
+            merged[section] = merged_options
+    for section, options in parts.items():
+        if section not in merged:
+            merged[section] = OrderedDict(options)
+
+    targets = format_option(merged['buildout'].get('parts', '')).split()
+    kept = [part for part in existing.get('buildout', {}).get('parts', '').split()
+            if part not in targets and part not in parts and part in merged]
+    if kept:
+        merged['buildout']['parts'] = ListBuildout(targets + kept)
+    merged[MERGE_SECTION] = OrderedDict((section, ListBuildout(list(options)))
+                                        for section, options in parts.items() if section != MERGE_SECTION)
+    return merged
+
+def merge_buildout_config(parts, output):
+    '''Merges the generated parts within the existing configuration file, if any
+
+    The existing configuration is parsed with buildout's own parser (so its
+    comments are not kept), and merged with the generated parts (cf
+    ``merge_parts()``). Parts left unchanged keep the very same options, so
+    buildout does not install them again. The file is read without holding
+    any lock: to write the merged configuration back, use
+    ``merge_generate_buildout_config()``.
+
+    Args:
+        parts: dict based representation of the generated configuration
+        output: path to the configuration file
+
+    Returns:
+        the merged configuration, or ``parts`` when printing to stdout (when the
+        file does not exist, ``parts`` along with the record of the options
+        generated, so the next merge removes those not generated anymore)
+    '''
+    if output == '-':
+        return parts
+    existing = {}
+    if os.path.exists(output):
+        with open(output, 'r') as config_file:
+            existing = parse(config_file, output)
+    return merge_parts(existing, parts)
+
+def project_paths(output, root_path=None, src_path=None, env_path=None, bin_path=None, installed_path=None):
+    '''Resolves the paths of a project, the way buildout will
+
+    The root path defaults to the directory of the buildout configuration file,
+    and the other paths are relative to the root path if not absolute (cf
+    ``build_part_buildout()``).
+
+    Args:
+        output: path to the buildout configuration file
+        root_path: path string to the root of the project
+        src_path: path string to the sources (where ``setup.py`` is)
+        env_path: path string to the environment (where dependencies are downloaded)
+        bin_path: path string to the runnable scripts
+        installed_path: path string to buildout's installed parts file
+
+    Returns:
+        dict with the ``root``, ``src``, ``env`` and ``bin`` paths, the
+        ``config`` directory (holding the configuration file) and the
+        ``installed`` parts file
+    '''
+    config_path = os.path.dirname(os.path.abspath(output))
+    root_path = root_path or config_path
+    return {
+        'config': config_path,
+        'root': root_path,
+        'src': os.path.join(root_path, src_path or '.'),
+        'env': os.path.join(root_path, env_path or 'var'),
+        'bin': os.path.join(root_path, bin_path or 'bin'),
+        'installed': os.path.join(root_path, installed_path or '.installed.cfg'),
+    }
+
+def paths_from_args(args):
+    '''Resolves the paths of a project out of the command line arguments (cf ``project_paths()``)'''
+    return project_paths(args['--output'], args['--root'], args['--src'], args['--env'], args['--bin'],
+                         args.get('--installed'))
+
+def interpreter_version(executable):
+    '''Gives the version of a python interpreter (its ``sys.version``)'''
+    import subprocess
+    return subprocess.run([executable, '-c', 'import sys; print(sys.version)'], stdout=subprocess.PIPE,
+                          check=True, universal_newlines=True).stdout.strip()
+
+def build_fingerprint(parts, requirements, part_templates, paths, executable=None):
+    '''Fingerprints all the inputs of a buildout run
+
+    The fingerprint covers the requirements files (and the files they include),
+    the ``setup.py`` of the project, the selected part templates, the python
+    interpreter, the generated configuration and the files it extends (such as
+    the pinned versions).
+
+    Args:
+        parts: dict based representation of the buildout configuration
+        requirements: the list of requirements files (list or comma separated string)
+        part_templates: list of the part templates in use
+        paths: dict of the project paths, as given by ``project_paths()``
+        executable: python interpreter running buildout (defaults to the running one)
+
+    Returns:
+        dict of each input to its digest
+    '''
+    def digest(path):
+        try:
+            return file_digest(path)
+        except FileNotFoundError:
+            return None
+
+    from buildstrap.requirements import requirements_files
+
+    if not isinstance(requirements, list):
+        requirements = requirements.split(',')
+    requirements = requirements_files([os.path.join(paths['src'], r) for r in requirements])
+
+    fingerprint = {
+        'config': hashlib.sha256(render_buildout_config(parts).encode('utf-8')).hexdigest(),
+        'setup.py': digest(os.path.join(paths['src'], 'setup.py')),
+        'requirements': {r: digest(r) for r in requirements},
+        'templates': {t: hashlib.sha256(json.dumps(parts[t], sort_keys=True).encode('utf-8')).hexdigest()
+                        for t in part_templates or []},
+        'interpreter': [executable, interpreter_version(executable)] if executable else [sys.executable, sys.version],
+    }
+    extends = format_option(parts['buildout'].get('extends', '')).split()
+    if extends:
+        config_path = paths.get('config', paths['root'])
+        fingerprint['extends'] = {e: digest(os.path.join(config_path, e)) for e in extends}
+    return fingerprint
+
+def state_path(paths):
+    '''Path to the file holding the state of the last successful run'''
+    return os.path.join(paths['env'], '.buildstrap-state.json')
+
+def load_state(paths):
+    '''Loads the state of the last successful run
+
+    Args:
+        paths: dict of the project paths, as given by ``project_paths()``
+
+    Returns:
+        the state dict, empty if there's no usable state
+    '''
+    try:
+        with open(state_path(paths), 'r') as state_file:
+            state = json.load(state_file)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def save_state(paths, state):
+    '''Stores the state of the last successful run within the environment directory
+
+    Args:
+        paths: dict of the project paths, as given by ``project_paths()``
+        state: the state dict to store
+    '''
+    os.makedirs(paths['env'], exist_ok=True)
+    with atomic_write(state_path(paths)) as state_file:
+        json.dump(state, state_file, indent=2, sort_keys=True)
+
+def resolve_requirements_from_args(args, paths):
+    '''Resolves the requirements files given on the command line (cf ``buildstrap.requirements``)
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        paths: dict of the project paths, as given by ``project_paths()``
+
+    Returns:
+        the ``Requirements`` instance
+    '''
+    from buildstrap.requirements import resolve_requirements
+
+    requirements = args['<requirements>']
+    if not isinstance(requirements, list):
+        requirements = requirements.split(',')
+    return resolve_requirements([os.path.join(paths['src'], r) for r in requirements])
+
+def prefetch_requirements(args, paths, options=None):
+    '''Resolves the requirements, and prefetches their distributions in the download cache
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        paths: dict of the project paths, as given by ``project_paths()``
+        options: options of the generated ``[buildout]`` section
+    '''
+    from buildstrap.prefetch import prefetch
+
+    resolved = resolve_requirements_from_args(args, paths)
+    statuses = prefetch(resolved, paths,
+                        args['--find-links'].split(',') if args.get('--find-links') else None,
+                        args.get('--index'),
+                        int(args['--jobs']) if args.get('--jobs') else None,
+                        os.path.abspath(os.path.expanduser(args['--eggs-cache'])) if args.get('--eggs-cache') else None,
+                        options)
+    if args['--verbose']:
+        for name, status in sorted(statuses.items()):
+            print('Prefetch {}: {}'.format(name, status), file=sys.stderr)
+
+def build_parts_from_args(args, merge=True):
+    '''Builds the parts out of the command line arguments (cf ``build_parts()``)
+
+    The configuration extends the versions file (cf ``--versions``) once it
+    exists, unless the pinned versions are being updated. With ``--merge``, the
+    parts are merged within the existing configuration (cf ``merge_parts()``),
+    unless ``merge`` is unset.
+    '''
+    versions_file = None
+    if args.get('--versions') and not args.get('--update-lock'):
+        from buildstrap.versions import lock_path
+        if os.path.exists(lock_path(args)):
+            versions_file = args['--versions']
+    parts = build_parts(
+            args['<package>'],
+            args['<requirements>'],
+            args['--part'],
+            args['--interpreter'],
+            args['--config'],
+            args['--root'],
+            args['--src'],
+            args['--env'],
+            args['--bin'],
+            args.get('--resolve', False),
+            args.get('--prefetch', False),
+            os.path.abspath(os.path.expanduser(args['--eggs-cache'])) if args.get('--eggs-cache') else None,
+            versions_file,
+            args.get('--installed'),
+            output_dir=os.path.dirname(args['--output']) if args['--output'] != '-' else None)
+    if merge and args.get('--merge'):
+        parts = merge_buildout_config(parts, args['--output'])
+    return parts
+
+def generate_from_args(args, force=False):
+    '''Builds the parts out of the command line arguments, and generates the configuration
+
+    With ``--merge``, the parts are merged within the existing configuration
+    while holding its lock (cf ``merge_generate_buildout_config()``).
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        force: if set, overwrites the configuration file if it exists (as
+            ``--force`` and ``--merge`` do)
+
+    Returns:
+        tuple of the parts (cf ``build_parts_from_args()``) and of the result of
+        ``generate_buildout_config()``
+    '''
+    with timed('parts'):
+        parts = build_parts_from_args(args, merge=False)
+    with timed('generate'):
+        if args.get('--merge'):
+            parts, result = merge_generate_buildout_config(parts, args['--output'])
+        else:
+            result = generate_buildout_config(parts, args['--output'], force or args['--force'])
+    return parts, result
+
+def prepare_run(args, parts):
+    '''Prepares a buildout run on the generated configuration
+
+    Buildout is skipped when none of its inputs changed since the last successful
+    run (unless ``--always-run`` is given), and the distributions are prefetched
+    with ``--prefetch``.
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        parts: dict based representation of the buildout configuration
+
+    Returns:
+        tuple of the project paths, the state and the fingerprint of the run (to
+        be saved once it succeeded, cf ``save_state()``), or None when buildout
+        does not need to run
+    '''
+    paths = paths_from_args(args)
+    with timed('fingerprint'):
+        state = load_state(paths)
+        fingerprint = build_fingerprint(parts, args['<requirements>'], args['--part'], paths,
+                                        args.get('--executable'))
+    if (not args.get('--always-run') and state.get('fingerprint') == fingerprint
+            and os.path.isdir(paths['bin'])):
+        print('Nothing changed since last run, skipping buildout (use --always-run to force it).',
+                file=sys.stderr)
+        return None
+
+    if args.get('--prefetch'):
+        with timed('prefetch'):
+            prefetch_requirements(args, paths, parts['buildout'])
+    state['fingerprint'] = fingerprint
+    return paths, state, fingerprint
+
+def run_buildout(args, parts):
+    '''Runs buildout on the generated configuration
+
+    The run is prepared by ``prepare_run()``, and with ``--eggs-cache``, eggs
+    are installed while holding the lock of the shared eggs directory. With ``--parallel-parts``,
+    independent parts are installed concurrently (cf ``buildstrap.parallel``),
+    and with ``--store``, the eggs are shared through the egg store (cf
+    ``egg_store_session()``). Once buildout succeeded, the environment is
+    compiled to bytecode, unless ``--no-compile`` is given (cf
+    ``precompile_environment()``).
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        parts: dict based representation of the buildout configuration
+    '''
+    prepared = prepare_run(args, parts)
+    if prepared is None:
+        return
+    paths, state, _ = prepared
+
+    def install(lock_path=None):
+        if args.get('--parallel-parts'):
+            import asyncio
+            from buildstrap.parallel import install_parts
+            asyncio.run(install_parts(args['--output'], parts, paths,
+                                      int(args['--jobs']) if args.get('--jobs') else None,
+                                      lock_path=lock_path))
+        else:
+            buildout(['-c', args['--output']])
+
+    with timed('buildout'), buildout_instrumentation(args), egg_store_session(args, paths, parts):
+        if args.get('--eggs-cache'):
+            from buildstrap.eggs import EggsCache, format_run, install_lock
+            eggs_cache = EggsCache(args['--eggs-cache'], parts['buildout'])
+            with eggs_cache.session(paths['bin']), install_lock(eggs_cache.lock_path):
+                install(eggs_cache.lock_path)
+            if args['--verbose']:
+                print(format_run(eggs_cache.last_run), file=sys.stderr)
+        else:
+            install()
+    save_state(paths, state)
+    if not args.get('--no-compile'):
+        with timed('compile'):
+            precompile_environment(args, paths)
+
+def precompile_environment(args, paths):
+    '''Compiles the eggs and the developed sources to bytecode (cf ``buildstrap.bytecode``)
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        paths: dict of the project paths, as given by ``project_paths()``
+    '''
+    from buildstrap.bytecode import develop_paths, format_run, precompile
+    if args.get('--eggs-cache'):
+        eggs_path = os.path.abspath(os.path.expanduser(args['--eggs-cache']))
+    else:
+        eggs_path = os.path.join(paths['env'], 'eggs')
+    roots = [eggs_path] + develop_paths(os.path.join(paths['env'], 'develop-eggs'))
+    run = precompile([root for root in roots if os.path.exists(root)], [paths['env'], paths['bin']],
+                     int(args['--jobs']) if args.get('--jobs') else None, args.get('--executable'))
+    if args['--verbose']:
+        print(format_run(run), file=sys.stderr)
+
+def run_requirements(args, paths, parts):
+    '''Lists the requirements of a run, so the egg store links the eggs they need
+
+    Those are the requirements files', and the eggs, recipes and extensions
+    given within the generated configuration.
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        paths: dict of the project paths, as given by ``project_paths()``
+        parts: dict of the generated configuration's sections
+
+    Returns:
+        list of requirements (e.g. ``foo[bar]>=1.0``)
+    '''
+    def values(value):
+        return value if isinstance(value, list) else str(value).split()
+
+    requirements = list(resolve_requirements_from_args(args, paths).eggs)
+    for name, section in parts.items():
+        if name == MERGE_SECTION or not isinstance(section, dict):
+            continue
+        if section.get('recipe'):
+            requirements.append(str(section['recipe']).split(':')[0])
+        for key in ('eggs', 'extensions'):
+            requirements += [egg for egg in values(section.get(key, [])) if '$' not in egg]
+    return requirements
+
+@contextmanager
+def egg_store_session(args, paths, parts):
+    '''Shares the eggs of the run through the egg store with ``--store`` (cf ``buildstrap.store``)
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        paths: dict of the project paths, as given by ``project_paths()``
+        parts: dict of the generated configuration's sections
+    '''
+    if not args.get('--store'):
+        yield
+        return
+    from buildstrap.eggs import eggs_directory
+    from buildstrap.store import EggStore, format_run
+    egg_store = EggStore(args['--store'])
+    if args.get('--eggs-cache'):
+        eggs_path = os.path.abspath(os.path.expanduser(args['--eggs-cache']))
+    else:
+        eggs_path = os.path.join(paths['env'], 'eggs')
+    with egg_store.session(eggs_directory(eggs_path, parts['buildout']), paths['bin'],
+                           run_requirements(args, paths, parts)):
+        yield
+    if args['--verbose']:
+        print(format_run(egg_store.last_run), file=sys.stderr)
+
+@contextmanager
+def buildout_instrumentation(args):
+    '''Times buildout's own phases when ``--timings`` is given'''
+    if args.get('--timings'):
+        from buildstrap.timings import buildout_phases
+        with buildout_phases():
+            yield
+    else:
+        yield
 
 def buildstrap(args):
     '''Parses the command line arguments, build the parts, generate the config and runs buildout
 
     refer to the __doc__ of this module for all arguments.
 
+    With ``--timings``, the time spent within each phase is reported as JSON on
+    stderr, and with ``--profile``, the whole invocation is profiled (cf
+    ``buildstrap.timings``).
+
     Args:
         args: arguments to parse
 
@@ -443,30 +1513,11 @@ def buildstrap(args):
         if args['--verbose'] >= 2: # pragma: no cover
             print(args, file=sys.stderr)
 
-        parts = build_parts(
-                args['<package>'],
-                args['<requirements>'],
-                args['--part'],
-                args['--interpreter'],
-                args['--config'],
-                args['--root'],
-                args['--src'],
-                args['--env'],
-                args['--bin'])
-
-        if args['debug']:
-            pprint(parts)
-            return 0
-
-        if args['show']:
-            args['--output'] = '-'
-
-        generate_buildout_config(parts, args['--output'], args['--force'])
-
-        if args['run']:
-            buildout(['-c', args['--output']])
-
-        return 0
+        if args.get('--timings') or args.get('--profile'):
+            from buildstrap.timings import instrument
+            with instrument(args.get('--timings'), args.get('--profile')):
+                return _buildstrap(args)
+        return _buildstrap(args)
     except Exception as err: # pragma: no cover
         print('Fatal error: {}'.format(err), file=sys.stderr)
         if args['--verbose']:
@@ -475,11 +1526,88 @@ def buildstrap(args):
             traceback.print_exc()
         return 1
 
+def _buildstrap(args):
+    '''Runs the action given by the command line arguments (cf ``buildstrap()``)'''
+    if args.get('batch'):
+        from buildstrap.batch import batch
+        return batch(args)
+
+    if args.get('templates'):
+        bundle_path, count = compile_template_bundle(os.path.expanduser(args['<directory>'] or args['--config']))
+        print('Compiled {} templates into {}'.format(count, bundle_path), file=sys.stderr)
+        return 0
+
+    if args.get('snapshot'):
+        from buildstrap.snapshot import snapshot
+        return snapshot(args)
+
+    if args.get('store'):
+        from buildstrap.store import store
+        return store(args)
+
+    if args.get('serve'):
+        from buildstrap.server import serve
+        return serve(args.get('--socket'), args['--verbose'])
+
+    if ',' in (args.get('--interpreter') or ''):
+        from buildstrap.matrix import matrix
+        return matrix(args)
+
+    if args.get('watch'):
+        from buildstrap.watch import watch
+        return watch(args)
+
+    if args.get('lock') or (args['run'] and args.get('--update-lock')):
+        from buildstrap.versions import lock
+        return lock(args)
+
+    if args['debug'] or args['show']:
+        with timed('parts'):
+            parts = build_parts_from_args(args)
+
+        if args.get('--format'):
+            from buildstrap.formats import write_parts
+            write_parts(parts, sys.stdout, args['--format'], 'debug' if args['debug'] else 'show')
+        elif args['debug']:
+            from pprint import pprint
+            pprint(parts)
+        else:
+            with timed('generate'):
+                generate_buildout_config(parts, '-')
+        return 0
+
+    parts, result = generate_from_args(args)
+    if result and args['--verbose']:
+        print('{}: {}'.format(args['--output'], result), file=sys.stderr)
+
+    if args['run']:
+        with timed('run'):
+            run_buildout(args, parts)
+
+    return 0
+
+
+class _VersionBanner:
+    '''Version string given to docopt, only looked up when it gets printed'''
+    def __str__(self):
+        return 'Buildstrap v{}'.format(get_version())
 
 def run(): # pragma: no cover
-    '''Parses arguments, gets current command name and version number'''
+    '''Parses arguments, gets current command name and version number
+
+    When a daemon is running (cf ``buildstrap.server``), the arguments are
+    forwarded to it instead.
+    '''
+    if not os.environ.get('BUILDSTRAP_NO_DAEMON'):
+        from buildstrap.server import forward
+        response = forward(sys.argv[1:], prog=os.path.basename(sys.argv[0]))
+        if response is not None:
+            sys.stdout.write(response['stdout'])
+            sys.stderr.write(response['stderr'])
+            sys.exit(response['code'])
+    from docopt import docopt
     sys.exit(buildstrap(docopt(__doc__.format(os.path.basename(sys.argv[0])),
-        version='Buildstrap v{}'.format(__version__))))
+        version=_VersionBanner())))
 
 
 if __name__ == "__main__": # pragma: no cover
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+'''
+Precompilation of the environment's bytecode
+
+Buildout installs the eggs without compiling them, so the first launch of the
+scripts compiles every module it imports, which makes the first run of the
+tests noticeably slower (and happens again on each new CI agent). After
+``run``, buildstrap compiles the eggs and the developed sources (the packages
+of the projects linked within the ``develop-eggs`` directory, cf
+``develop_paths()``) on a pool of processes, unless ``--no-compile`` is given.
+
+Files whose bytecode is current (as checked by the import system, cf
+``is_current()``) are skipped, so following runs only compile what changed.
+The bytecode is compiled for the interpreter running buildstrap, or for the
+interpreter the environment is built for (cf ``buildstrap.matrix``), by running
+this module on it: it only depends on the standard library.
+'''
+
+import os, sys, glob, json, subprocess, py_compile, importlib.util
+
+from concurrent.futures import ProcessPoolExecutor
+
+# below that many files to compile, starting the pool costs more than it saves
+POOL_THRESHOLD = 64
+
+def egg_packages(path):
+    '''Lists the packages and modules of a developed project, out of its ``.egg-info`` metadata
+
+    The top level packages are read from ``top_level.txt``, or else the sources
+    are read from ``SOURCES.txt`` (relative to the project's ``setup.py``, which
+    may be the parent of the linked directory, for a ``src`` layout).
+
+    Args:
+        path: path to the directory linked by the ``.egg-link`` file
+
+    Returns:
+        list of the paths of the packages directories and modules, empty when
+        the project has no metadata
+    '''
+    sources = []
+    for egg_info in sorted(glob.glob(os.path.join(path, '*.egg-info'))):
+        try:
+            with open(os.path.join(egg_info, 'top_level.txt'), 'r') as top_level_file:
+                names = [line.strip() for line in top_level_file if line.strip()]
+            candidates = [os.path.join(path, name.replace('/', os.sep)) for name in names]
+            candidates += [candidate + '.py' for candidate in candidates]
+        except OSError:
+            try:
+                with open(os.path.join(egg_info, 'SOURCES.txt'), 'r') as sources_file:
+                    names = [line.strip() for line in sources_file if line.strip().endswith('.py')]
+            except OSError:
+                continue
+            candidates = [os.path.join(base, name) for base in (path, os.path.dirname(path)) for name in names]
+        for candidate in candidates:
+            if os.path.exists(candidate) and candidate not in sources:
+                sources.append(candidate)
+    return sources
+
+def develop_paths(develop_eggs_path):
+    '''Lists the developed sources, out of the ``.egg-link`` files of the develop-eggs directory
+
+    Only the packages and modules of each developed project are listed (cf
+    ``egg_packages()``), rather than the whole linked directory, which usually
+    is the project's checkout, holding its tests, documentation and environment.
+    '''
+    sources = []
+    if not os.path.isdir(develop_eggs_path):
+        return sources
+    for name in sorted(os.listdir(develop_eggs_path)):
+        if not name.endswith('.egg-link'):
+            continue
+        with open(os.path.join(develop_eggs_path, name), 'r') as link_file:
+            path = link_file.readline().strip()
+        if path and os.path.isdir(path):
+            sources.extend(egg_packages(os.path.abspath(path)))
+    return sources
+
+def source_files(roots, excluded=()):
+    '''Lists the python sources within directories
+
+    Hidden directories, ``__pycache__`` directories and the excluded paths
+    (such as the environment, when the sources hold it) are not walked into.
+
+    Args:
+        roots: list of the directories to walk (or of single modules)
+        excluded: paths of the directories to leave out
+
+    Returns:
+        list of the paths of the ``.py`` files, each listed once
+    '''
+    excluded = {os.path.abspath(path) for path in excluded}
+    seen = set()
+    files = []
+    for root in roots:
+        if os.path.isfile(root):
+            if root.endswith('.py') and root not in seen:
+                seen.add(root)
+                files.append(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.') and d != '__pycache__'
+                           and os.path.join(dirpath, d) not in excluded]
+            for fname in filenames:
+                path = os.path.join(dirpath, fname)
+                if fname.endswith('.py') and path not in seen:
+                    seen.add(path)
+                    files.append(path)
+    return files
+
+def is_current(path):
+    '''Tells whether the bytecode of a source is current, the way the import system checks it
+
+    Returns:
+        True if the cached bytecode matches the source's modification time and
+        size (or its hash, for hash based bytecode)
+    '''
+    try:
+        with open(importlib.util.cache_from_source(path), 'rb') as pyc_file:
+            header = pyc_file.read(16)
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if len(header) != 16 or header[:4] != importlib.util.MAGIC_NUMBER:
+        return False
+    flags = int.from_bytes(header[4:8], 'little')
+    if flags & 0b1:
+        with open(path, 'rb') as source_file:
+            return header[8:16] == importlib.util.source_hash(source_file.read())
+    return (int.from_bytes(header[8:12], 'little') == int(stat.st_mtime) & 0xFFFFFFFF
+            and int.from_bytes(header[12:16], 'little') == stat.st_size & 0xFFFFFFFF)
+
+def compile_file(path):
+    '''Compiles a source to its cached bytecode
+
+    Returns:
+        None on success, the error message otherwise
+    '''
+    try:
+        py_compile.compile(path, doraise=True)
+    except (py_compile.PyCompileError, OSError, ValueError) as err:
+        return str(err)
+    return None
+
+def precompile(roots, excluded=(), jobs=None, executable=None):
+    '''Compiles the bytecode of the python sources within directories
+
+    Args:
+        roots: list of the directories holding the sources (or of single modules)
+        excluded: paths of the directories to leave out
+        jobs: number of worker processes (defaults to the number of CPUs)
+        executable: python interpreter to compile the bytecode for (defaults to
+            the running one), this module then runs on it as a subprocess
+
+    Returns:
+        dict with the number of ``compiled`` files, of files already ``current``
+        and of the files that ``failed`` to compile (such as sources of other
+        python versions shipped within eggs)
+    '''
+    if executable:
+        # isolated, so the directory of this module does not shadow any other
+        output = subprocess.run([executable, '-I', os.path.abspath(__file__),
+                                 json.dumps({'roots': list(roots), 'excluded': list(excluded), 'jobs': jobs})],
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        return json.loads(output)
+    files = source_files(roots, excluded)
+    stale = [path for path in files if not is_current(path)]
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(stale) >= POOL_THRESHOLD:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            errors = list(executor.map(compile_file, stale, chunksize=max(1, len(stale) // (jobs * 4))))
+    else:
+        errors = [compile_file(path) for path in stale]
+    failed = sum(1 for error in errors if error is not None)
+    return {'compiled': len(stale) - failed, 'current': len(files) - len(stale), 'failed': failed}
+
+def format_run(run):
+    '''Formats the statistics of a precompilation, as given by ``precompile()``'''
+    return 'Bytecode: compiled {} files, {} already current, {} failed'.format(
+            run['compiled'], run['current'], run['failed'])
+
+if __name__ == '__main__': # pragma: no cover (run by precompile(), on another interpreter)
+    options = json.loads(sys.argv[1])
+    print(json.dumps(precompile(options['roots'], options['excluded'], options['jobs'])))
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+'''
+Shared eggs cache
+
+By default, each project has its own eggs directory, so the same eggs get
+downloaded and unpacked once per checkout. Using a shared eggs directory (a
+user wide or machine wide one) avoids that.
+
+As several ``buildstrap run`` can be using the shared directory at once, eggs
+are installed (or built) while holding an exclusive lock on the directory (cf
+``install_lock()``), so runs only wait for each other while one of them is
+writing to the cache. The eggs reused from the cache are accounted for, in a
+statistics file within the directory, so you know how much disk and time the
+sharing saved.
+
+Since zc.buildout 5, the eggs are not directly within the eggs directory, but
+within a subdirectory of it (cf ``eggs_directory()``).
+'''
+
+import os, re, json, time
+
+from contextlib import contextmanager
+
+from buildstrap.utils import atomic_write, file_lock, tree_size
+
+# runs buildout (given the lock path, then buildout's arguments), installing and
+# building eggs while holding the lock; self contained, so that any interpreter
+# having zc.buildout can run it
+LOCKED_BUILDOUT_SCRIPT = '''
+import sys, zc.buildout.buildout, zc.buildout.easy_install
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+lock_path, depth = sys.argv[1], [0]
+def locked(func):
+    def wrapper(*args, **kwargs):
+        if depth[0] or fcntl is None:
+            return func(*args, **kwargs)
+        depth[0] += 1
+        try:
+            with open(lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                return func(*args, **kwargs)
+        finally:
+            depth[0] -= 1
+    return wrapper
+zc.buildout.easy_install.install = locked(zc.buildout.easy_install.install)
+zc.buildout.easy_install.build = locked(zc.buildout.easy_install.build)
+zc.buildout.buildout.main(sys.argv[2:])
+'''
+
+def eggs_directory(path, options=None):
+    '''Resolves the directory buildout installs the eggs in, within an eggs directory
+
+    Since zc.buildout 5, the eggs are installed within a subdirectory named
+    after the format of the eggs (``eggs-directory-version``, ``v5``), and with
+    ``abi-tag-eggs``, within another one named after the interpreter's ABI.
+
+    Args:
+        path: path to the eggs directory, as given to ``eggs-directory``
+        options: options of the ``[buildout]`` section, overriding buildout's
+            defaults for those two options
+
+    Returns:
+        the path to the directory holding the eggs
+    '''
+    import zc.buildout.buildout
+
+    options = options or {}
+    # zc.buildout < 5 has no versioned eggs directory
+    default = getattr(zc.buildout.buildout, '_buildout_default_options', {}).get('eggs-directory-version')
+    version = str(options.get('eggs-directory-version', getattr(default, 'value', default) or '')).strip()
+    if version:
+        path = os.path.join(path, version)
+    if str(options.get('abi-tag-eggs', 'false')).strip() == 'true':
+        from zc.buildout.pep425tags import get_abi_tag
+        path = os.path.join(path, get_abi_tag())
+    return path
+
+def script_eggs(bin_path, eggs_path):
+    '''Lists the eggs of an eggs directory the scripts of a project use
+
+    Scripts generated by buildout set their ``sys.path`` up with the absolute
+    path to each of their eggs.
+
+    Args:
+        bin_path: path to the project's bin directory
+        eggs_path: path to the directory holding the eggs (cf ``eggs_directory()``)
+
+    Returns:
+        set of the eggs names
+    '''
+    used = set()
+    if not os.path.isdir(bin_path):
+        return used
+    prefixes = {eggs_path, os.path.realpath(eggs_path)}
+    pattern = re.compile('|'.join(r'{}{}([^\'"{}]+)'.format(re.escape(p), re.escape(os.sep), re.escape(os.sep))
+                                  for p in prefixes))
+    for fname in os.listdir(bin_path):
+        try:
+            with open(os.path.join(bin_path, fname), 'r') as script:
+                content = script.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        for match in pattern.finditer(content):
+            used.add(next(g for g in match.groups() if g))
+    return used
+
+@contextmanager
+def install_lock(lock_path):
+    '''Makes buildout install and build eggs while holding a lock, within the context
+
+    ``zc.buildout.easy_install.install()`` and ``build()`` are wrapped, so that
+    only the installation of the eggs is serialized between the runs sharing
+    the lock, and not the whole buildout run. ``LOCKED_BUILDOUT_SCRIPT`` does
+    the same within a buildout subprocess.
+
+    Args:
+        lock_path: path to the lock file
+    '''
+    import zc.buildout.easy_install
+
+    depth = [0]
+    def locked(func):
+        def wrapper(*args, **kwargs):
+            if depth[0]:
+                return func(*args, **kwargs)
+            depth[0] += 1
+            try:
+                with file_lock(lock_path):
+                    return func(*args, **kwargs)
+            finally:
+                depth[0] -= 1
+        return wrapper
+
+    install, build = zc.buildout.easy_install.install, zc.buildout.easy_install.build
+    zc.buildout.easy_install.install = locked(install)
+    zc.buildout.easy_install.build = locked(build)
+    try:
+        yield
+    finally:
+        zc.buildout.easy_install.install, zc.buildout.easy_install.build = install, build
+
+class EggsCache:
+    '''Eggs directory shared between projects
+
+    The lock and the statistics are within the shared eggs directory, while the
+    eggs are within the directory buildout installs them in (cf
+    ``eggs_directory()``).
+
+    Args:
+        path: path to the shared eggs directory
+        options: options of the ``[buildout]`` section of the projects
+    '''
+    lock_name = '.buildstrap.lock'
+    stats_name = '.buildstrap-stats.json'
+
+    def __init__(self, path, options=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.options = options
+        self.last_run = None
+
+    @property
+    def eggs_path(self):
+        '''Path to the directory holding the eggs (cf ``eggs_directory()``)'''
+        return eggs_directory(self.path, self.options)
+
+    @property
+    def stats_path(self):
+        return os.path.join(self.path, self.stats_name)
+
+    @property
+    def lock_path(self):
+        '''Path to the lock held while installing eggs within the cache (cf ``install_lock()``)'''
+        return os.path.join(self.path, self.lock_name)
+
+    def eggs(self):
+        '''Lists the eggs within the cache'''
+        if not os.path.isdir(self.eggs_path):
+            return set()
+        return {fname for fname in os.listdir(self.eggs_path) if not fname.startswith('.')}
+
+    def load_stats(self):
+        '''Loads the cumulated statistics of the cache'''
+        try:
+            with open(self.stats_path, 'r') as stats_file:
+                return json.load(stats_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_stats(self, stats):
+        with atomic_write(self.stats_path) as stats_file:
+            json.dump(stats, stats_file, indent=2, sort_keys=True)
+
+    def used_eggs(self, bin_path):
+        '''Lists the eggs of the cache the scripts of a project use (cf ``script_eggs()``)
+
+        Args:
+            bin_path: path to the project's bin directory
+
+        Returns:
+            set of the eggs names
+        '''
+        return script_eggs(bin_path, self.eggs_path)
+
+    @contextmanager
+    def session(self, bin_path):
+        '''Context of a buildout run using the cache
+
+        Once the context successfully ends, updates the statistics with the eggs
+        the project reused from the cache and the eggs it installed in the cache
+        (the statistics file being updated while holding the cache's lock).
+        Those statistics are then available through ``last_run``.
+
+        The cache is not locked during the context: the run is expected to
+        install its eggs while holding the lock (cf ``install_lock()``). As
+        other runs may install eggs meanwhile, the eggs installed by the run
+        are the new eggs its scripts use.
+
+        Args:
+            bin_path: path to the project's bin directory
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        before = self.eggs()
+        start = time.time()
+        yield self
+        duration = time.time() - start
+
+        with file_lock(self.lock_path):
+            stats = self.load_stats()
+            sizes = stats.setdefault('sizes', {})
+            used = self.used_eggs(bin_path)
+            installed = (self.eggs() - before) & used
+            reused = used & before
+            for egg in installed | reused:
+                if egg not in sizes and os.path.exists(os.path.join(self.eggs_path, egg)):
+                    sizes[egg] = tree_size(os.path.join(self.eggs_path, egg))
+            for egg in set(sizes) - self.eggs():
+                del sizes[egg]
+
+            run = {
+                'reused_eggs': len(reused),
+                'reused_bytes': sum(sizes.get(egg, 0) for egg in reused),
+                'installed_eggs': len(installed),
+                'installed_bytes': sum(sizes.get(egg, 0) for egg in installed),
+                'seconds': duration,
+            }
+            for key in ('reused_eggs', 'reused_bytes', 'installed_eggs', 'installed_bytes'):
+                stats[key] = stats.get(key, 0) + run[key]
+            stats['runs'] = stats.get('runs', 0) + 1
+            if installed:
+                stats['install_seconds'] = stats.get('install_seconds', 0) + duration
+            # estimate the time saved from the throughput of the runs that had
+            # to install eggs in the cache
+            if stats.get('installed_bytes') and stats.get('install_seconds'):
+                rate = stats['install_seconds'] / stats['installed_bytes']
+                run['saved_seconds'] = run['reused_bytes'] * rate
+                stats['saved_seconds'] = stats.get('saved_seconds', 0) + run['saved_seconds']
+            else:
+                run['saved_seconds'] = None
+            self.save_stats(stats)
+            self.last_run = run
+
+def format_size(size):
+    '''Formats a size in bytes in a human readable way'''
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return '{:.1f}{}'.format(size, unit) if unit != 'B' else '{}B'.format(size)
+        size /= 1024
+
+def format_run(run):
+    '''Formats the statistics of a run, as given by ``EggsCache.last_run``'''
+    saved = '' if run['saved_seconds'] is None else ', about {:.1f}s saved'.format(run['saved_seconds'])
+    return 'Shared eggs: reused {} eggs ({}{}), installed {} eggs ({})'.format(
+            run['reused_eggs'], format_size(run['reused_bytes']), saved,
+            run['installed_eggs'], format_size(run['installed_bytes']))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+'''
+Machine readable output of the ``debug`` and ``show`` actions
+
+With ``--format json`` or ``--format jsonl``, the configuration is output as
+JSON rather than as a ``pprint`` of the parts (``debug``) or as a buildout
+configuration file (``show``). Both formats share the same records, one per
+section, in the order of the configuration::
+
+    {"version": 1, "section": "buildout", "options": {"newest": "false", ...}}
+
+``jsonl`` outputs one record per line, and ``json`` outputs a single document
+holding the list of the records::
+
+    {"version": 1, "action": "show", "sections": [{"version": 1, "section": "buildout", ...}, ...]}
+
+With ``debug``, the options are the internal representation of the parts: lists
+(such as ``eggs``) are arrays. With ``show``, the options are as written within
+the configuration file: their names are lower cased, and their values are
+strings, lists being one item per line.
+
+Records are written out as soon as they are encoded, so the whole output is
+never built in memory.
+
+The ``version`` is bumped whenever the records change in an incompatible way.
+'''
+
+import json
+
+from buildstrap.buildstrap import ListBuildout
+
+FORMATS = ('json', 'jsonl')
+VERSION = 1
+
+def option_value(value, rendered):
+    '''Gives the JSON value of an option
+
+    Args:
+        value: value of the option within the parts
+        rendered: if set, gives the value as written in the configuration
+
+    Returns:
+        a string, or a list of strings for lists that are not rendered
+    '''
+    if isinstance(value, ListBuildout):
+        return '\n'.join(value) if rendered else list(value)
+    return str(value) if rendered or not isinstance(value, (str, list)) else value
+
+def section_records(parts, rendered=False):
+    '''Iterates over the records of the sections of the configuration
+
+    Args:
+        parts: dict based representation of the buildout configuration
+        rendered: if set, the options are given as written in the configuration
+
+    Returns:
+        iterator over the records, one per section
+    '''
+    for section, options in parts.items():
+        yield {
+            'version': VERSION,
+            'section': section,
+            'options': {(str(key).lower() if rendered else key): option_value(value, rendered)
+                        for key, value in options.items()},
+        }
+
+def write_jsonl(parts, out, rendered=False):
+    '''Writes the records of the configuration, one per line
+
+    Args:
+        parts: dict based representation of the buildout configuration
+        out: file-like object to write to
+        rendered: if set, the options are given as written in the configuration
+    '''
+    for record in section_records(parts, rendered):
+        out.write(json.dumps(record))
+        out.write('\n')
+
+def write_json(parts, out, action, rendered=False):
+    '''Writes the records of the configuration as a single JSON document
+
+    Args:
+        parts: dict based representation of the buildout configuration
+        out: file-like object to write to
+        action: name of the action, given in the document
+        rendered: if set, the options are given as written in the configuration
+    '''
+    out.write('{{"version": {}, "action": {}, "sections": ['.format(VERSION, json.dumps(action)))
+    for position, record in enumerate(section_records(parts, rendered)):
+        if position:
+            out.write(', ')
+        out.write(json.dumps(record))
+    out.write(']}\n')
+
+def write_parts(parts, out, output_format, action):
+    '''Writes the configuration in a machine readable format
+
+    Args:
+        parts: dict based representation of the buildout configuration
+        out: file-like object to write to
+        output_format: ``json`` or ``jsonl``
+        action: ``debug`` (internal representation) or ``show`` (as written)
+
+    Raises:
+        ValueError: when the format is not supported
+    '''
+    rendered = action == 'show'
+    if output_format == 'jsonl':
+        write_jsonl(parts, out, rendered)
+    elif output_format == 'json':
+        write_json(parts, out, action, rendered)
+    else:
+        raise ValueError('Unsupported format {}, use one of: {}'.format(output_format, ', '.join(FORMATS)))
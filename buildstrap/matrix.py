@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+'''
+Interpreters matrix: one environment per python interpreter, built concurrently
+
+Giving several interpreters, as a comma separated list::
+
+    buildstrap run -i python3.11,python3.12 marvin requirements.txt
+
+builds one environment per interpreter, all of them within the project's root,
+each having its own configuration, ``bin`` and environment directories, and
+buildout installed parts file (cf ``interpreter_args()``)::
+
+    buildout-python3.11.cfg
+    bin/python3.11/
+    var/python3.11/
+    var/python3.11/.installed.cfg
+    buildout-python3.12.cfg
+    bin/python3.12/
+    …
+
+Interpreters can be given by name or by path (``-i /usr/bin/python3.12``): the
+layout, and the interpreter script of the environment, are named after the
+executable (``python3.12``, cf ``interpreter_name()``), while the interpreter as
+given is the one running buildout.
+
+With ``run``, the environments are built concurrently (up to ``--jobs`` at
+once, cf ``buildstrap.aio``), each buildout's output being prefixed with the
+name of its interpreter, and a report of every interpreter's build is printed
+once all of them are done. Each environment's buildout runs on its interpreter
+(as does the precompilation of its bytecode), which therefore has to be able to
+import ``zc.buildout`` (cf ``check_interpreter()``). The other actions (``generate``, ``show`` and
+``debug``) go through the interpreters one after the other.
+'''
+
+import os, re, sys, time, asyncio, subprocess
+
+from buildstrap.aio import buildstrap_async, print_output
+from buildstrap.buildstrap import _buildstrap
+
+def interpreters(interpreter):
+    '''Lists the interpreters given to ``--interpreter`` (comma separated)'''
+    if not interpreter:
+        return []
+    return [name.strip() for name in interpreter.split(',') if name.strip()]
+
+def interpreter_name(interpreter):
+    '''Names the layout of an interpreter after its executable (``/usr/bin/python3.12`` is ``python3.12``)'''
+    return re.sub(r'[^\w.-]', '_', os.path.basename(interpreter.rstrip('/'))) or 'python'
+
+def interpreter_args(args, interpreter):
+    '''Gives the arguments building the environment of one interpreter of the matrix
+
+    The configuration is named after the output, suffixed by the interpreter's
+    name (``buildout-python3.12.cfg``), and the ``bin`` and environment
+    directories get a subdirectory for the interpreter (``bin/python3.12`` and
+    ``var/python3.12``), which also holds buildout's installed parts file. The
+    interpreter script is named after the interpreter too (a path cannot name
+    a script), while the interpreter as given is the ``--executable``, the
+    python running buildout.
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        interpreter: the interpreter to build the environment of
+
+    Returns:
+        a copy of the arguments, for that interpreter only
+    '''
+    name = interpreter_name(interpreter)
+    env_path = os.path.join(args['--env'] or 'var', name)
+    output = args['--output']
+    if output != '-':
+        stem, ext = os.path.splitext(output)
+        output = '{}-{}{}'.format(stem, name, ext or '.cfg')
+    return dict(args, **{
+        '--interpreter': name,
+        '--executable': interpreter,
+        '--output': output,
+        '--env': env_path,
+        '--bin': os.path.join(args['--bin'] or 'bin', name),
+        '--installed': os.path.join(env_path, '.installed.cfg'),
+    })
+
+async def check_interpreter(interpreter):
+    '''Checks that an interpreter runs, and can import ``zc.buildout`` to run buildout
+
+    Raises:
+        RuntimeError: when it cannot
+    '''
+    try:
+        process = await asyncio.create_subprocess_exec(interpreter, '-c', 'import zc.buildout',
+                                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError as err:
+        raise RuntimeError('cannot run {}: {}'.format(interpreter, err.strerror or err)) from None
+    if await process.wait() != 0:
+        raise RuntimeError('{} cannot import zc.buildout, install it for that interpreter'.format(interpreter))
+
+async def build_matrix(args, jobs=None):
+    '''Builds the environments of all the interpreters concurrently
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        jobs: maximum number of environments built at once (defaults to the
+            number of CPUs)
+
+    Returns:
+        list of tuples of the interpreter's arguments (cf ``interpreter_args()``),
+        the exit code (or the exception raised) and the time spent building it,
+        in the interpreters' order
+    '''
+    semaphore = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+
+    async def build(interpreter_args):
+        name = interpreter_name(interpreter_args['--interpreter'])
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await check_interpreter(interpreter_args['--executable'])
+                code = await buildstrap_async(interpreter_args,
+                                              lambda line: print_output('{}: {}'.format(name, line)))
+            except Exception as err:
+                code = err
+            return interpreter_args, code, time.perf_counter() - start
+
+    return await asyncio.gather(*(build(interpreter_args(args, interpreter))
+                                  for interpreter in interpreters(args['--interpreter'])))
+
+def report(results, out=None):
+    '''Prints the report of the builds of the matrix
+
+    Args:
+        results: list of the builds, as given by ``build_matrix()``
+        out: file to print the report to (defaults to stdout)
+
+    Returns:
+        the number of failed builds
+    '''
+    out = out or sys.stdout
+    failures = 0
+    for interpreter_args, code, duration in results:
+        name = interpreter_name(interpreter_args['--interpreter'])
+        if code == 0:
+            print('{:<9} {} ({}, {:.1f}s)'.format('ok', name, interpreter_args['--output'], duration), file=out)
+        else:
+            failures += 1
+            error = 'exit code {}'.format(code) if isinstance(code, int) else str(code) or code.__class__.__name__
+            print('{:<9} {}: {} ({:.1f}s)'.format('failed', name, error, duration), file=out)
+    print('{} interpreters, {} succeeded, {} failed'.format(
+            len(results), len(results) - failures, failures), file=out)
+    return failures
+
+def matrix(args):
+    '''Runs the action on every interpreter given to ``--interpreter``
+
+    Args:
+        args: command line arguments, as parsed by docopt
+
+    Returns:
+        0 if the action succeeded for all the interpreters, 1 otherwise
+    '''
+    if args.get('watch') or args.get('lock') or args.get('--update-lock'):
+        print('Cannot watch or lock several interpreters at once, give them one at a time.',
+              file=sys.stderr)
+        return 1
+
+    if args['run']:
+        jobs = int(args['--jobs']) if args.get('--jobs') else None
+        return 1 if report(asyncio.run(build_matrix(args, jobs))) else 0
+
+    code = 0
+    for interpreter in interpreters(args['--interpreter']):
+        code = _buildstrap(interpreter_args(args, interpreter)) or code
+    return code
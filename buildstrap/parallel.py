@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+'''
+Parallel installation of independent parts
+
+Buildout installs the parts one after the other. With ``run --parallel-parts``,
+the dependencies between the parts are worked out from their ``${section:option}``
+references, and the parts that do not depend on each other are installed
+concurrently, each by its own buildout subprocess:
+
+1. buildout runs once without any part, to develop the sources (and uninstall
+   the parts that are no longer used),
+2. each part is installed by a buildout subprocess as soon as the parts it
+   depends on are installed, with a ``.installed.cfg`` of its own, seeded with
+   the previous installation of the part and of its dependencies, so unchanged
+   parts are only updated,
+3. the installation of all the parts is merged back within ``.installed.cfg``,
+   so following runs (parallel or not) go on from there.
+
+The subprocesses installing the parts do not develop the sources again, and
+take turns to install eggs, as they share the same eggs directory. All of them
+write their scripts in the same ``bin`` directory.
+'''
+
+import os, re, sys, asyncio, shutil
+
+from collections import OrderedDict
+
+from buildstrap.buildstrap import format_option, parse
+from buildstrap.aio import buildout_command, print_output, run_process
+from buildstrap.eggs import LOCKED_BUILDOUT_SCRIPT
+from buildstrap.utils import atomic_write
+
+REFERENCE_RE = re.compile(r'\$\{([^:}]*):[^}]*\}')
+
+# buildout installing a part without developing the sources again (the option is
+# still read, so buildout does not warn about it being unused), and installing
+# eggs while holding the lock given as first argument; it only needs zc.buildout,
+# so it runs on any interpreter (cf ``part_command()``)
+PART_BUILDOUT_SCRIPT = '''
+import zc.buildout.buildout
+zc.buildout.buildout.Buildout._develop = lambda self: self['buildout'].get('develop') and ''
+''' + LOCKED_BUILDOUT_SCRIPT
+
+class PartFailed(RuntimeError):
+    '''Raised when the installation of a part failed'''
+
+def section_references(options):
+    '''Lists the sections referenced by the options of a section
+
+    Args:
+        options: dict of the options of the section
+
+    Returns:
+        set of the names of the sections referenced through ``${section:option}``
+        or listed in ``<part-dependencies>``
+    '''
+    references = set()
+    for value in options.values():
+        references.update(name for name in REFERENCE_RE.findall(format_option(value)) if name)
+    references.update(format_option(options.get('<part-dependencies>', '')).split())
+    return references
+
+def part_dependencies(parts):
+    '''Works out which parts each part depends on
+
+    A part depends on the parts it references, directly or through other
+    sections. Referenced sections having a recipe are parts, even when they are
+    not listed in ``buildout:parts`` (buildout installs them as well).
+
+    Args:
+        parts: dict based representation of the buildout configuration
+
+    Returns:
+        OrderedDict of each part's name to the set of the parts it depends on
+    '''
+    names = format_option(parts['buildout'].get('parts', '')).split()
+    dependencies = OrderedDict()
+    pending = list(names)
+    while pending:
+        name = pending.pop(0)
+        if name in dependencies:
+            continue
+        depends = set()
+        seen = {name}
+        sections = [name]
+        while sections:
+            for reference in section_references(parts.get(sections.pop(), {})):
+                if reference in seen or reference not in parts:
+                    continue
+                seen.add(reference)
+                if 'recipe' in parts[reference]:
+                    depends.add(reference)
+                    pending.append(reference)
+                else:
+                    sections.append(reference)
+        dependencies[name] = depends
+    return dependencies
+
+def install_order(dependencies):
+    '''Sorts the parts so each part comes after the parts it depends on
+
+    Raises:
+        ValueError: when parts depend on each other
+    '''
+    order = []
+    remaining = OrderedDict(dependencies)
+    while remaining:
+        ready = [name for name, depends in remaining.items() if depends <= set(order)]
+        if not ready:
+            raise ValueError('Circular references between parts: {}'.format(', '.join(remaining)))
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+    return order
+
+def read_installed(path):
+    '''Reads an installed parts file (as written by buildout)
+
+    Returns:
+        dict of each section to its raw options, empty if the file does not exist
+    '''
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r') as installed_file:
+        return parse(installed_file, path)
+
+def write_installed(path, sections, order):
+    '''Writes an installed parts file, the way buildout does
+
+    Args:
+        path: path to the file
+        sections: dict of each section to its raw options
+        order: list of the parts to write, after the ``buildout`` section
+    '''
+    from zc.buildout.buildout import _save_options
+    with atomic_write(path) as installed_file:
+        _save_options('buildout', sections['buildout'], installed_file)
+        for part in order:
+            installed_file.write('\n')
+            _save_options(part, sections[part], installed_file)
+
+def part_command(config, part, installed, lock, executable=None):
+    '''Gives the command line installing a single part, as a subprocess (on ``executable``, if given)'''
+    return [executable or sys.executable, '-c', PART_BUILDOUT_SCRIPT, lock,
+            '-c', config, 'buildout:parts={}'.format(part), 'buildout:installed={}'.format(installed)]
+
+def transitive(dependencies, part):
+    '''Lists all the parts a part depends on, directly or not'''
+    result = set()
+    pending = list(dependencies[part])
+    while pending:
+        name = pending.pop()
+        if name not in result:
+            result.add(name)
+            pending.extend(dependencies[name])
+    return result
+
+async def install_parts(config, parts, paths, jobs=None, output=None, lock_path=None, executable=None):
+    '''Installs the parts of a buildout configuration concurrently
+
+    Args:
+        config: path to the buildout configuration file
+        parts: dict based representation of the buildout configuration
+        paths: dict of the project paths, as given by ``project_paths()``
+        jobs: maximum number of parts installed at once (defaults to the number of CPUs)
+        output: callable given the name of the part and each line of its
+            buildout's output (defaults to printing the line, prefixed with the
+            part's name)
+        lock_path: path to the lock held while installing eggs (defaults to a
+            lock of the project's own, cf ``buildstrap.eggs.install_lock()``)
+        executable: python executable running buildout (defaults to the running one)
+
+    Returns:
+        list of the installed parts, in their installation order
+
+    Raises:
+        PartFailed: when some parts failed to install (the parts that got
+            installed are still recorded)
+        ValueError: when parts depend on each other
+    '''
+    dependencies = part_dependencies(parts)
+    order = install_order(dependencies)
+    output = output or (lambda part, line: print_output('{}: {}'.format(part, line)))
+
+    installed_path = paths['installed']
+    work_path = os.path.join(paths['env'], 'parallel')
+    shutil.rmtree(work_path, ignore_errors=True)
+    os.makedirs(work_path)
+    lock_path = lock_path or os.path.join(work_path, 'install.lock')
+    previous = read_installed(installed_path)
+    previous_parts = previous.get('buildout', {}).get('parts', '').split()
+
+    # develop the sources once, and uninstall the parts no longer used
+    removed = [part for part in previous_parts if part not in dependencies]
+    develop_path = os.path.join(work_path, 'develop.cfg')
+    if previous:
+        write_installed(develop_path, dict(previous, buildout={
+            'parts': ' '.join(removed),
+            'installed_develop_eggs': previous['buildout'].get('installed_develop_eggs', ''),
+        }), removed)
+    code = await run_process(buildout_command(config, lock_path, executable) + [
+                                    'buildout:parts=', 'buildout:installed={}'.format(develop_path)],
+                             lambda line: output('develop', line))
+    if code != 0:
+        raise PartFailed('Developing the sources failed')
+    developed = read_installed(develop_path).get('buildout', {})
+
+    installed = {}
+    semaphore = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+    tasks = {}
+
+    async def install(part):
+        for dependency in dependencies[part]:
+            await tasks[dependency]
+        async with semaphore:
+            seeded = [p for p in order if p in transitive(dependencies, part)]
+            sections = {p: installed[p] for p in seeded}
+            if part in previous_parts:
+                sections[part] = previous[part]
+                seeded.append(part)
+            part_path = os.path.join(work_path, '{}.cfg'.format(part))
+            if seeded:
+                write_installed(part_path, dict(sections, buildout={'parts': ' '.join(seeded)}), seeded)
+            code = await run_process(part_command(config, part, part_path, lock_path, executable),
+                                     lambda line: output(part, line))
+            if code != 0:
+                raise PartFailed('Installing part {} failed'.format(part))
+            installed[part] = read_installed(part_path)[part]
+
+    for part in order:
+        tasks[part] = asyncio.ensure_future(install(part))
+    results = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    # parts left out by a failure, but previously installed, are still there
+    for part in order:
+        if part not in installed and part in previous_parts:
+            installed[part] = previous[part]
+    merged_parts = [part for part in order if part in installed]
+    installed['buildout'] = {
+        'parts': ' '.join(merged_parts),
+        'installed_develop_eggs': developed.get('installed_develop_eggs', ''),
+    }
+    if merged_parts or installed['buildout']['installed_develop_eggs']:
+        write_installed(installed_path, installed, merged_parts)
+    elif os.path.exists(installed_path):
+        os.unlink(installed_path)
+    shutil.rmtree(work_path, ignore_errors=True)
+
+    failures = OrderedDict((str(result), True) for result in results if isinstance(result, BaseException))
+    if failures:
+        raise PartFailed('\n'.join(failures))
+    return merged_parts
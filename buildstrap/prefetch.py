@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+'''
+Parallel prefetcher of distributions
+
+Buildout downloads distributions one after the other. To avoid having the ``run``
+action wait on each download, the distributions matching the resolved
+requirements (cf ``buildstrap.requirements``) are fetched concurrently,
+before running buildout, within the ``dist`` directory of the buildout download
+cache. Buildout uses that directory as a find-links source, so it then only has
+to install them.
+
+Distributions are looked up within find-links sources (local directories, or
+urls of pages listing distributions), then within a :pep:`503` simple index
+(which can be a local directory, using a ``file://`` url).
+
+Only the distributions directly required are prefetched, as knowing their
+dependencies would need their metadata: buildout still fetches those.
+'''
+
+import os, re, sys
+import shutil
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, unquote
+from urllib.request import urlopen, url2pathname
+
+from buildstrap.requirements import normalize_name, satisfies, version_key
+
+DEFAULT_INDEX = 'https://pypi.org/simple/'
+
+DIST_RE = re.compile(r'^(?P<name>.+?)-(?P<version>\d[^-]*?)'
+                     r'(?P<ext>-[^/]*\.whl|-py\d\.\d+(?:-[^/]*)?\.egg|\.tar\.gz|\.tar\.bz2|\.tgz|\.zip)$')
+
+class _LinksParser(HTMLParser):
+    '''Gathers the targets of all the links of an HTML page'''
+    def __init__(self):
+        super(_LinksParser, self).__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value)
+
+def is_local(location):
+    '''Tells whether a location is a local path (or a ``file://`` url)'''
+    return '://' not in location or location.startswith('file://')
+
+def local_path(location):
+    '''Gives the local path of a local location'''
+    if location.startswith('file://'):
+        return url2pathname(unquote(urlparse(location).path))
+    return location
+
+def list_links(location):
+    '''Lists the distributions available at a location
+
+    Args:
+        location: path to a directory, ``file://`` url, or url of an HTML page
+
+    Returns:
+        list of the urls (or paths) of all the linked files, an empty list if the
+        location cannot be read
+    '''
+    try:
+        if is_local(location):
+            path = local_path(location)
+            if os.path.isdir(path):
+                if os.path.exists(os.path.join(path, 'index.html')):
+                    path = os.path.join(path, 'index.html')
+                else:
+                    return [os.path.join(path, f) for f in sorted(os.listdir(path))]
+            with open(path, 'r') as page:
+                content = page.read()
+            base = path
+        else:
+            with urlopen(location) as page:
+                content = page.read().decode('utf-8', 'replace')
+            base = location
+    except (OSError, ValueError):
+        return []
+    parser = _LinksParser()
+    parser.feed(content)
+    if is_local(location):
+        return [os.path.join(os.path.dirname(base), local_path(l)) if is_local(l) else l
+                for l in (link.split('#')[0] for link in parser.links)]
+    return [urljoin(base, link.split('#')[0]) for link in parser.links]
+
+def parse_dist(link):
+    '''Parses the file name of a distribution
+
+    Returns:
+        tuple of normalized name, version and file name, or None if the link
+        does not look like a distribution
+    '''
+    filename = os.path.basename(unquote(urlparse(link).path) if not is_local(link) else link)
+    match = DIST_RE.match(filename)
+    if not match:
+        return None
+    return normalize_name(match.group('name')), match.group('version'), filename
+
+def compatible(filename):
+    '''Tells whether a distribution file can be installed with the current python'''
+    if filename.endswith('.whl'):
+        python_tag, abi_tag, platform_tag = filename[:-4].split('-')[-3:]
+        if abi_tag == 'none' and platform_tag == 'any':
+            return any(tag.startswith('py3') or tag == 'py{}{}'.format(*sys.version_info[:2])
+                       for tag in python_tag.split('.'))
+        try:
+            from packaging.tags import sys_tags
+        except ImportError: # pragma: no cover
+            return False
+        supported = {str(tag) for tag in sys_tags()}
+        return any('-'.join((p, a, pl)) in supported
+                   for p in python_tag.split('.') for a in abi_tag.split('.') for pl in platform_tag.split('.'))
+    if filename.endswith('.egg'):
+        return '-py{}.{}'.format(*sys.version_info[:2]) in filename
+    return True
+
+def select_dist(requirement, links):
+    '''Selects the best distribution for a requirement
+
+    The highest version satisfying the requirement is selected, binary
+    distributions being preferred over source distributions of the same version.
+
+    Args:
+        requirement: ``Requirement`` instance
+        links: list of the available links
+
+    Returns:
+        tuple of the link and file name, or None if no distribution matches
+    '''
+    candidates = []
+    for link in links:
+        dist = parse_dist(link)
+        if dist is None or dist[0] != requirement.key or not compatible(dist[2]):
+            continue
+        _, version, filename = dist
+        if not all(satisfies(version, op, spec) is not False for op, spec, _ in requirement.specifiers):
+            continue
+        key = version_key(version)
+        if key is None:
+            continue
+        candidates.append((key, filename.endswith(('.whl', '.egg')), link, filename))
+    if not candidates:
+        return None
+    _, _, link, filename = max(candidates, key=lambda c: c[:2])
+    return link, filename
+
+def fetch(link, dest):
+    '''Copies or downloads a distribution to its destination, atomically
+
+    Args:
+        link: path or url of the distribution
+        dest: path of the destination file
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.prefetch-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if is_local(link):
+                with open(local_path(link), 'rb') as src:
+                    shutil.copyfileobj(src, out)
+            else:
+                with urlopen(link) as src:
+                    shutil.copyfileobj(src, out)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+class Prefetcher:
+    '''Fetches the distributions of a list of requirements concurrently
+
+    Args:
+        dist_path: directory where to store the distributions (the ``dist``
+            directory of the buildout download cache)
+        eggs_path: directory holding buildout's eggs (cf
+            ``buildstrap.eggs.eggs_directory()``), requirements already
+            installed there are not fetched again
+        find_links: list of find-links locations
+        index_url: url of the simple index (``None`` to disable the index)
+        jobs: size of the thread pool
+    '''
+    def __init__(self, dist_path, eggs_path=None, find_links=(), index_url=DEFAULT_INDEX, jobs=None):
+        self.dist_path = dist_path
+        self.eggs_path = eggs_path
+        self.find_links = list(find_links)
+        self.index_url = index_url
+        self.jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+        self._find_links_cache = None
+
+    def installed(self, requirement):
+        '''Tells whether a matching egg is already installed'''
+        if not self.eggs_path or not os.path.isdir(self.eggs_path):
+            return False
+        for fname in os.listdir(self.eggs_path):
+            name, _, rest = fname.partition('-')
+            version = rest.partition('-')[0]
+            if normalize_name(name) == requirement.key and version and all(
+                    satisfies(version, op, spec) is not False for op, spec, _ in requirement.specifiers):
+                return True
+        return False
+
+    def links(self, requirement):
+        '''Lists the links available for a requirement, from find-links then from the index'''
+        if self._find_links_cache is None:
+            self._find_links_cache = [l for location in self.find_links for l in list_links(location)]
+        links = list(self._find_links_cache)
+        if self.index_url and select_dist(requirement, links) is None:
+            links += list_links(urljoin(self.index_url.rstrip('/') + '/', requirement.key + '/'))
+        return links
+
+    def prefetch_one(self, requirement):
+        '''Prefetches the distribution of a requirement
+
+        Returns:
+            tuple of the requirement's name and the status, one of ``installed``,
+            ``cached``, ``fetched`` or ``missing``
+        '''
+        if self.installed(requirement):
+            return requirement.name, 'installed'
+        dist = select_dist(requirement, self.links(requirement))
+        if dist is None:
+            return requirement.name, 'missing'
+        link, filename = dist
+        dest = os.path.join(self.dist_path, filename)
+        if os.path.exists(dest):
+            return requirement.name, 'cached'
+        fetch(link, dest)
+        return requirement.name, 'fetched'
+
+    def prefetch(self, requirements):
+        '''Prefetches the distributions of all the requirements
+
+        Args:
+            requirements: iterable of ``Requirement`` instances
+
+        Returns:
+            dict of each requirement name to its status (cf ``prefetch_one()``),
+            or to the error message if it failed
+        '''
+        os.makedirs(self.dist_path, exist_ok=True)
+        # list the find-links before starting the workers, so it's done once
+        self._find_links_cache = [l for location in self.find_links for l in list_links(location)]
+
+        def task(requirement):
+            try:
+                return self.prefetch_one(requirement)
+            except Exception as err:
+                return requirement.name, 'error: {}'.format(err)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return dict(executor.map(task, requirements))
+
+def prefetch(requirements, paths, find_links=None, index_url=None, jobs=None, eggs_path=None, options=None):
+    '''Prefetches the resolved requirements of a project in its download cache
+
+    Args:
+        requirements: ``Requirements`` instance, as given by ``resolve_requirements()``
+        paths: dict of the project paths, as given by ``project_paths()``
+        find_links: list of find-links locations (defaults to the ones given
+            within the requirements files)
+        index_url: url of the simple index (defaults to the one given within the
+            requirements files, or to PyPI)
+        jobs: size of the thread pool
+        eggs_path: path to the eggs directory, when not within the environment
+        options: options of the ``[buildout]`` section, to find the eggs within
+            the eggs directory (cf ``buildstrap.eggs.eggs_directory()``)
+
+    Returns:
+        dict of each requirement name to its status
+    '''
+    from buildstrap.eggs import eggs_directory
+
+    base_path = paths['src']
+    find_links = [l if not is_local(l) or os.path.isabs(local_path(l)) else os.path.join(base_path, l)
+                  for l in (find_links or requirements.find_links)]
+    prefetcher = Prefetcher(os.path.join(paths['env'], 'downloads', 'dist'),
+                            eggs_directory(eggs_path or os.path.join(paths['env'], 'eggs'), options),
+                            find_links,
+                            index_url or requirements.index_url or DEFAULT_INDEX,
+                            jobs)
+    return prefetcher.prefetch(requirements.requirements.values())
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+
+'''
+Native requirements files resolver
+
+Parses pip requirements files in a single streaming pass, following ``-r``
+(requirements) and ``-c`` (constraints) includes, and merges all requirements
+by their normalized name, so the flattened list of eggs can be written within
+the buildout configuration, instead of having ``gp.vcsdevelop`` parse the
+requirements files again within buildout on every run.
+
+Editable and VCS requirements (``-e git+https://…#egg=name``, or direct
+references such as ``name @ git+https://…``) are kept apart, as they still need
+``gp.vcsdevelop`` to be checked out. Per requirement options (such as the
+``--hash`` options written by ``pip-compile --generate-hashes``) are ignored.
+
+Conflicting pins (two different ``==`` versions, or a pin outside of the range
+allowed by another requirement of the same distribution) are reported with a
+``RequirementConflict`` as soon as they are parsed.
+'''
+
+import os, re
+
+from collections import OrderedDict
+
+REQUIREMENT_RE = re.compile(r'^(?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*'
+                            r'(?:\[(?P<extras>[^\]]*)\])?\s*(?P<specs>[^;]*?)\s*(?:;\s*(?P<marker>.*))?$')
+SPECIFIER_RE = re.compile(r'^\s*(?P<op>===|==|!=|<=|>=|~=|<|>)\s*(?P<version>[^\s,]+)\s*$')
+EGG_RE = re.compile(r'[#&]egg=(?P<name>[^&\s]+)')
+# per requirement options, e.g. ``foo==1.0 --hash=sha256:…``
+REQUIREMENT_OPTIONS_RE = re.compile(r'\s+--[A-Za-z].*$')
+
+INCLUDE_OPTIONS = {
+    '-r': 'requirement', '--requirement': 'requirement',
+    '-c': 'constraint', '--constraint': 'constraint',
+}
+EDITABLE_OPTIONS = ('-e', '--editable')
+INDEX_OPTIONS = ('-i', '--index-url')
+FIND_LINKS_OPTIONS = ('-f', '--find-links')
+
+class RequirementConflict(ValueError):
+    '''Raised when two requirements of the same distribution cannot be both satisfied'''
+
+def strip_options(line):
+    '''Removes the per requirement options trailing a requirement line'''
+    return REQUIREMENT_OPTIONS_RE.sub('', line)
+
+def direct_url(name, url):
+    '''Turns a direct reference (``name @ url``) into an url naming its egg (``url#egg=name``)'''
+    if EGG_RE.search(url):
+        return url
+    return '{}{}egg={}'.format(url, '&' if '#' in url else '#', name)
+
+def normalize_name(name):
+    '''Normalizes a distribution name, as per PEP 503'''
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def version_key(version):
+    '''Makes a comparable key out of a version string
+
+    Only the release segment (the leading dot separated numbers) is considered,
+    which is enough to compare pins with ranges.
+    '''
+    match = re.match(r'^v?(\d+(?:\.\d+)*)', version)
+    if not match:
+        return None
+    release = [int(n) for n in match.group(1).split('.')]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    return tuple(release)
+
+def satisfies(version, op, spec):
+    '''Checks whether a pinned version satisfies a specifier
+
+    Returns:
+        True or False, or None when the versions cannot be compared
+    '''
+    if op == '===':
+        return version == spec
+    if op in ('==', '!=') and spec.endswith('.*'):
+        prefix = version_key(spec[:-2])
+        key = version_key(version)
+        if prefix is None or key is None:
+            return None
+        matches = (key + (0,) * len(prefix))[:len(prefix)] == prefix
+        return matches if op == '==' else not matches
+    key, spec_key = version_key(version), version_key(spec)
+    if key is None or spec_key is None:
+        return None
+    if op == '==':
+        return key == spec_key
+    if op == '!=':
+        return key != spec_key
+    if op == '<':
+        return key < spec_key
+    if op == '<=':
+        return key <= spec_key
+    if op == '>':
+        return key > spec_key
+    if op == '>=':
+        return key >= spec_key
+    if op == '~=':
+        upper = spec_key[:-1] if len(spec_key) > 1 else spec_key
+        return key >= spec_key and key[:len(upper)] == upper
+    return None
+
+class Requirement:
+    '''A distribution requirement, merged from all the lines requiring it
+
+    Args:
+        name: name of the distribution, as first given
+        source: ``file:line`` where the requirement has first been given
+    '''
+    def __init__(self, name, source):
+        self.name = name
+        self.key = normalize_name(name)
+        self.extras = []
+        self.specifiers = []
+        self.sources = [source]
+
+    def __repr__(self):
+        return '<Requirement {}>'.format(self.egg)
+
+    @property
+    def pin(self):
+        '''the pinned version and where it comes from, or None'''
+        for op, version, source in self.specifiers:
+            if op in ('==', '===') and not version.endswith('.*'):
+                return version, source
+        return None
+
+    @property
+    def egg(self):
+        '''the requirement as an egg specification for buildout'''
+        extras = '[{}]'.format(','.join(self.extras)) if self.extras else ''
+        return '{}{}{}'.format(self.name, extras, ','.join(op + version for op, version, _ in self.specifiers))
+
+    def add_extras(self, extras):
+        for extra in extras:
+            if extra not in self.extras:
+                self.extras.append(extra)
+
+    def add_specifier(self, op, version, source):
+        '''Adds a version specifier, checking it against the current pin
+
+        Raises:
+            RequirementConflict: if the specifier contradicts another one
+        '''
+        if any(op == o and version == v for o, v, _ in self.specifiers):
+            return
+        pin = self.pin
+        checks = []
+        if pin is not None:
+            checks.append((pin[0], op, version, pin[1], source))
+        if op in ('==', '===') and not version.endswith('.*'):
+            checks += [(version, o, v, source, s) for o, v, s in self.specifiers]
+        for pinned, o, v, pin_source, spec_source in checks:
+            if satisfies(pinned, o, v) is False:
+                raise RequirementConflict('Conflicting requirements for {}: {}=={} ({}) and {}{} ({})'.format(
+                    self.name, self.name, pinned, pin_source, self.name, o + v, spec_source))
+        self.specifiers.append((op, version, source))
+
+class Requirements:
+    '''Result of the resolution of requirements files
+
+    Attributes:
+        requirements: OrderedDict of normalized name to ``Requirement``
+        constraints: OrderedDict of normalized name to ``Requirement``, for the
+            constraints not matching (yet) any requirement
+        vcs: list of the editable or VCS urls
+        files: list of all the files parsed, includes comprised
+        index_url: the last index url given with ``--index-url``, or None
+        find_links: list of the find links given with ``--find-links``
+    '''
+    def __init__(self):
+        self.requirements = OrderedDict()
+        self.constraints = OrderedDict()
+        self.vcs = []
+        self.files = []
+        self.index_url = None
+        self.find_links = []
+
+    @property
+    def eggs(self):
+        '''list of the requirements, as eggs specifications for buildout'''
+        return [req.egg for req in self.requirements.values()]
+
+    def add(self, line, source, constraint=False):
+        '''Adds a requirement line
+
+        Direct references (``name @ url``) are added as VCS requirements (cf
+        ``add_vcs()``), so the distribution is taken from the url.
+
+        Args:
+            line: the requirement, e.g. ``foo[bar]>=1.0,<2; python_version>"3"``
+            source: ``file:line`` where the requirement is given
+            constraint: whether the line comes from a constraints file
+
+        Raises:
+            ValueError: if the line cannot be parsed
+            RequirementConflict: if it conflicts with the former requirements
+        '''
+        line = strip_options(line)
+        if ' @ ' in line:
+            name, url = (part.strip() for part in line.split(' @ ', 1))
+            url, _, marker = url.partition(' ;')
+            if constraint or (marker.strip() and not evaluate_marker(marker.strip())):
+                return
+            match = REQUIREMENT_RE.match(name)
+            if not match or match.group('specs'):
+                raise ValueError('Invalid requirement at {}: {}'.format(source, line))
+            self.add_vcs(direct_url(match.group('name'), url.strip()), source)
+            if match.group('extras'):
+                self.requirements[normalize_name(match.group('name'))].add_extras(
+                        [e.strip() for e in match.group('extras').split(',') if e.strip()])
+            return
+        match = REQUIREMENT_RE.match(line)
+        if not match:
+            raise ValueError('Invalid requirement at {}: {}'.format(source, line))
+        if match.group('marker') and not evaluate_marker(match.group('marker')):
+            return
+
+        name = match.group('name')
+        key = normalize_name(name)
+        if constraint:
+            req = self.requirements.get(key) or self.constraints.setdefault(key, Requirement(name, source))
+        else:
+            req = self.requirements.get(key) or self.constraints.pop(key, None) or Requirement(name, source)
+            self.requirements[key] = req
+            if source not in req.sources:
+                req.sources.append(source)
+            if match.group('extras'):
+                req.add_extras([e.strip() for e in match.group('extras').split(',') if e.strip()])
+
+        for spec in filter(None, (s.strip() for s in match.group('specs').split(','))):
+            spec_match = SPECIFIER_RE.match(spec)
+            if not spec_match:
+                raise ValueError('Invalid version specifier at {}: {}'.format(source, spec))
+            req.add_specifier(spec_match.group('op'), spec_match.group('version'), source)
+
+    def add_vcs(self, url, source):
+        '''Adds an editable or VCS requirement
+
+        The egg name given by the url's ``#egg=`` fragment, if any, is added to the
+        requirements (so it is part of the eggs list) without specifiers.
+        '''
+        if url not in self.vcs:
+            self.vcs.append(url)
+        match = EGG_RE.search(url)
+        if match:
+            self.add(match.group('name'), source)
+
+def evaluate_marker(marker, environment=None):
+    '''Evaluates an environment marker, using ``packaging`` when it's available
+
+    Args:
+        marker: the environment marker, e.g. ``python_version >= "3.8"``
+        environment: dict overriding values of the current environment, e.g.
+            ``{'extra': 'test'}``
+
+    Returns:
+        whether the requirement applies to the current environment (True when it
+        cannot be evaluated)
+    '''
+    try:
+        from packaging.markers import Marker
+    except ImportError: # pragma: no cover
+        return True
+    try:
+        return Marker(marker).evaluate(environment)
+    except Exception:
+        return True
+
+def iter_lines(path):
+    '''Iterates over the logical lines of a requirements file
+
+    Comments are stripped, and lines ending with a backslash are joined. Bytes
+    that are not UTF-8 (e.g. within latin-1 comments) are replaced, rather than
+    failing to read the file.
+
+    Yields:
+        tuples of the line number and the line
+    '''
+    with open(path, 'r', encoding='utf-8', errors='replace') as req_file:
+        buffer, start = '', None
+        for number, line in enumerate(req_file, 1):
+            if line.lstrip().startswith('#'):
+                line = ''
+            elif ' #' in line or '\t#' in line:
+                line = re.split(r'\s#', line, 1)[0]
+            line = line.strip()
+            if start is None:
+                start = number
+            if line.endswith('\\'):
+                buffer += line[:-1].strip() + ' '
+                continue
+            line = (buffer + line).strip()
+            if line:
+                yield start, line
+            buffer, start = '', None
+        if buffer.strip():
+            yield start, buffer.strip()
+
+def split_option(line):
+    '''Splits an option line into its option and value (``-r foo``, ``-rfoo``, ``--requirement=foo``)'''
+    if line.startswith('--'):
+        option, _, value = line.partition('=') if '=' in line.split()[0] else line.partition(' ')
+    else:
+        option, value = line[:2], line[2:]
+    return option.strip(), value.strip()
+
+def resolve_requirements(paths, result=None):
+    '''Resolves a list of requirements files
+
+    Each file is read line by line, includes being followed as they are met.
+    Paths within the files are relative to the including file.
+
+    Args:
+        paths: list of paths to the requirements files
+        result: ``Requirements`` to add the requirements to (a new one by default)
+
+    Returns:
+        the ``Requirements`` instance
+
+    Raises:
+        FileNotFoundError: if a requirements file does not exist
+        RequirementConflict: if two requirements cannot be both satisfied
+        ValueError: if a requirement cannot be parsed
+    '''
+    result = result or Requirements()
+    visited = set(os.path.realpath(f) for f in result.files)
+
+    def walk(path, constraint):
+        real_path = os.path.realpath(path)
+        if real_path in visited:
+            return
+        visited.add(real_path)
+        result.files.append(path)
+        base_path = os.path.dirname(path)
+        for number, line in iter_lines(path):
+            source = '{}:{}'.format(path, number)
+            if line.startswith('-'):
+                option, value = split_option(line)
+                if option in INCLUDE_OPTIONS:
+                    walk(os.path.join(base_path, value),
+                         constraint or INCLUDE_OPTIONS[option] == 'constraint')
+                elif option in EDITABLE_OPTIONS:
+                    result.add_vcs(value, source)
+                elif option in INDEX_OPTIONS:
+                    result.index_url = value
+                elif option in FIND_LINKS_OPTIONS:
+                    result.find_links.append(value)
+                # other pip options are irrelevant to buildout
+            elif '://' in line.split(' @ ')[0] or line.startswith(('.', '/')):
+                result.add_vcs(strip_options(line), source)
+            else:
+                result.add(line, source, constraint)
+
+    for path in paths:
+        walk(path, False)
+    return result
+
+def requirements_files(paths):
+    '''Lists requirements files along with all the files they include
+
+    Unlike ``resolve_requirements()``, requirements are not parsed, and missing
+    files are listed without failing.
+
+    Args:
+        paths: list of paths to the requirements files
+
+    Returns:
+        list of the paths of all the files, in the order they are included
+    '''
+    files = []
+    visited = set()
+
+    def walk(path):
+        real_path = os.path.realpath(path)
+        if real_path in visited:
+            return
+        visited.add(real_path)
+        files.append(path)
+        try:
+            for _, line in iter_lines(path):
+                if line.startswith('-'):
+                    option, value = split_option(line)
+                    if option in INCLUDE_OPTIONS:
+                        walk(os.path.join(os.path.dirname(path), value))
+        except OSError:
+            pass
+
+    for path in paths:
+        walk(path)
+    return files
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+'''
+Warm daemon serving buildstrap's requests over a Unix socket
+
+Each invocation of buildstrap pays for the interpreter startup and the imports,
+which adds up for editor integrations or pre-commit hooks calling ``buildstrap
+show`` or ``buildstrap generate`` all the time. ``buildstrap serve`` starts a
+daemon keeping the modules and the template index loaded, and the command line
+forwards its arguments to it when it's running (cf ``forward()``), falling back
+to running in process otherwise.
+
+Requests and responses are JSON documents, one per line::
+
+    {"argv": ["show", "foo", "requirements.txt"], "cwd": "/path/to/project", "prog": "buildstrap"}
+    {"code": 0, "stdout": "[buildout]\n...", "stderr": ""}
+
+Only the actions that do not run buildout (``generate``, ``show`` and ``debug``)
+are served: the daemon answers ``{"fallback": true}`` to any other request, so
+the client runs it in process.
+
+As the requests are relative to the client's working directory, they are
+executed one at a time.
+
+The socket is ``$BUILDSTRAP_SOCKET`` if set, otherwise ``buildstrap.sock``
+within ``$XDG_RUNTIME_DIR`` (or ``~/.cache/buildstrap``). Setting
+``BUILDSTRAP_NO_DAEMON`` disables forwarding.
+'''
+
+import os, sys, io, json, socket, threading
+
+from contextlib import redirect_stdout, redirect_stderr
+
+def default_socket_path():
+    '''Gives the path to the daemon's socket'''
+    if os.environ.get('BUILDSTRAP_SOCKET'):
+        return os.path.expanduser(os.environ['BUILDSTRAP_SOCKET'])
+    runtime_path = os.environ.get('XDG_RUNTIME_DIR') or os.path.expanduser(os.path.join('~', '.cache', 'buildstrap'))
+    return os.path.join(runtime_path, 'buildstrap.sock')
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+def _receive(sock):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data.decode('utf-8'))
+
+def forward(argv, path=None, cwd=None, prog='buildstrap'):
+    '''Forwards a command line to the daemon
+
+    Args:
+        argv: command line arguments (without the program name)
+        path: path to the daemon's socket (defaults to ``default_socket_path()``)
+        cwd: working directory of the command (defaults to the current one)
+        prog: name of the program, for the usage message
+
+    Returns:
+        dict with the exit ``code``, and the ``stdout`` and ``stderr`` output of
+        the command, or None when it has to run in process (no daemon is running,
+        or the daemon does not serve that command)
+    '''
+    path = path or default_socket_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            _send(sock, {'argv': list(argv), 'cwd': cwd or os.getcwd(), 'prog': prog})
+            response = _receive(sock)
+    except (OSError, ValueError):
+        return None
+    if response.get('fallback'):
+        return None
+    return response
+
+def is_listening(path):
+    '''Tells whether a daemon is listening on a socket'''
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+class Daemon:
+    '''Executes the requests forwarded by the clients
+
+    Args:
+        verbose: if set, logs each request on stderr
+    '''
+    def __init__(self, verbose=0):
+        self.verbose = verbose
+        self._lock = threading.Lock()
+
+    def execute(self, argv, cwd, prog='buildstrap'):
+        '''Executes a command line within the daemon
+
+        Args:
+            argv: command line arguments (without the program name)
+            cwd: working directory of the command
+            prog: name of the program, for the usage message
+
+        Returns:
+            the response to send back to the client (cf ``forward()``)
+        '''
+        from docopt import docopt
+        from buildstrap import buildstrap as module
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with self._lock:
+            previous_cwd = os.getcwd()
+            try:
+                os.chdir(cwd)
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    try:
+                        args = docopt(module.__doc__.format(prog), argv, version=module._VersionBanner())
+                        if (args['run'] or args['batch'] or args['serve'] or args['watch'] or args['lock']
+                                or args['templates'] or args['snapshot'] or args['store']):
+                            return {'fallback': True}
+                        code = module.buildstrap(args)
+                    except SystemExit as exit:
+                        if exit.code is None or isinstance(exit.code, int):
+                            code = exit.code or 0
+                        else:
+                            print(exit.code, file=sys.stderr)
+                            code = 1
+            finally:
+                os.chdir(previous_cwd)
+            # logged while holding the lock, so it's not redirected to another client
+            if self.verbose:
+                print('{} in {}: {}'.format(' '.join(argv), cwd, code), file=sys.stderr)
+        return {'code': code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+    def handle(self, sock):
+        '''Handles a client's connection'''
+        with sock:
+            try:
+                request = _receive(sock)
+                response = self.execute(request['argv'], request['cwd'], request.get('prog', 'buildstrap'))
+            except Exception as err:
+                response = {'code': 1, 'stdout': '', 'stderr': 'Fatal error: {}\n'.format(err)}
+            try:
+                _send(sock, response)
+            except OSError: # pragma: no cover
+                pass
+
+    def bind(self, path):
+        '''Binds the daemon's socket
+
+        Raises:
+            RuntimeError: when a daemon is already listening on that socket
+        '''
+        if os.path.exists(path):
+            if is_listening(path):
+                raise RuntimeError('A daemon is already running on {}'.format(path))
+            os.unlink(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        previous_umask = os.umask(0o177)
+        try:
+            self.socket.bind(path)
+        finally:
+            os.umask(previous_umask)
+        self.socket.listen()
+
+    def serve_forever(self):
+        '''Accepts and handles connections, until ``shutdown()`` is called'''
+        while True:
+            try:
+                sock, _ = self.socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle, args=(sock,), daemon=True).start()
+
+    def shutdown(self):
+        '''Stops the daemon, removing its socket'''
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+def serve(path=None, verbose=0):
+    '''Runs the daemon until it's interrupted
+
+    Args:
+        path: path to the socket to listen on (defaults to ``default_socket_path()``)
+        verbose: if set, logs each request on stderr
+
+    Returns:
+        0 once interrupted
+    '''
+    import signal
+    from importlib import import_module
+    from buildstrap.buildstrap import get_template_index
+    # warms the imports and the template index up, so requests don't pay for them
+    for module in ('docopt', 'zc.buildout.configparser'):
+        import_module(module)
+    get_template_index().directories
+
+    daemon = Daemon(verbose)
+    daemon.bind(path or default_socket_path())
+    print('Serving on {}'.format(daemon.path), file=sys.stderr)
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+    return 0
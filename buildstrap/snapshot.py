@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+'''
+Snapshots of a project's environment, to be cached between CI jobs
+
+Installing the eggs and parts of a project takes most of a CI job, while they
+only depend on a few inputs. ``buildstrap snapshot save`` packs the project's
+environment into a compressed archive named after a hash of those inputs, and
+``buildstrap snapshot restore`` unpacks it, so a job whose inputs did not change
+gets its environment back in a few seconds::
+
+    buildstrap snapshot restore foo requirements.txt || true
+    buildstrap run foo requirements.txt
+    buildstrap snapshot save foo requirements.txt
+
+The hash (cf ``snapshot_key()``) covers the resolved requirements, the
+project's ``setup.py``, the python interpreter and the part templates in use.
+
+The archive holds the environment directory (``--env``), the ``bin`` directory
+and buildout's ``.installed.cfg``, so buildout knows the restored parts are
+installed, and the state of the last run, so ``run`` does not run buildout again
+when the configuration did not change either. The environment holds absolute
+paths (e.g. to the developed sources), so it has to be restored at the same
+place it has been saved from.
+
+The archive is a tarball compressed by a pool of threads (cf
+``ParallelGzipWriter``), and hard links within the environment are kept as
+such, both when saving and restoring.
+'''
+
+import os, sys, gzip, json, shutil, hashlib, platform, tarfile
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from buildstrap.buildstrap import build_part_template, file_digest, paths_from_args
+from buildstrap.utils import atomic_write, remove_path
+
+class ParallelGzipWriter:
+    '''File-like object compressing what is written to it on a pool of threads
+
+    The data is cut in blocks, each block being compressed as a gzip member of
+    its own by a worker thread (zlib releases the GIL while compressing). The
+    members are written in order, and their concatenation is a valid gzip
+    stream, that any gzip reader decompresses.
+
+    Args:
+        fileobj: binary file object to write the compressed data to
+        jobs: number of compressing threads (defaults to the number of CPUs)
+        level: compression level
+    '''
+    block_size = 1 << 20
+
+    def __init__(self, fileobj, jobs=None, level=6):
+        self.fileobj = fileobj
+        self.level = level
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(self.jobs)
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(gzip.compress, block, self.level, mtime=0))
+        # bounds the memory used by the blocks waiting to be written
+        while len(self.pending) > 2 * self.jobs:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        '''Compresses the remaining data, and waits for all the blocks to be written'''
+        try:
+            if self.buffer or not self.pending:
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+
+def snapshot_key(args, paths):
+    '''Hashes the inputs the environment of a project depends on
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        paths: dict of the project paths, as given by ``project_paths()``
+
+    Returns:
+        the hexadecimal digest string
+    '''
+    from buildstrap.requirements import resolve_requirements
+
+    requirements = args['<requirements>']
+    if not isinstance(requirements, list):
+        requirements = requirements.split(',')
+    resolved = resolve_requirements([os.path.join(paths['src'], r) for r in requirements])
+    setup_path = os.path.join(paths['src'], 'setup.py')
+    inputs = {
+        'requirements': resolved.eggs,
+        'vcs': resolved.vcs,
+        'setup.py': file_digest(setup_path) if os.path.exists(setup_path) else None,
+        'interpreter': [args['--interpreter'], sys.implementation.cache_tag, sys.version, platform.machine()],
+        'templates': {name: build_part_template(name, args['--config']) for name in args['--part'] or []},
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+def archive_path(args, key):
+    '''Gives the path to the archive of a project's snapshot, within the ``--snapshots`` directory'''
+    package = args['<package>']
+    if isinstance(package, list):
+        package = package[0]
+    return os.path.join(os.path.expanduser(args['--snapshots']),
+                        '{}-{}.tar.gz'.format(package.split(',')[0], key))
+
+def snapshot_entries(paths):
+    '''Lists what a snapshot holds
+
+    Returns:
+        list of the names of the entries within the archive, and their paths
+    '''
+    return [
+        ('env', paths['env']),
+        ('bin', paths['bin']),
+        ('installed.cfg', paths['installed']),
+    ]
+
+def _exclude(tarinfo):
+    # work directory of the parallel installation of parts
+    if tarinfo.name == 'env/parallel' or tarinfo.name.startswith('env/parallel/'):
+        return None
+    return tarinfo
+
+def save(args):
+    '''Saves a snapshot of the project's environment
+
+    Args:
+        args: command line arguments, as parsed by docopt
+
+    Returns:
+        0 on success, 1 when the environment does not exist
+    '''
+    paths = paths_from_args(args)
+    if not os.path.isdir(paths['env']):
+        print('No environment to snapshot in {}, run buildout first.'.format(paths['env']), file=sys.stderr)
+        return 1
+    archive = archive_path(args, snapshot_key(args, paths))
+    if os.path.exists(archive) and not args['--force']:
+        print('Snapshot {} already saved.'.format(archive), file=sys.stderr)
+        return 0
+
+    os.makedirs(os.path.dirname(archive), exist_ok=True)
+    with atomic_write(archive, 'wb') as archive_file:
+        writer = ParallelGzipWriter(archive_file, int(args['--jobs']) if args.get('--jobs') else None)
+        # tarfile keeps hard links as such
+        with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            for name, path in snapshot_entries(paths):
+                if os.path.lexists(path):
+                    tar.add(path, arcname=name, filter=_exclude)
+        writer.close()
+    print('Saved snapshot {} ({} bytes)'.format(archive, os.path.getsize(archive)), file=sys.stderr)
+    return 0
+
+def restore(args):
+    '''Restores the snapshot of the project's environment, if there's one
+
+    The archive is unpacked aside, within the project's root, and each of its
+    entries then replaces the project's one.
+
+    Args:
+        args: command line arguments, as parsed by docopt
+
+    Returns:
+        0 on success, 1 when there is no snapshot for the project's inputs
+    '''
+    paths = paths_from_args(args)
+    archive = archive_path(args, snapshot_key(args, paths))
+    if not os.path.exists(archive):
+        print('No snapshot {} to restore.'.format(archive), file=sys.stderr)
+        return 1
+
+    unpack_path = os.path.join(paths['root'], '.buildstrap-restore.{}'.format(os.getpid()))
+    remove_path(unpack_path)
+    try:
+        with tarfile.open(archive, 'r:gz') as tar:
+            if hasattr(tarfile, 'tar_filter'):
+                # refuses members outside of the unpacking directory
+                tar.extractall(unpack_path, filter='tar')
+            else: # pragma: no cover (python < 3.8.17)
+                tar.extractall(unpack_path)
+        for name, path in snapshot_entries(paths):
+            unpacked = os.path.join(unpack_path, name)
+            if os.path.lexists(unpacked):
+                remove_path(path)
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                shutil.move(unpacked, path)
+    finally:
+        remove_path(unpack_path)
+    print('Restored snapshot {}'.format(archive), file=sys.stderr)
+    return 0
+
+def snapshot(args):
+    '''Saves or restores the snapshot of a project's environment (cf ``save()`` and ``restore()``)'''
+    if args['save']:
+        return save(args)
+    return restore(args)
@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+
+'''
+Content addressed store of the eggs, shared between projects
+
+Where a shared eggs directory (cf ``buildstrap.eggs``) makes projects use the
+same eggs, the store keeps each project's own eggs directory, while making all
+of them share their content: every egg lives once within the store, addressed
+by the hash of its content, and each project's eggs directory is populated with
+hard links into the store (or reflinks, or copies, when hard links cannot be
+made). So disk usage stays flat however many checkouts there are, and
+populating a new environment only creates links.
+
+Using ``--store``, around each buildout run:
+
+1. the eggs of the store the project needs and does not have yet are linked
+   within the directory buildout installs its eggs in (cf
+   ``buildstrap.eggs.eggs_directory()``), so buildout finds them already
+   installed. The needed eggs are resolved from the requirements of the run
+   (its requirements files, and the eggs and recipes of its parts), following
+   the dependencies given within the metadata of the stored eggs, and picking
+   the latest stored version matching the python version and the
+   requirement's specifiers. Buildout still resolves the requirements on its
+   own, installing what the store does not provide,
+2. once buildout succeeded, the eggs it installed are added to the store (by
+   linking them within it), and eggs having the same content as ones of the
+   store are replaced by links to the store.
+
+The projects using the store are registered within it (their eggs and bin
+directories), and ``buildstrap store gc`` drops the eggs that none of their
+scripts uses anymore (cf ``buildstrap.eggs.script_eggs()``).
+
+The bytecode compiled within the eggs (``__pycache__``) belongs to each project,
+and is not part of the store.
+'''
+
+import os, re, sys, json, hashlib, zipfile
+
+from contextlib import contextmanager
+
+from buildstrap.requirements import Requirements, evaluate_marker, normalize_name, satisfies, version_key
+from buildstrap.utils import atomic_write, file_lock, link_file, remove_path
+
+# ``[extra:marker]`` sections of an egg's ``requires.txt``
+REQUIRES_SECTION_RE = re.compile(r'^\[(?P<extra>[^:\]]*)(?::(?P<marker>[^\]]*))?\]$')
+
+def default_store_path():
+    '''Path to the store used by ``store gc`` when ``--store`` is not given'''
+    return os.path.expanduser(os.path.join('~', '.cache', 'buildstrap', 'store'))
+
+def _ignored(name):
+    return name == '__pycache__' or name.endswith('.pyc')
+
+def content_hash(path):
+    '''Hashes the content of an egg (a zipped egg file, or an unpacked directory)
+
+    Returns:
+        the hexadecimal digest string
+    '''
+    def file_digest(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    if not os.path.isdir(path):
+        return file_digest(path)
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if not _ignored(d))
+        relpath = os.path.relpath(dirpath, path)
+        digest.update('d {}\0'.format(relpath).encode('utf-8'))
+        for fname in sorted(filenames):
+            if _ignored(fname):
+                continue
+            file_path = os.path.join(dirpath, fname)
+            if os.path.islink(file_path):
+                digest.update('l {} {}\0'.format(fname, os.readlink(file_path)).encode('utf-8'))
+            else:
+                digest.update('f {} {}\0'.format(fname, file_digest(file_path)).encode('utf-8'))
+    return digest.hexdigest()
+
+def link_tree(src, dst):
+    '''Recreates an egg, linking its files (cf ``buildstrap.utils.link_file()``)
+
+    Directories are created, so only the files are shared.
+    '''
+    if not os.path.isdir(src):
+        link_file(src, dst)
+        return
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames[:] = [d for d in dirnames if not _ignored(d)]
+        target = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target, exist_ok=True)
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+                if name in dirnames:
+                    dirnames.remove(name)
+            elif name in filenames and not _ignored(name):
+                link_file(path, os.path.join(target, name))
+
+def same_files(path, other):
+    '''Tells whether an egg is made of the very same files as another one (hard linked)'''
+    if not os.path.isdir(path):
+        return os.path.isfile(other) and os.path.samefile(path, other)
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [d for d in dirnames if not _ignored(d)]
+        for fname in filenames:
+            if _ignored(fname):
+                continue
+            file_path = os.path.join(dirpath, fname)
+            other_path = os.path.join(other, os.path.relpath(file_path, path))
+            if os.path.islink(file_path):
+                continue
+            if not os.path.isfile(other_path) or not os.path.samefile(file_path, other_path):
+                return False
+    return True
+
+def parse_egg_name(name):
+    '''Parses the name of an egg, e.g. ``foo-1.0-py3.11.egg``
+
+    Returns:
+        tuple of the normalized distribution name, its version and the python
+        version tag (e.g. ``py3.11``), or None if it's not an egg's name
+    '''
+    if not name.endswith('.egg'):
+        return None
+    fields = name[:-len('.egg')].split('-')
+    if len(fields) < 3:
+        return None
+    return normalize_name(fields[0]), fields[1], fields[2]
+
+def read_metadata(path):
+    '''Reads the dependencies metadata of an egg (a zipped egg file, or an unpacked directory)
+
+    Eggs built by setuptools have an ``EGG-INFO/requires.txt``, while eggs
+    unpacked from wheels by buildout keep the wheel's ``*.dist-info/METADATA``.
+
+    Returns:
+        tuple of the kind of metadata (``requires`` or ``metadata``) and of its
+        content, or None when the egg has no dependencies metadata
+    '''
+    candidates = [('requires', 'EGG-INFO/requires.txt')]
+    try:
+        if os.path.isdir(path):
+            candidates += [('metadata', '{}/METADATA'.format(name))
+                           for name in sorted(os.listdir(path)) if name.endswith('.dist-info')]
+            for kind, name in candidates:
+                if os.path.isfile(os.path.join(path, name)):
+                    with open(os.path.join(path, name), 'r', encoding='utf-8') as metadata:
+                        return kind, metadata.read()
+            return None
+        with zipfile.ZipFile(path) as egg:
+            names = egg.namelist()
+            candidates += [('metadata', name) for name in sorted(names)
+                           if name.endswith('.dist-info/METADATA') and name.count('/') == 1]
+            for kind, name in candidates:
+                if name in names:
+                    return kind, egg.read(name).decode('utf-8')
+    except (OSError, UnicodeDecodeError, zipfile.BadZipFile):
+        pass
+    return None
+
+def egg_requirements(path, extras=()):
+    '''Lists the requirements of an egg, from its metadata (cf ``read_metadata()``)
+
+    Args:
+        path: path to the egg
+        extras: the extras of the egg that are required
+
+    Returns:
+        list of ``buildstrap.requirements.Requirement``, for the requirements
+        applying to the current environment
+    '''
+    metadata = read_metadata(path)
+    if metadata is None:
+        return []
+    kind, content = metadata
+    extras = [normalize_name(extra) for extra in extras]
+    lines = []
+    if kind == 'requires':
+        applies = True
+        for line in content.splitlines():
+            line = line.strip()
+            match = REQUIRES_SECTION_RE.match(line)
+            if match:
+                extra, marker = match.group('extra'), match.group('marker')
+                applies = ((not extra or normalize_name(extra) in extras)
+                           and (not marker or evaluate_marker(marker)))
+            elif line and applies:
+                lines.append(line)
+    else:
+        for line in content.splitlines():
+            if not line.lower().startswith('requires-dist:'):
+                continue
+            line, _, marker = line.split(':', 1)[1].partition(';')
+            if not marker.strip() or any(evaluate_marker(marker.strip(), {'extra': extra})
+                                         for extra in extras or ['']):
+                lines.append(line.strip())
+    requirements = Requirements()
+    for line in lines:
+        try:
+            requirements.add(line, path)
+        except ValueError:
+            continue
+    return list(requirements.requirements.values())
+
+class EggStore:
+    '''Content addressed store of eggs
+
+    The store holds the eggs within ``objects/<hash>``, and an index mapping
+    each egg's name to its hash, along with the projects using the store (cf
+    ``register()``).
+
+    Args:
+        path: path to the store
+    '''
+    lock_name = '.buildstrap.lock'
+    index_name = 'index.json'
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.last_run = None
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, self.index_name)
+
+    def object_path(self, digest):
+        '''Path to an egg within the store, given its hash'''
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+
+    def load_index(self):
+        '''Loads the index of the store'''
+        try:
+            with open(self.index_path, 'r') as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('eggs', {})
+        index.setdefault('envs', [])
+        return index
+
+    def save_index(self, index):
+        with atomic_write(self.index_path) as index_file:
+            json.dump(index, index_file, indent=2, sort_keys=True)
+
+    @contextmanager
+    def locked(self):
+        '''Holds the store's lock, for the duration of the context'''
+        os.makedirs(self.path, exist_ok=True)
+        with file_lock(os.path.join(self.path, self.lock_name)):
+            yield
+
+    def _place(self, src, dst):
+        '''Links an egg to its place, through a temporary path so it's never seen half linked'''
+        tmp_path = '{}.{}.tmp'.format(dst, os.getpid())
+        remove_path(tmp_path)
+        link_tree(src, tmp_path)
+        remove_path(dst)
+        os.rename(tmp_path, dst)
+
+    def add(self, egg_path):
+        '''Adds an egg to the store, linking its files within the store
+
+        Returns:
+            the hash of the egg
+        '''
+        digest = content_hash(egg_path)
+        object_path = self.object_path(digest)
+        if not os.path.lexists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            self._place(egg_path, object_path)
+        return digest
+
+    def resolve(self, index, requirements):
+        '''Selects the eggs of the store needed by requirements, following their dependencies
+
+        For each requirement, the latest version of the store matching the
+        running python version and the requirement's specifiers is selected.
+
+        Args:
+            index: index of the store, as given by ``load_index()``
+            requirements: list of requirements (e.g. ``foo[bar]>=1.0``)
+
+        Returns:
+            the list of the selected eggs names
+        '''
+        tag = 'py{}.{}'.format(*sys.version_info[:2])
+        candidates = {}
+        for name in index['eggs']:
+            parsed = parse_egg_name(name)
+            if parsed is not None and parsed[2] == tag:
+                candidates.setdefault(parsed[0], []).append((version_key(parsed[1]), parsed[1], name))
+        resolved = Requirements()
+        for requirement in requirements:
+            try:
+                resolved.add(requirement, 'buildout')
+            except ValueError:
+                continue
+        pending = list(resolved.requirements.values())
+        selected = {}
+        while pending:
+            requirement = pending.pop(0)
+            if requirement.key in selected:
+                continue
+            matching = [candidate for candidate in candidates.get(requirement.key, ())
+                        if all(satisfies(candidate[1], op, spec) is not False
+                               for op, spec, _ in requirement.specifiers)]
+            if not matching:
+                continue
+            name = max(matching)[2]
+            selected[requirement.key] = name
+            pending += egg_requirements(self.object_path(index['eggs'][name]), requirement.extras)
+        return sorted(selected.values())
+
+    def checkout(self, eggs_path, requirements=()):
+        '''Links the eggs of the store needed by requirements, that an eggs directory does not have yet
+
+        Args:
+            eggs_path: path to the directory holding the eggs (cf
+                ``buildstrap.eggs.eggs_directory()``)
+            requirements: list of requirements (cf ``resolve()``)
+
+        Returns:
+            the number of eggs linked
+        '''
+        os.makedirs(eggs_path, exist_ok=True)
+        linked = 0
+        with self.locked():
+            index = self.load_index()
+            for name in self.resolve(index, requirements):
+                path = os.path.join(eggs_path, name)
+                object_path = self.object_path(index['eggs'][name])
+                if not os.path.lexists(path) and os.path.lexists(object_path):
+                    self._place(object_path, path)
+                    linked += 1
+        return linked
+
+    def checkin(self, eggs_path):
+        '''Adds the eggs of an eggs directory to the store
+
+        Eggs not yet within the store are added, and eggs having the same content
+        as the store's ones are replaced by links to the store.
+
+        Args:
+            eggs_path: path to the directory holding the eggs (cf
+                ``buildstrap.eggs.eggs_directory()``)
+
+        Returns:
+            tuple of the number of eggs added, and of eggs replaced by links
+        '''
+        added = deduplicated = 0
+        if not os.path.isdir(eggs_path):
+            return added, deduplicated
+        with self.locked():
+            index = self.load_index()
+            for name in sorted(os.listdir(eggs_path)):
+                path = os.path.join(eggs_path, name)
+                if not name.endswith('.egg') or os.path.islink(path):
+                    continue
+                digest = index['eggs'].get(name)
+                if digest is not None and os.path.lexists(self.object_path(digest)):
+                    object_path = self.object_path(digest)
+                    if same_files(path, object_path):
+                        continue
+                    if content_hash(path) == digest:
+                        self._place(object_path, path)
+                        deduplicated += 1
+                        continue
+                index['eggs'][name] = self.add(path)
+                # the egg's files are those of the store, unless they had to be copied
+                if not same_files(path, self.object_path(index['eggs'][name])):
+                    self._place(self.object_path(index['eggs'][name]), path)
+                added += 1
+            self.save_index(index)
+        return added, deduplicated
+
+    def register(self, eggs_path, bin_path):
+        '''Registers a project using the store, so ``gc()`` keeps the eggs its scripts use
+
+        Args:
+            eggs_path: path to the directory holding the project's eggs
+            bin_path: path to the project's bin directory
+        '''
+        env = {'eggs': os.path.abspath(eggs_path), 'bin': os.path.abspath(bin_path)}
+        with self.locked():
+            index = self.load_index()
+            if env not in index['envs']:
+                index['envs'].append(env)
+                self.save_index(index)
+
+    @contextmanager
+    def session(self, eggs_path, bin_path, requirements=()):
+        '''Context of a buildout run using the store
+
+        Registers the project, and links the store's eggs it needs within its
+        eggs directory before the run, and once the run succeeded, adds its eggs
+        to the store. The statistics of the run are then available through
+        ``last_run``.
+
+        Args:
+            eggs_path: path to the directory holding the project's eggs (cf
+                ``buildstrap.eggs.eggs_directory()``)
+            bin_path: path to the project's bin directory
+            requirements: list of the requirements of the run (cf ``resolve()``)
+        '''
+        self.register(eggs_path, bin_path)
+        linked = self.checkout(eggs_path, requirements)
+        yield self
+        added, deduplicated = self.checkin(eggs_path)
+        self.last_run = {'linked_eggs': linked, 'added_eggs': added, 'deduplicated_eggs': deduplicated}
+
+    def gc(self):
+        '''Drops the eggs the scripts of the registered projects do not use anymore
+
+        Projects whose eggs directory does not exist anymore are unregistered.
+
+        Returns:
+            tuple of the number of eggs dropped, and of bytes freed
+        '''
+        from buildstrap.eggs import script_eggs
+
+        removed = freed = 0
+        with self.locked():
+            index = self.load_index()
+            index['envs'] = [env for env in index['envs']
+                             if isinstance(env, dict) and os.path.isdir(env['eggs'])]
+            used = set()
+            for env in index['envs']:
+                used.update(script_eggs(env['bin'], env['eggs']))
+            index['eggs'] = {name: digest for name, digest in index['eggs'].items() if name in used}
+            referenced = set(index['eggs'].values())
+            objects_path = os.path.join(self.path, 'objects')
+            for prefix in sorted(os.listdir(objects_path)) if os.path.isdir(objects_path) else []:
+                for digest in os.listdir(os.path.join(objects_path, prefix)):
+                    if digest in referenced:
+                        continue
+                    object_path = os.path.join(objects_path, prefix, digest)
+                    freed += _unshared_size(object_path)
+                    remove_path(object_path)
+                    removed += 1
+            self.save_index(index)
+        return removed, freed
+
+def _unshared_size(path):
+    '''Size of the files of a tree that are not hard linked elsewhere'''
+    paths = [path] if not os.path.isdir(path) else (
+            os.path.join(dirpath, fname) for dirpath, _, filenames in os.walk(path) for fname in filenames)
+    size = 0
+    for file_path in paths:
+        stat = os.lstat(file_path)
+        if stat.st_nlink == 1:
+            size += stat.st_size
+    return size
+
+def format_run(run):
+    '''Formats the statistics of a run, as given by ``EggStore.last_run``'''
+    return 'Egg store: linked {} eggs, added {} eggs, deduplicated {} eggs'.format(
+            run['linked_eggs'], run['added_eggs'], run['deduplicated_eggs'])
+
+def store(args):
+    '''Runs the ``store`` action (only ``gc`` for now)'''
+    from buildstrap.eggs import format_size
+    removed, freed = EggStore(args['--store'] or default_store_path()).gc()
+    print('Dropped {} eggs, freed {}'.format(removed, format_size(freed)), file=sys.stderr)
+    return 0
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+'''
+Instrumentation of buildstrap's phases
+
+``Timings`` records the wall and CPU time spent in each phase of an invocation,
+phases being nested (e.g. ``buildstrap/run/buildout/install:pytest/eggs`` is
+the egg resolution done by buildout while installing the ``pytest`` part). Code
+marks its phases using ``timed()``, which does nothing unless an instrumentation
+is active, so it costs nothing otherwise.
+
+When timing a ``run``, buildout's own phases are timed as well: the develop
+step, the egg resolutions and the installation of each part.
+'''
+
+import sys, json, time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('buildstrap_timings', default=None)
+
+class Timings:
+    '''Records the wall and CPU time of nested phases
+
+    Each phase is aggregated by its path within the nesting of phases, so a phase
+    happening several times is reported once, along with its number of calls.
+    '''
+    def __init__(self):
+        self.phases = OrderedDict()
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        '''Context of a phase, nested within the current phase'''
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        record = self.phases.setdefault(path, {'phase': path, 'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record['wall'] += time.perf_counter() - wall
+            record['cpu'] += time.process_time() - cpu
+            record['calls'] += 1
+            self._stack.pop()
+
+    def report(self):
+        '''Gives the timings as a JSON serializable dict'''
+        return {'phases': list(self.phases.values())}
+
+@contextmanager
+def timed(name):
+    '''Times a phase within the active instrumentation, if any'''
+    timings = _current.get()
+    if timings is None:
+        yield
+    else:
+        with timings.phase(name):
+            yield
+
+def _wrap(owner, attribute, name):
+    '''Wraps a method or function so it is timed as a phase
+
+    Args:
+        owner: class or module holding the function
+        attribute: name of the function
+        name: name of the phase, or callable giving the name out of the call's arguments
+
+    Returns:
+        a callable restoring the original function
+    '''
+    original = getattr(owner, attribute)
+    def wrapper(*args, **kwarg):
+        with timed(name(*args, **kwarg) if callable(name) else name):
+            return original(*args, **kwarg)
+    setattr(owner, attribute, wrapper)
+    return lambda: setattr(owner, attribute, original)
+
+@contextmanager
+def buildout_phases():
+    '''Times buildout's own phases, while buildout runs in process
+
+    Buildout's develop step, egg resolutions, egg builds and parts installation
+    are wrapped to be timed as ``develop``, ``eggs``, ``build`` and ``install:<part>``.
+    '''
+    import zc.buildout.buildout
+    import zc.buildout.easy_install
+
+    Buildout = zc.buildout.buildout.Buildout
+    restores = [
+        _wrap(Buildout, '_develop', 'develop'),
+        _wrap(Buildout, '_install', lambda self, part: 'install:{}'.format(part)),
+        _wrap(zc.buildout.easy_install, 'install', 'eggs'),
+        _wrap(zc.buildout.easy_install, 'build', 'build'),
+    ]
+    try:
+        yield
+    finally:
+        for restore in reversed(restores):
+            restore()
+
+@contextmanager
+def instrument(timings=False, profile=None, stream=None):
+    '''Instruments an invocation of buildstrap
+
+    Args:
+        timings: if set, times each phase, and writes the timings as JSON on
+            ``stream`` once done
+        profile: if given, path to the file where to dump the cProfile statistics
+            of the whole context (to be read with ``pstats``)
+        stream: where to write the timings (defaults to stderr)
+
+    Yields:
+        the ``Timings`` instance, or None if not timing
+    '''
+    recorder = Timings() if timings else None
+    token = _current.set(recorder)
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        if recorder is not None:
+            with recorder.phase('buildstrap'):
+                yield recorder
+        else:
+            yield recorder
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        _current.reset(token)
+        if recorder is not None:
+            print(json.dumps(recorder.report()), file=stream or sys.stderr)
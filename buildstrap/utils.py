@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+'''
+Filesystem helpers shared by buildstrap's modules
+'''
+
+import os, shutil, threading
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # pragma: no cover (not available on windows)
+    fcntl = None
+
+@contextmanager
+def file_lock(path, shared=False):
+    '''Holds an advisory lock on a file for the duration of the context
+
+    The lock file is created if needed, and is left in place afterwards. On
+    platforms without ``fcntl``, no locking is done.
+
+    Args:
+        path: path to the lock file
+        shared: if set, take a shared lock instead of an exclusive one
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        if fcntl is None: # pragma: no cover
+            yield
+            return
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def directory_lock(path):
+    '''Holds an exclusive advisory lock on a directory for the duration of the context
+
+    Unlike ``file_lock()``, no lock file is left within the directory. Where
+    directories cannot be locked (e.g. on some network filesystems), or on
+    platforms without ``fcntl``, no locking is done.
+
+    Args:
+        path: path to the directory
+    '''
+    if fcntl is None: # pragma: no cover
+        yield
+        return
+    fd = os.open(path or '.', os.O_RDONLY)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except OSError: # pragma: no cover
+            pass
+        yield
+    finally:
+        # closing the descriptor releases the lock
+        os.close(fd)
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    '''Opens a file to write it aside, then renames it over ``path``
+
+    The temporary file is within the same directory, so the rename is atomic:
+    readers either see the previous content, or the new one, never a truncated
+    or interleaved file. The temporary file's name is unique to the process and
+    thread, and it is removed if the context fails.
+
+    Args:
+        path: path to the file to write
+        mode: mode to open the temporary file with (``wb`` for a binary file)
+
+    Yields:
+        the temporary file, opened for writing
+    '''
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, mode) as tmp_file:
+            yield tmp_file
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def remove_path(path):
+    '''Removes a file, a symbolic link or a directory tree, if it exists'''
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+def tree_size(path):
+    '''Computes the disk usage of a file or directory tree, in bytes
+
+    Symbolic links are not followed.
+    '''
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fname in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, fname)).st_size
+            except OSError:
+                pass
+    return size
+
+# ioctl cloning a file's extents (cf ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+def link_file(src, dst):
+    '''Makes ``dst`` a file having the same content as ``src``, without copying it if possible
+
+    A hard link is made if possible, otherwise a reflink (on filesystems
+    supporting it, such as btrfs or xfs), otherwise the file is copied.
+
+    Returns:
+        ``'hardlink'``, ``'reflink'`` or ``'copy'``
+    '''
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            shutil.copystat(src, dst)
+            return 'reflink'
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return 'copy'
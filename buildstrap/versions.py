@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+'''
+Pinned versions of the distributions picked by buildout
+
+Even with ``newest = false``, buildout resolves every requirement on each run,
+looking up which distributions satisfy them. ``buildstrap lock`` runs buildout,
+and records the exact versions it picked within a ``[versions]`` section of a
+separate file (``versions.cfg`` by default, cf ``--versions``)::
+
+    [versions]
+    docopt = 0.6.2
+    zc.buildout = 2.13.3
+
+Once that file exists, the generated configuration extends it, so following
+runs use the pinned versions instead of resolving them again. Locking again
+keeps the pinned versions (only pinning the newly required distributions),
+while ``--update-lock`` picks all of them again.
+'''
+
+import os, sys
+
+from collections import OrderedDict
+
+from buildstrap.buildstrap import (build_fingerprint, generate_from_args, load_state, parse, paths_from_args,
+                                   run_buildout, save_state, write_buildout_config)
+from buildstrap.requirements import normalize_name
+from buildstrap.utils import atomic_write
+
+HEADER = '# Versions pinned by buildstrap lock, update them with --update-lock\n'
+
+def lock_path(args):
+    '''Gives the path to the versions file, relative to the configuration file if not absolute
+
+    Args:
+        args: command line arguments, as parsed by docopt
+    '''
+    return os.path.join(os.path.dirname(os.path.abspath(args['--output'])), args['--versions'])
+
+def read_lock(path):
+    '''Reads the pinned versions
+
+    Args:
+        path: path to the versions file
+
+    Returns:
+        OrderedDict of each distribution's name to its pinned version, empty if
+        the file does not exist
+    '''
+    if not os.path.isfile(path):
+        return OrderedDict()
+    with open(path, 'r') as versions_file:
+        return OrderedDict(parse(versions_file, path).get('versions', {}))
+
+def write_lock(path, versions):
+    '''Writes the pinned versions, sorted by name
+
+    Args:
+        path: path to the versions file
+        versions: dict of each distribution's name to its version
+    '''
+    pins = OrderedDict(sorted(versions.items(), key=lambda item: item[0].lower()))
+    with atomic_write(path) as versions_file:
+        versions_file.write(HEADER)
+        write_buildout_config({'versions': pins}, versions_file)
+
+def merge_versions(pinned, picked):
+    '''Adds the picked versions to the pinned ones
+
+    Names are compared once normalized (cf
+    ``buildstrap.requirements.normalize_name()``), so ``zc.buildout`` and
+    ``zc-buildout`` are the same pin, and the pinned versions are kept.
+
+    Args:
+        pinned: dict of the pinned versions
+        picked: list of the ``(name, version)`` picked by buildout
+
+    Returns:
+        OrderedDict of the merged versions
+    '''
+    versions = OrderedDict(pinned)
+    names = {normalize_name(name) for name in versions}
+    for name, version in picked:
+        if normalize_name(name) not in names:
+            versions[name] = version
+            names.add(normalize_name(name))
+    return versions
+
+def lock(args):
+    '''Runs buildout, and pins the versions it picked
+
+    Buildout runs in process (the parts are not installed concurrently), so the
+    versions it picked can be collected. Once the versions file is written, the
+    configuration is generated again to extend it, and the state of the run is
+    updated, so the next ``run`` is skipped.
+
+    Args:
+        args: command line arguments, as parsed by docopt
+
+    Returns:
+        0 on success
+    '''
+    import zc.buildout.easy_install
+
+    path = lock_path(args)
+    pinned = OrderedDict() if args.get('--update-lock') else read_lock(path)
+
+    run_args = dict(args, **{'--always-run': True, '--parallel-parts': False})
+    parts, result = generate_from_args(run_args)
+    if args['--verbose']:
+        print('{}: {}'.format(args['--output'], result), file=sys.stderr)
+
+    zc.buildout.easy_install.Installer._picked_versions.clear()
+    run_buildout(run_args, parts)
+    picked, _ = zc.buildout.easy_install.get_picked_versions()
+
+    versions = merge_versions(pinned, picked)
+    write_lock(path, versions)
+    if args['--verbose']:
+        print('{}: {} versions pinned'.format(path, len(versions)), file=sys.stderr)
+
+    # the configuration now extends the versions file, and is ours from now on
+    parts, _ = generate_from_args(dict(args, **{'--update-lock': False}), force=True)
+    paths = paths_from_args(args)
+    state = load_state(paths)
+    state['fingerprint'] = build_fingerprint(parts, args['<requirements>'], args['--part'], paths)
+    save_state(paths, state)
+    return 0
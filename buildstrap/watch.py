@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+'''
+Watch mode: generate and run buildout again whenever its inputs change
+
+``buildstrap watch`` monitors the requirements files (and the files they
+include), the project's ``setup.py``, and the part templates directories (and
+their bundles). Once a burst of changes settled (cf ``--debounce``), the parts
+are built and the configuration is generated again, and buildout is run when
+its inputs differ from the last successful run (cf ``run_buildout()``): when
+only a template that's not used changed, buildout is not run.
+
+Changes are watched using inotify on Linux, and by polling the files
+otherwise.
+'''
+
+import os, sys, time, select, struct
+
+from buildstrap.buildstrap import (TEMPLATE_BUNDLE, generate_from_args, paths_from_args, run_buildout,
+                                   template_paths)
+
+def watched_paths(args):
+    '''Lists the paths to watch for a project
+
+    Args:
+        args: command line arguments, as parsed by docopt
+
+    Returns:
+        tuple of the set of the files, and the set of the templates directories
+    '''
+    from buildstrap.requirements import requirements_files
+
+    paths = paths_from_args(args)
+    requirements = args['<requirements>']
+    if not isinstance(requirements, list):
+        requirements = requirements.split(',')
+    files = set(requirements_files([os.path.join(paths['src'], r) for r in requirements]))
+    files.add(os.path.join(paths['src'], 'setup.py'))
+    files = {os.path.abspath(f) for f in files}
+    dirs = {os.path.abspath(d) for d in template_paths(args['--config'])}
+    return files, dirs
+
+def relevant(path, files, dirs):
+    '''Tells whether a change on a path is a change of the watched inputs'''
+    return path in files or path in dirs or (os.path.dirname(path) in dirs
+                                             and (path.endswith('.part.cfg')
+                                                  or os.path.basename(path) == TEMPLATE_BUNDLE))
+
+class PollingWatcher:
+    '''Watches files by comparing their status at regular intervals
+
+    Args:
+        interval: time between two polls, in seconds
+    '''
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self._snapshot = None
+
+    def snapshot(self, files, dirs):
+        '''Takes the status of all the watched paths'''
+        status = {}
+        def stat(path):
+            try:
+                st = os.stat(path)
+                status[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+            except OSError:
+                status[path] = None
+        for path in files:
+            stat(path)
+        for path in dirs:
+            stat(path)
+            if status[path] is not None:
+                for fname in os.listdir(path):
+                    if fname.endswith('.part.cfg') or fname == TEMPLATE_BUNDLE:
+                        stat(os.path.join(path, fname))
+        return status
+
+    def changes(self, files, dirs, timeout=None):
+        '''Waits for changes of the watched paths
+
+        Args:
+            files: set of the files to watch
+            dirs: set of the templates directories to watch
+            timeout: maximum time to wait, in seconds (``None`` to wait forever)
+
+        Returns:
+            set of the changed paths, empty on timeout
+        '''
+        if self._snapshot is None:
+            self._snapshot = self.snapshot(files, dirs)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+            snapshot = self.snapshot(files, dirs)
+            changed = {path for path in set(snapshot) | set(self._snapshot)
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    '''Watches files using Linux' inotify, through ctypes
+
+    The parent directories of the files are watched rather than the files
+    themselves, so files replaced by editors (written aside, then renamed) are
+    still watched.
+    '''
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    # | IN_DELETE_SELF | IN_MOVE_SELF
+    mask = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+    event = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes, ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+
+    @classmethod
+    def available(cls):
+        '''Tells whether inotify can be used'''
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            cls().close()
+        except (OSError, AttributeError):
+            return False
+        return True
+
+    def update(self, files, dirs):
+        '''Sets the watches up for the directories holding the watched paths'''
+        targets = {os.path.dirname(f) for f in files}
+        for path in dirs:
+            # a missing templates directory gets noticed once created
+            targets.add(path if os.path.isdir(path) else os.path.dirname(path))
+        by_path = {path: wd for wd, path in self.watches.items()}
+        for path in set(by_path) - targets:
+            self.libc.inotify_rm_watch(self.fd, by_path[path])
+            del self.watches[by_path[path]]
+        for path in targets - set(by_path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+            if wd >= 0:
+                self.watches[wd] = path
+
+    def changes(self, files, dirs, timeout=None):
+        '''Waits for changes of the watched paths (cf ``PollingWatcher.changes()``)'''
+        self.update(files, dirs)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = None if deadline is None else max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], delay)
+            if not ready:
+                return set()
+            changed = set()
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError: # pragma: no cover
+                continue
+            offset = 0
+            while offset < len(data):
+                wd, _, _, length = self.event.unpack_from(data, offset)
+                offset += self.event.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if wd in self.watches:
+                    path = os.path.join(self.watches[wd], name) if name else self.watches[wd]
+                    if relevant(path, files, dirs):
+                        changed.add(path)
+            if changed:
+                return changed
+
+    def close(self):
+        os.close(self.fd)
+
+def default_watcher():
+    '''Gives an inotify watcher if available, a polling watcher otherwise'''
+    if InotifyWatcher.available():
+        return InotifyWatcher()
+    return PollingWatcher()
+
+def regenerate(args, force):
+    '''Builds the parts, generates the configuration and runs buildout if needed
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        force: if set, overwrites the configuration file if it exists
+
+    Returns:
+        True on success, False otherwise
+    '''
+    try:
+        parts, result = generate_from_args(args, force)
+        print('{}: {}'.format(args['--output'], result), file=sys.stderr)
+        run_buildout(args, parts)
+        return True
+    except (Exception, SystemExit) as err:
+        # buildout exits on failure, which must not stop watching
+        if not isinstance(err, SystemExit):
+            print('Error: {}'.format(err), file=sys.stderr)
+        return False
+
+def watch(args, watcher=None, stop=None):
+    '''Generates and runs the project, then again on each change of its inputs
+
+    Args:
+        args: command line arguments, as parsed by docopt
+        watcher: watcher to use (defaults to ``default_watcher()``)
+        stop: ``threading.Event`` ending the watch once set (otherwise, it's
+            watching until interrupted)
+
+    Returns:
+        0 once stopped, 1 if the first generation failed
+    '''
+    debounce = float(args.get('--debounce') or 0.5)
+    watcher = watcher or default_watcher()
+    try:
+        if not regenerate(args, args['--force']):
+            return 1
+        print('Watching for changes...', file=sys.stderr)
+        while stop is None or not stop.is_set():
+            files, dirs = watched_paths(args)
+            changed = watcher.changes(files, dirs, None if stop is None else debounce)
+            if not changed:
+                continue
+            # wait for the burst of changes to settle
+            while True:
+                more = watcher.changes(files, dirs, debounce)
+                if not more:
+                    break
+                changed |= more
+            if args['--verbose']:
+                print('Changed: {}'.format(', '.join(sorted(changed))), file=sys.stderr)
+            # the configuration is ours from now on
+            regenerate(args, True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return 0
@@ -2,8 +2,8 @@ from setuptools import setup, find_packages
 
 import sys
 
-if sys.version_info.major < 3:
-    print('Please install with python version 3')
+if sys.version_info < (3, 7):
+    print('Please install with python version 3.7 or later')
     sys.exit(1)
 
 from distutils.core import Command
@@ -70,8 +70,11 @@ setup(name='buildstrap',
           # 'Development Status :: 6 - Mature',
           # 'Development Status :: 7 - Inactive',
           'Programming Language :: Python :: 3',
-          'Programming Language :: Python :: 3.4',
-          'Programming Language :: Python :: 3.5',
+          'Programming Language :: Python :: 3.7',
+          'Programming Language :: Python :: 3.8',
+          'Programming Language :: Python :: 3.9',
+          'Programming Language :: Python :: 3.10',
+          'Programming Language :: Python :: 3.11',
           'Framework :: Buildout',
           'Environment :: Console',
           'Intended Audience :: Developers',
@@ -89,6 +92,7 @@ setup(name='buildstrap',
       ],
       long_description_markdown_filename='README.md',
       include_package_data = True,
+      python_requires='>=3.7',
       install_requires=[
             'docopt',
             'zc.buildout',
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+'''Benchmarks of the configuration generation pipeline
+
+Those benchmarks are not part of the default test run, use::
+
+    python -m pytest tests/bench_buildstrap.py
+
+Each benchmark is timed (best of a few rounds) against synthetic inputs at
+scale, and compared to the baseline stored in ``bench_baseline.json``: it fails
+when it gets slower than ``TOLERANCE`` times the baseline. A benchmark without
+a baseline is skipped. To record the baselines (e.g. for a new benchmark, on
+another machine, or after an expected change), run with
+``BUILDSTRAP_BENCH_UPDATE=1``: that's the only time the baseline file is written.
+'''
+
+import io
+import os
+import json
+import time
+
+from configparser import ConfigParser
+
+import pytest
+
+from buildstrap.buildstrap import *
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+UPDATE = os.environ.get('BUILDSTRAP_BENCH_UPDATE', '') not in ('', '0')
+TOLERANCE = 3.0
+# timings under this are too noisy to be compared with the tolerance only
+SLACK = 0.002
+ROUNDS = 3
+
+SCALES = [1, 100, 10000]
+TEMPLATES = 1000
+
+@pytest.fixture(scope='module')
+def baseline():
+    try:
+        with open(BASELINE_PATH, 'r') as baseline_file:
+            values = json.load(baseline_file)
+    except (OSError, ValueError):
+        values = {}
+    updated = dict(values)
+    yield values, updated
+    if UPDATE and updated != values:
+        with open(BASELINE_PATH, 'w') as baseline_file:
+            json.dump(updated, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+
+@pytest.fixture
+def bench(baseline, request):
+    '''Times a function, and checks it against its baseline'''
+    values, updated = baseline
+    def run(func, setup=None):
+        timings = []
+        for _ in range(ROUNDS):
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            func(arg) if setup else func()
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        name = request.node.name
+        if UPDATE:
+            updated[name] = best
+        elif name not in values:
+            pytest.skip('{} has no baseline, record it with BUILDSTRAP_BENCH_UPDATE=1'.format(name))
+        else:
+            assert best <= values[name] * TOLERANCE + SLACK, \
+                '{} regressed: {:.4f}s, baseline is {:.4f}s'.format(name, best, values[name])
+        return best
+    return run
+
+@pytest.fixture(scope='module')
+def templates(tmpdir_factory):
+    '''Directory holding lots of part templates'''
+    path = tmpdir_factory.mktemp('templates')
+    for i in range(TEMPLATES):
+        path.join('part{}.part.cfg'.format(i)).write('\n'.join([
+            '[part{}]'.format(i),
+            'recipe = zc.recipe.egg',
+            'eggs = ${buildout:requirements-eggs}',
+            '       extra{}'.format(i),
+            'arguments = sys.argv[1:]',
+            '',
+        ]))
+    return str(path)
+
+def synthetic_args(scale):
+    packages = ['package{}'.format(i) for i in range(scale)]
+    requirements = ['requirements{}.txt'.format(i) for i in range(scale)]
+    return packages, requirements
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_bench__build_parts(bench, scale):
+    packages, requirements = synthetic_args(scale)
+    bench(lambda: build_parts(packages, requirements))
+
+@pytest.mark.parametrize('scale', SCALES)
+def test_bench__generate_buildout_config(bench, scale, tmpdir):
+    parts = build_parts(*synthetic_args(scale))
+    output = str(tmpdir.join('buildout.cfg'))
+    def setup():
+        if os.path.exists(output):
+            os.unlink(output)
+    bench(lambda _: generate_buildout_config(parts, output), setup)
+
+def render_with_configparser(parts):
+    '''Renders the configuration the way it used to be, through a ``ConfigParser``'''
+    with ListBuildout.generate_context():
+        parser = ConfigParser()
+        parser.read_dict(parts)
+        content = io.StringIO()
+        parser.write(content)
+        return content.getvalue()
+
+def synthetic_parts(scale):
+    parts = build_parts(*synthetic_args(scale))
+    for i in range(scale):
+        parts['part{}'.format(i)] = {
+            'recipe': 'zc.recipe.egg',
+            'eggs': ListBuildout(['egg{}'.format(j) for j in range(scale)]),
+        }
+    return parts
+
+@pytest.mark.parametrize('scale', SCALES[:-1] + [1000])
+def test_bench__render__configparser(bench, scale):
+    parts = synthetic_parts(scale)
+    bench(lambda: render_with_configparser(parts))
+
+@pytest.mark.parametrize('scale', SCALES[:-1] + [1000])
+def test_bench__render__streaming(bench, scale):
+    parts = synthetic_parts(scale)
+    assert render_buildout_config(parts) == render_with_configparser(parts)
+    bench(lambda: render_buildout_config(parts))
+
+def test_bench__list_part_templates__cold(bench, templates, tmpdir):
+    index_paths = iter(range(ROUNDS))
+    bench(lambda index: list(list_part_templates(templates, index)),
+          lambda: TemplateIndex(str(tmpdir.join('index{}.json'.format(next(index_paths))))))
+
+def test_bench__list_part_templates__warm(bench, templates, tmpdir):
+    index = TemplateIndex(str(tmpdir.join('index.json')))
+    list(list_part_templates(templates, index))
+    bench(lambda: list(list_part_templates(templates, index)))
+
+def test_bench__build_part_template__cold(bench, templates, tmpdir):
+    index_paths = iter(range(ROUNDS))
+    def resolve_all(index):
+        for i in range(TEMPLATES):
+            build_part_template('part{}'.format(i), templates, index)
+    bench(resolve_all, lambda: TemplateIndex(str(tmpdir.join('index{}.json'.format(next(index_paths))))))
+
+def test_bench__build_part_template__warm(bench, templates, tmpdir):
+    index = TemplateIndex(str(tmpdir.join('index.json')))
+    def resolve_all():
+        for i in range(TEMPLATES):
+            build_part_template('part{}'.format(i), templates, index)
+    resolve_all()
+    bench(resolve_all)
+
+def test_bench__build_parts__templates(bench, templates, tmpdir):
+    index = TemplateIndex(str(tmpdir.join('index.json')))
+    names = ['part{}'.format(i) for i in range(TEMPLATES)]
+    packages, requirements = synthetic_args(100)
+    build_parts(packages, requirements, names, config_path=templates, template_index=index)
+    bench(lambda: build_parts(packages, requirements, names, config_path=templates, template_index=index))
+
+def test_bench__build_part_template__bundle(bench, templates, tmpdir_factory):
+    bundled = tmpdir_factory.mktemp('bundled')
+    for fname in os.listdir(templates):
+        bundled.join(fname).write(open(os.path.join(templates, fname)).read())
+    compile_template_bundle(str(bundled))
+    index_paths = iter(range(ROUNDS))
+    def resolve_all(index):
+        for i in range(TEMPLATES):
+            build_part_template('part{}'.format(i), str(bundled), index)
+    bench(resolve_all, lambda: TemplateIndex(str(bundled.join('index{}.json'.format(next(index_paths))))))
@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+
+import pytest
+
+from buildstrap import buildstrap as buildstrap_module
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmpdir_factory, monkeypatch):
+    '''Keeps the caches of the tests (such as the template index) out of the user's home'''
+    cache_path = tmpdir_factory.mktemp('cache')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(cache_path))
+    monkeypatch.setattr(buildstrap_module, '_template_index', None)
+    return cache_path
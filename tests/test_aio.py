@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import asyncio
+
+import pytest
+
+from buildstrap import aio
+from buildstrap.aio import *
+
+
+def python_command(code):
+    return [sys.executable, '-c', code]
+
+def make_project(tmpdir, name):
+    project = tmpdir.mkdir(name)
+    project.join('requirements.txt').write('docopt\n')
+    return project
+
+def run_args(project, name='foo'):
+    return ['run', '-o', str(project.join('buildout.cfg')), name, 'requirements.txt']
+
+@pytest.fixture
+def mocked_buildout(monkeypatch):
+    '''Replaces buildout's subprocess by a script creating the bin directory'''
+    commands = []
+    def command(config, *args, **kwargs):
+        commands.append(config)
+        return python_command('\n'.join([
+            'import os, sys, time',
+            'print("Installing {}")'.format(config),
+            'os.makedirs(os.path.join(os.path.dirname({!r}), "bin"), exist_ok=True)'.format(config),
+        ]))
+    monkeypatch.setattr(aio, 'buildout_command', command)
+    return commands
+
+
+def test_parse_args():
+    args = parse_args(['run', 'foo', 'requirements.txt'])
+    assert args['run'] is True
+    assert args['<package>'] == 'foo'
+    assert args['--output'] == 'buildout.cfg'
+    with pytest.raises(ValueError):
+        parse_args(['--unknown'])
+
+def test_buildout_command():
+    assert buildout_command('buildout.cfg')[-2:] == ['-c', 'buildout.cfg']
+    command = buildout_command('buildout.cfg', '/cache/.buildstrap.lock')
+    assert command[-3:] == ['/cache/.buildstrap.lock', '-c', 'buildout.cfg']
+    assert command[0] == sys.executable
+    assert buildout_command('buildout.cfg', executable='/usr/bin/python3.12')[0] == '/usr/bin/python3.12'
+
+def test_run_process():
+    lines = []
+    code = asyncio.run(run_process(python_command('import sys; print("a"); print("b", file=sys.stderr); sys.exit(3)'),
+                                   lines.append))
+    assert code == 3
+    assert lines == ['a\n', 'b\n']
+
+def test_run_process__timeout(tmpdir):
+    pid_file = tmpdir.join('pid')
+    command = python_command('import os, time; open({!r}, "w").write(str(os.getpid())); time.sleep(30)'.format(str(pid_file)))
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(run_process(command, lambda line: None), 0.5))
+    assert time.monotonic() - start < 10
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read()), 0)
+
+def test_buildstrap_async(tmpdir, mocked_buildout, capsys):
+    project = make_project(tmpdir, 'project')
+    lines = []
+    assert asyncio.run(buildstrap_async(run_args(project), lines.append)) == 0
+    assert mocked_buildout == [str(project.join('buildout.cfg'))]
+    assert lines == ['Installing {}\n'.format(project.join('buildout.cfg'))]
+    assert project.join('var', '.buildstrap-state.json').exists()
+    # nothing changed: skipped
+    assert asyncio.run(buildstrap_async(run_args(project), lines.append)) == 0
+    assert len(mocked_buildout) == 1
+    assert 'skipping buildout' in capsys.readouterr()[1]
+
+def test_buildstrap_async__failure(tmpdir, monkeypatch):
+    project = make_project(tmpdir, 'project')
+    monkeypatch.setattr(aio, 'buildout_command', lambda config, *args, **kwargs: python_command('import sys; sys.exit(1)'))
+    assert asyncio.run(buildstrap_async(run_args(project), lambda line: None)) == 1
+    assert not project.join('var', '.buildstrap-state.json').exists()
+
+def test_buildstrap_async__timeout(tmpdir, monkeypatch):
+    project = make_project(tmpdir, 'project')
+    monkeypatch.setattr(aio, 'buildout_command', lambda config, *args, **kwargs: python_command('import time; time.sleep(30)'))
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(buildstrap_async(run_args(project), lambda line: None, timeout=0.5))
+    assert not project.join('var', '.buildstrap-state.json').exists()
+
+def test_buildstrap_async__generate(tmpdir):
+    project = make_project(tmpdir, 'project')
+    assert asyncio.run(buildstrap_async(['generate', '-o', str(project.join('buildout.cfg')), 'foo', 'requirements.txt'])) == 0
+    assert project.join('buildout.cfg').exists()
+
+def test_gather_buildstrap(tmpdir, monkeypatch):
+    projects = [make_project(tmpdir, 'project{}'.format(i)) for i in range(12)]
+    marker = tmpdir.mkdir('running')
+    # each buildout records how many are running at once
+    monkeypatch.setattr(aio, 'buildout_command', lambda config, *args, **kwargs: python_command('\n'.join([
+        'import os, time',
+        'marker = os.path.join({!r}, str(os.getpid()))'.format(str(marker)),
+        'open(marker, "w").close()',
+        'print(len(os.listdir({!r})))'.format(str(marker)),
+        'time.sleep(0.2)',
+        'os.unlink(marker)',
+        'os.makedirs(os.path.join(os.path.dirname({!r}), "bin"), exist_ok=True)'.format(config),
+    ])))
+    lines = []
+    codes = asyncio.run(gather_buildstrap([run_args(p, 'foo{}'.format(i)) for i, p in enumerate(projects)],
+                                          jobs=3, output=lambda args, line: lines.append((args['<package>'], line))))
+    assert codes == [0] * 12
+    assert sorted(name for name, _ in lines) == sorted('foo{}'.format(i) for i in range(12))
+    assert max(int(line) for _, line in lines) <= 3
+
+def test_gather_buildstrap__exceptions(tmpdir, mocked_buildout):
+    project = make_project(tmpdir, 'project')
+    results = asyncio.run(gather_buildstrap([run_args(project), ['--unknown']], output=lambda args, line: None))
+    assert results[0] == 0
+    assert isinstance(results[1], ValueError)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+import json
+
+import pytest
+
+from buildstrap.batch import *
+
+
+def make_manifest(tmpdir, projects):
+    manifest = tmpdir.join('manifest.json')
+    manifest.write(json.dumps(projects))
+    for project in projects:
+        tmpdir.join(project.get('root', '.')).ensure(dir=True)
+    return str(manifest)
+
+def make_args(manifest, **kwarg):
+    args = {'<manifest>': manifest,
+            '--interpreter': None,
+            '--config': '',
+            '--src': None,
+            '--env': 'var',
+            '--bin': 'bin',
+            '--output': 'buildout.cfg',
+            '--force': False,
+            '--jobs': '2',
+            '--pool': 'thread'}
+    args.update(kwarg)
+    return args
+
+PROJECTS = [
+    {'package': 'marvin', 'requirements': ['requirements.txt'], 'root': 'marvin'},
+    {'package': 'dent,prefect', 'requirements': 'requirements.txt,requirements-test.txt',
+        'parts': ['pytest'], 'root': 'dent'},
+    {'package': 'zaphod', 'requirements': ['requirements.txt'], 'parts': ['doesnotexists'], 'root': 'zaphod'},
+    {'requirements': ['requirements.txt'], 'root': 'trillian'},
+]
+
+class TestFun__load_manifest:
+    def test_load_manifest(self, tmpdir):
+        projects = load_manifest(make_manifest(tmpdir, PROJECTS))
+        assert [p['root'] for p in projects] == [str(tmpdir.join(p['root'])) for p in PROJECTS]
+
+    def test_load_manifest__invalid(self, tmpdir):
+        manifest = tmpdir.join('manifest.json')
+        manifest.write('{"package": "marvin"}')
+        with pytest.raises(ValueError):
+            load_manifest(str(manifest))
+
+class TestFun__batch:
+    @pytest.mark.parametrize('pool', ['thread', 'process'])
+    def test_batch(self, pool, tmpdir, capsys):
+        assert batch(make_args(make_manifest(tmpdir, PROJECTS), **{'--pool': pool})) == 1
+        out, err = capsys.readouterr()
+        lines = out.splitlines()
+        assert lines[0] == 'created   marvin ({})'.format(tmpdir.join('marvin', 'buildout.cfg'))
+        assert lines[1] == 'created   dent ({})'.format(tmpdir.join('dent', 'buildout.cfg'))
+        assert lines[2].startswith('failed    zaphod: Missing template file doesnotexists.part.cfg')
+        assert lines[3].startswith('failed    {}: '.format(tmpdir.join('trillian')))
+        assert lines[4] == '4 projects, 2 succeeded, 2 failed'
+
+        dent_config = tmpdir.join('dent', 'buildout.cfg').read()
+        assert 'package = dent prefect\n' in dent_config
+        assert '[pytest]\n' in dent_config
+        assert not tmpdir.join('zaphod', 'buildout.cfg').exists()
+
+    def test_batch__exists(self, tmpdir, capsys):
+        manifest = make_manifest(tmpdir, PROJECTS[:1])
+        assert batch(make_args(manifest)) == 0
+        assert batch(make_args(manifest)) == 0
+        assert capsys.readouterr()[0].splitlines()[-2].startswith('unchanged marvin')
+        assert batch(make_args(manifest, **{'--interpreter': 'python3'})) == 1
+        assert capsys.readouterr()[0].startswith('failed    marvin: Cannot overwrite')
+        assert batch(make_args(manifest, **{'--interpreter': 'python3', '--force': True})) == 0
+        assert capsys.readouterr()[0].startswith('updated   marvin')
+
+    def test_batch__unknown_pool(self, tmpdir):
+        with pytest.raises(ValueError):
+            batch(make_args(make_manifest(tmpdir, PROJECTS), **{'--pool': 'fiber'}))
+
+    def test_batch__warm_index(self, tmpdir, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        from buildstrap import batch as batch_module
+        from buildstrap.buildstrap import TemplateIndex
+        saved = []
+        class CheckingExecutor(ThreadPoolExecutor):
+            def __init__(self, *args, **kwargs):
+                # workers not forked from this process read the warm index back from its file
+                saved.append(os.path.exists(TemplateIndex.default_path()))
+                super().__init__(*args, **kwargs)
+        monkeypatch.setitem(batch_module.POOLS, 'thread', CheckingExecutor)
+        assert batch(make_args(make_manifest(tmpdir, PROJECTS[:2]))) == 0
+        assert saved == [True]
+
+    def test_batch__resolve(self, tmpdir, monkeypatch, capsys):
+        # the requirements are resolved within each project, whatever the current directory
+        monkeypatch.chdir(tmpdir.mkdir('elsewhere'))
+        manifest = make_manifest(tmpdir, PROJECTS[:1])
+        tmpdir.join('marvin', 'requirements.txt').write('docopt\n')
+        assert batch(make_args(manifest, **{'--resolve': True})) == 0
+        assert capsys.readouterr()[0].startswith('created   marvin')
+        assert 'requirements-eggs = docopt\n' in tmpdir.join('marvin', 'buildout.cfg').read()
@@ -39,6 +39,36 @@ def test_list():
         assert str(lb_thr) == '\n'.join(l_thr)
 
 
+def test_list__nested_context():
+    lb_two = ListBuildout(['a', 'b'])
+    with ListBuildout.generate_context():
+        with ListBuildout.generate_context():
+            assert str(lb_two) == 'a\nb'
+        assert str(lb_two) == 'a\nb'
+    assert str(lb_two) == str(['a', 'b'])
+
+def test_list__threads():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    lb_two = ListBuildout(['a', 'b'])
+    barrier = threading.Barrier(16)
+
+    def render(i):
+        # half the threads render within the context, the other half outside of it
+        barrier.wait()
+        results = set()
+        for _ in range(500):
+            if i % 2:
+                with ListBuildout.generate_context():
+                    results.add(str(lb_two))
+            else:
+                results.add(str(lb_two))
+        return i, results
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for i, results in executor.map(render, range(16)):
+            assert results == ({'a\nb'} if i % 2 else {str(['a', 'b'])})
+
 class TestFun__build_part_target:
     def test_build_part_target__target(self):
         assert build_part_target('a') == {
@@ -125,6 +155,136 @@ class TestFun__list_part_template:
     def test_list(self):
         assert list(list_part_templates('')) == ['pytest', 'sphinx']
 
+    def test_list_user(self, tmpdir):
+        tmpdir.join('foo.part.cfg').write('[foo]\nrecipe = bar\n')
+        index = TemplateIndex(str(tmpdir.join('index.json')))
+        assert list(list_part_templates(str(tmpdir), index)) == ['pytest', 'sphinx', 'foo']
+
+##
+
+class TestClass__TemplateIndex:
+    def test_user_template(self, tmpdir):
+        config = tmpdir.mkdir('config')
+        config.join('foo.part.cfg').write('[foo]\nrecipe = bar\n')
+        config.join('pytest.part.cfg').write('[pytest]\nrecipe = overriden\n')
+        index = TemplateIndex(str(tmpdir.join('index.json')))
+        assert build_part_template('foo', str(config), index) == {'foo': OrderedDict([('recipe', 'bar')])}
+        assert build_part_template('pytest', str(config), index) == {'pytest': OrderedDict([('recipe', 'overriden')])}
+
+    def test_persistence(self, tmpdir):
+        config = tmpdir.mkdir('config')
+        config.join('foo.part.cfg').write('[foo]\nrecipe = bar\n')
+        index_path = str(tmpdir.join('index.json'))
+        index = TemplateIndex(index_path)
+        build_part_template('foo', str(config), index)
+        index.save()
+
+        index = TemplateIndex(index_path)
+        entry = index.directory(str(config))['foo.part.cfg']
+        assert entry['sections'] == {'foo': {'recipe': 'bar'}}
+        assert not index._dirty
+
+    def test_incremental_update(self, tmpdir):
+        config = tmpdir.mkdir('config')
+        template = config.join('foo.part.cfg')
+        template.write('[foo]\nrecipe = bar\n')
+        index = TemplateIndex(str(tmpdir.join('index.json')))
+        assert build_part_template('foo', str(config), index)['foo']['recipe'] == 'bar'
+
+        template.write('[foo]\nrecipe = barbaz\n')
+        assert build_part_template('foo', str(config), index)['foo']['recipe'] == 'barbaz'
+
+        config.join('qux.part.cfg').write('[qux]\nrecipe = quux\n')
+        assert 'qux' in list(list_part_templates(str(config), index))
+
+        template.remove()
+        with pytest.raises(FileNotFoundError):
+            build_part_template('foo', str(config), index)
+
+    def test_prune(self, tmpdir):
+        index_path = str(tmpdir.join('index.json'))
+        configs = [tmpdir.mkdir('config{}'.format(i)) for i in range(2)]
+        index = TemplateIndex(index_path)
+        for config in configs:
+            config.join('foo.part.cfg').write('[foo]\nrecipe = bar\n')
+            build_part_template('foo', str(config), index)
+        index.save()
+
+        configs[0].remove()
+        index = TemplateIndex(index_path)
+        assert str(configs[0]) not in index.directories
+        assert str(configs[1]) in index.directories
+        index.save()
+        assert str(configs[0]) not in open(index_path).read()
+
+    def test_corrupted_index(self, tmpdir):
+        index_path = tmpdir.join('index.json')
+        index_path.write('{not json')
+        assert list(list_part_templates('', TemplateIndex(str(index_path)))) == ['pytest', 'sphinx']
+
+##
+
+class TestFun__template_bundle:
+    def test_compile(self, tmpdir):
+        config = tmpdir.mkdir('config')
+        config.join('foo.part.cfg').write('[foo]\nrecipe = bar\n')
+        config.join('pytest.part.cfg').write('[pytest]\nrecipe = overriden\n')
+        assert compile_template_bundle(str(config)) == (str(config.join(TEMPLATE_BUNDLE)), 2)
+        assert load_template_bundle(str(config.join(TEMPLATE_BUNDLE))) == {
+                'foo.part.cfg': {'foo': {'recipe': 'bar'}},
+                'pytest.part.cfg': {'pytest': {'recipe': 'overriden'}},
+            }
+
+        # templates are taken out of the bundle, without reading the files
+        config.join('foo.part.cfg').remove()
+        config.join('pytest.part.cfg').remove()
+        index = TemplateIndex(str(tmpdir.join('index.json')))
+        assert list(list_part_templates(str(config), index)) == ['pytest', 'sphinx', 'foo', 'pytest']
+        assert build_part_template('foo', str(config), index) == {'foo': OrderedDict([('recipe', 'bar')])}
+        assert build_part_template('pytest', str(config), index) == {'pytest': OrderedDict([('recipe', 'overriden')])}
+        assert build_part_template('sphinx', str(config), index)['sphinx']['recipe'] == 'collective.recipe.sphinxbuilder'
+        with pytest.raises(FileNotFoundError):
+            build_part_template('qux', str(config), index)
+        assert str(config) not in index.directories
+
+    def test_recompile(self, tmpdir, capsys):
+        config = tmpdir.mkdir('config')
+        config.join('foo.part.cfg').write('[foo]\nrecipe = bar\n')
+        compile_template_bundle(str(config))
+        index = TemplateIndex(str(tmpdir.join('index.json')))
+        assert build_part_template('foo', str(config), index)['foo']['recipe'] == 'bar'
+        assert 'Warning' not in capsys.readouterr()[1]
+
+        # the stale bundle is still used, with a warning
+        config.join('foo.part.cfg').write('[foo]\nrecipe = barbaz\n')
+        bundle_mtime = config.join(TEMPLATE_BUNDLE).mtime()
+        config.join('foo.part.cfg').setmtime(bundle_mtime + 10)
+        index = TemplateIndex(str(tmpdir.join('index.json')))
+        assert build_part_template('foo', str(config), index)['foo']['recipe'] == 'bar'
+        assert 'is older than foo.part.cfg, compile it again' in capsys.readouterr()[1]
+
+        compile_template_bundle(str(config))
+        assert build_part_template('foo', str(config), index)['foo']['recipe'] == 'barbaz'
+
+    @pytest.mark.parametrize('content,error', [
+        ('{not json', 'Expecting'),
+        ('{"format": "other"}', 'not a template bundle'),
+        ('{"format": "buildstrap-templates", "version": 0}', 'unsupported bundle version'),
+        ('{"format": "buildstrap-templates", "version": 1, "templates": {"foo.part.cfg": []}}', 'malformed'),
+        ('{"format": "buildstrap-templates", "version": 1, "templates": {}, "digest": "0"}', 'digest mismatch'),
+    ])
+    def test_invalid(self, tmpdir, capsys, content, error):
+        config = tmpdir.mkdir('config')
+        config.join('foo.part.cfg').write('[foo]\nrecipe = bar\n')
+        config.join(TEMPLATE_BUNDLE).write(content)
+        with pytest.raises(ValueError, match=error):
+            load_template_bundle(str(config.join(TEMPLATE_BUNDLE)))
+        # the directory is used instead
+        index = TemplateIndex(str(tmpdir.join('index.json')))
+        assert build_part_template('foo', str(config), index)['foo']['recipe'] == 'bar'
+        assert list(list_part_templates(str(config), index)) == ['pytest', 'sphinx', 'foo']
+        assert 'ignoring template bundle' in capsys.readouterr()[1]
+
 ##
 
 class TestFun__build_part_buildout:
@@ -304,6 +464,16 @@ class TestFun__build_part_buildout:
         assert buildout_part['buildout']['parts-directory']        == '/bar/parts'
         assert buildout_part['buildout']['bin-directory']          == '/fubar'
 
+    def test_build_part_buildout__download_cache(self):
+        assert 'download-cache' not in build_part_buildout()['buildout']
+        assert build_part_buildout(download_cache=True)['buildout']['download-cache'] == '${buildout:directory}/var/downloads'
+        assert build_part_buildout(env_path='/bar', download_cache=True)['buildout']['download-cache'] == '/bar/downloads'
+
+    def test_build_part_buildout__eggs_path(self):
+        buildout_part = build_part_buildout(env_path='/bar', eggs_path='/shared/eggs')
+        assert buildout_part['buildout']['eggs-directory']         == '/shared/eggs'
+        assert buildout_part['buildout']['develop-eggs-directory'] == '/bar/develop-eggs'
+
 class TestFun_build_parts:
     def get_buildout_part(self, packages, parts=[], requirements=[]):
         return OrderedDict([
@@ -391,6 +561,21 @@ class TestFun_build_parts:
         assert parts['a']['recipe'] == 'zc.recipe.egg'
         assert parts['a']['eggs'] == ['${buildout:requirements-eggs}', 'a', 'x']
 
+    def test_build_parts__resolve(self, tmpdir):
+        tmpdir.join('b').write('docopt\n-r c\n')
+        tmpdir.join('c').write('zc.buildout>=2\ndocopt<1\n')
+        parts = build_parts(packages='a', requirements='b', root_path=str(tmpdir), resolve=True)
+        assert 'requirements' not in parts['buildout']
+        assert 'extensions' not in parts['buildout']
+        assert parts['buildout']['requirements-eggs'] == ['docopt<1', 'zc.buildout>=2']
+
+    def test_build_parts__resolve_vcs(self, tmpdir):
+        tmpdir.join('b').write('docopt\n-e git+https://github.com/guyzmo/git-repo#egg=git-repo\n')
+        parts = build_parts(packages='a', requirements='b', root_path=str(tmpdir), resolve=True)
+        assert parts['buildout']['extensions'] == 'gp.vcsdevelop'
+        assert parts['buildout']['requirements-eggs'] == ['docopt', 'git-repo']
+        assert parts['buildout']['vcs-extend-develop'] == ['git+https://github.com/guyzmo/git-repo#egg=git-repo']
+
 from contextlib import contextmanager
 
 class UnitConfig:
@@ -758,17 +943,28 @@ class MockupsMixin:
 
         buf = StringIO()
         orig_open = builtins.open
+        orig_replace = os.replace
 
         def mock_open(fname, *args, **kwarg):
-            if fname == target:
+            # the file is written aside, then renamed over the target
+            if fname == target or (fname.startswith(target + '.') and fname.endswith('.tmp')):
+                if 'b' in (args[0] if args else kwarg.get('mode', 'r')):
+                    # the existing file is read as bytes, for its digest
+                    return io.BytesIO(buf.getvalue().encode('utf-8'))
                 # mimic open() by sending buffer as a generator
                 return buf
             else:
                 return orig_open(fname, *args, **kwarg)
 
+        def mock_replace(src, dst):
+            if dst != target:
+                return orig_replace(src, dst)
+
         builtins.open = mock_open
+        os.replace = mock_replace
         yield buf
         builtins.open = orig_open
+        os.replace = orig_replace
 
     @contextmanager
     def mocked_os_path_exists(self, target, value):
@@ -842,8 +1038,292 @@ class TestFun_generate_buildout_config(MockupsMixin):
                 generate_buildout_config(parts=config.internal, output='test_file')
                 assert buf.getvalue() == config.output
 
+    def test__config__unchanged(self, tmpdir):
+        output = tmpdir.join('buildout.cfg')
+        assert generate_buildout_config(parts={'foobar': {'foo': 'bar'}}, output=str(output)) == 'created'
+        output.setmtime(0)
+        assert generate_buildout_config(parts={'foobar': {'foo': 'bar'}}, output=str(output)) == 'unchanged'
+        assert output.mtime() == 0
+        with pytest.raises(FileExistsError):
+            generate_buildout_config(parts={'foobar': {'foo': 'baz'}}, output=str(output))
+        assert generate_buildout_config(parts={'foobar': {'foo': 'baz'}}, output=str(output), force=True) == 'updated'
+        assert output.read() == '[foobar]\nfoo = baz\n\n'
+        assert output.mtime() != 0
+
+    def test__config__unchanged__encoding(self, tmpdir):
+        output = tmpdir.join('buildout.cfg')
+        assert generate_buildout_config(parts={'foobar': {'foo': 'café'}}, output=str(output)) == 'created'
+        assert generate_buildout_config(parts={'foobar': {'foo': 'café'}}, output=str(output)) == 'unchanged'
+        # hand edited in latin-1
+        output.write_binary('[foobar]\nfoo = caf\xe9\n\n'.encode('latin-1'))
+        with pytest.raises(FileExistsError):
+            generate_buildout_config(parts={'foobar': {'foo': 'café'}}, output=str(output))
+
+    def test__config__same_as_configparser(self):
+        import io
+        from configparser import ConfigParser
+        parts = OrderedDict([
+            ('buildout', OrderedDict([
+                ('parts', ListBuildout(['a', 'b'])),
+                ('develop', ListBuildout(['.'])),
+                ('empty', ListBuildout([])),
+                ('Upper-Case', 'value'),
+                ('multiline', 'first\nsecond'),
+                ('number', 42),
+            ])),
+            ('a', {'recipe': 'zc.recipe.egg', 'eggs': ListBuildout(['${buildout:eggs}', 'pytest'])}),
+            ('b', {}),
+        ])
+        with ListBuildout.generate_context():
+            parser = ConfigParser()
+            parser.read_dict(parts)
+            expected = io.StringIO()
+            parser.write(expected)
+        assert render_buildout_config(parts) == expected.getvalue()
+        for config in unit_config_list.values():
+            assert render_buildout_config(config.internal) == config.output
+
+class TestFun_merge_buildout_config:
+    def test_merge(self, tmpdir):
+        output = tmpdir.join('buildout.cfg')
+        parts = build_parts('foo', 'requirements.txt', resolve=False)
+        assert merge_buildout_config(parts, '-') is parts
+        merged = merge_buildout_config(parts, str(output))
+        assert list(merged) == list(parts) + ['buildstrap']
+        generate_buildout_config(parts, str(output))
+
+        # hand tuned sections and options
+        content = output.read()
+        content = content.replace('[foo]\n', '[foo]\nscripts = foo\n')
+        content = content.replace('newest = false\n', 'newest = false\nshow-picked-versions = true\n')
+        content = content.replace('parts = foo\n', 'parts = foo\n\tdocs\n\tremoved\n')
+        content += '[docs]\nrecipe = collective.recipe.sphinxbuilder\neggs +=\n\tsphinx\n\n'
+        output.write(content)
+
+        parts = build_parts('foo,bar', 'requirements.txt', interpreter='python3')
+        parts['buildout']['download-cache'] = 'var/downloads'
+        merged = merge_buildout_config(parts, str(output))
+        assert list(merged) == ['buildout', 'foo', 'docs', 'buildstrap']
+        assert merged['buildout']['package'] == 'foo bar'
+        assert merged['buildout']['show-picked-versions'] == 'true'
+        assert list(merged['buildout'])[-1] == 'download-cache'
+        assert merged['buildout']['parts'] == ['foo', 'docs']
+        assert merged['foo'] == OrderedDict([('scripts', 'foo'), ('recipe', 'zc.recipe.egg'),
+                                             ('eggs', parts['foo']['eggs']), ('interpreter', 'python3')])
+        assert merged['docs'] == {'recipe': 'collective.recipe.sphinxbuilder', 'eggs +': 'sphinx'}
+
+        assert generate_buildout_config(merged, str(output), force=True) == 'updated'
+        merged_content = output.read()
+        assert 'eggs += sphinx\n' in merged_content
+        assert parse(io.StringIO(merged_content), 'buildout.cfg')['docs'] == merged['docs']
+
+        # generating the same configuration again changes nothing
+        parts = build_parts('foo,bar', 'requirements.txt', interpreter='python3')
+        parts['buildout']['download-cache'] = 'var/downloads'
+        assert generate_buildout_config(merge_buildout_config(parts, str(output)), str(output)) == 'unchanged'
+
+        # options buildstrap does not generate anymore are removed, hand written ones are kept
+        output.write(output.read().replace('newest = false\n', 'newest = false\nextends = base.cfg\n'))
+        parts = build_parts('foo,bar', 'requirements.txt', interpreter='python3')
+        merged = merge_buildout_config(parts, str(output))
+        assert 'download-cache' not in merged['buildout']
+        assert merged['buildout']['show-picked-versions'] == 'true'
+        assert merged['buildout']['extends'] == 'base.cfg'
+        assert 'extends' not in merged['buildstrap']['buildout']
+        assert merged['buildstrap']['foo'] == ['recipe', 'eggs', 'interpreter']
+
+    def test_merge__template_sections(self, tmpdir):
+        output = tmpdir.join('buildout.cfg')
+        def template_parts(*templates):
+            parts = build_parts('foo', 'requirements.txt', resolve=False)
+            for name, options in templates:
+                parts[name] = OrderedDict(options)
+                parts['buildout']['parts'].append(name)
+            return parts
+        pytest_part = ('pytest', [('recipe', 'zc.recipe.egg'), ('eggs', 'pytest'), ('arguments', '["-x"]')])
+        docs_part = ('docs', [('recipe', 'collective.recipe.sphinxbuilder')])
+        generate_buildout_config(merge_buildout_config(template_parts(pytest_part, docs_part), str(output)), str(output))
+        output.write(output.read().replace('[pytest]\n', '[pytest]\nhand = written\n'))
+
+        # an option removed from a template is removed, hand written ones are kept
+        pytest_part = ('pytest', pytest_part[1][:2])
+        merged = merge_buildout_config(template_parts(pytest_part, docs_part), str(output))
+        assert merged['pytest'] == {'hand': 'written', 'recipe': 'zc.recipe.egg', 'eggs': 'pytest'}
+        assert merged['buildstrap']['pytest'] == ['recipe', 'eggs']
+        generate_buildout_config(merged, str(output), force=True)
+
+        # the section of a template not selected anymore is removed, unless options were added by hand
+        merged = merge_buildout_config(template_parts(), str(output))
+        assert 'docs' not in merged
+        assert merged['pytest'] == {'hand': 'written'}
+        assert merged['buildout']['parts'] == ['foo', 'pytest']
+        assert 'pytest' not in merged['buildstrap']
+
+    def test_merge__concurrent(self, tmpdir, monkeypatch):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import buildstrap.buildstrap
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join('buildout.cfg').write('[buildout]\nparts =\n')
+        events = []
+        parse, atomic_write = buildstrap.buildstrap.parse, buildstrap.buildstrap.atomic_write
+
+        def slow_parse(*args):
+            # widens the window between the read of the configuration and its writing
+            events.append('read')
+            time.sleep(0.01)
+            return parse(*args)
+
+        @contextmanager
+        def recorded_write(path):
+            with atomic_write(path) as f:
+                yield f
+            events.append('write')
+        monkeypatch.setattr(buildstrap.buildstrap, 'parse', slow_parse)
+        monkeypatch.setattr(buildstrap.buildstrap, 'atomic_write', recorded_write)
+
+        def generate(i):
+            return generate_from_args({
+                'run': False, 'show': False, 'debug': False, 'generate': True,
+                '<package>': 'foo{}'.format(i), '<requirements>': ['requirements.txt'],
+                '--part': [], '--interpreter': None, '--config': '', '--output': 'buildout.cfg',
+                '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+                '--force': False, '--verbose': 0, '--merge': True,
+            })[1]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert list(executor.map(generate, range(8))) == ['updated'] * 8
+        # each merge reads the configuration written by the previous one
+        assert events == ['read', 'write'] * 8
+
+    def test_merge__hand_written(self, tmpdir):
+        output = tmpdir.join('buildout.cfg')
+        output.write('[buildout]\nextends = base.cfg\ndirectory = ..\ndownload-cache = /tmp/downloads\n')
+        merged = merge_buildout_config(build_parts('foo', 'requirements.txt', resolve=False), str(output))
+        assert merged['buildout']['extends'] == 'base.cfg'
+        assert merged['buildout']['download-cache'] == '/tmp/downloads'
+        assert merged['buildout']['directory'] == '.'
+
+    def test_buildstrap__merge(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join('buildout.cfg').write('[buildout]\nparts =\n\n[custom]\nrecipe = foo\n')
+        args = {
+            'run': False, 'show': False, 'debug': False, 'generate': True,
+            '<package>': 'foo', '<requirements>': ['requirements.txt'],
+            '--part': [], '--interpreter': None, '--config': '', '--output': 'buildout.cfg',
+            '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+            '--force': False, '--verbose': 0, '--merge': True,
+        }
+        assert buildstrap(args) == 0
+        content = parse(io.StringIO(tmpdir.join('buildout.cfg').read()), 'buildout.cfg')
+        assert list(content) == ['buildout', 'custom', 'foo', 'buildstrap']
+        assert content['buildout']['parts'] == 'foo'
+
+class TestFun_generate_buildout_config__threads:
+    def test_generate(self, tmpdir):
+        from concurrent.futures import ThreadPoolExecutor
+        configs = [config for name, config in sorted(unit_config_list.items())
+                   if not name.startswith('config_debug_')]
+
+        def generate(i):
+            config = configs[i % len(configs)]
+            output = str(tmpdir.join('buildout{}.cfg'.format(i)))
+            generate_buildout_config(config.internal, output)
+            with open(output, 'r') as f:
+                return f.read() == config.output
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            assert all(executor.map(generate, range(200)))
+
+    def test_same_output(self, tmpdir):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        output = str(tmpdir.join('buildout.cfg'))
+        parts = [build_parts('package{}'.format(i), ['requirements{}.txt'.format(j) for j in range(200)])
+                 for i in range(8)]
+        contents = {render_buildout_config(p) for p in parts}
+        stop = threading.Event()
+        seen = []
+
+        def read():
+            while not stop.is_set():
+                if os.path.exists(output):
+                    with open(output, 'r') as f:
+                        seen.append(f.read())
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        try:
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                results = list(executor.map(lambda i: generate_buildout_config(parts[i % len(parts)], output, force=True),
+                                            range(200)))
+        finally:
+            stop.set()
+            reader.join()
+        assert results.count('created') == 1
+        assert set(seen) <= contents
+        assert tmpdir.join('buildout.cfg').read() in contents
+        assert tmpdir.listdir() == [tmpdir.join('buildout.cfg')]
+
+    def test_exists_check(self, tmpdir, monkeypatch):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import buildstrap.buildstrap
+        output = str(tmpdir.join('buildout.cfg'))
+        atomic_write = buildstrap.buildstrap.atomic_write
+
+        @contextmanager
+        def slow_write(path):
+            # widens the window between the check of the file and its writing
+            time.sleep(0.01)
+            with atomic_write(path) as f:
+                yield f
+        monkeypatch.setattr(buildstrap.buildstrap, 'atomic_write', slow_write)
+
+        def generate(i):
+            try:
+                return generate_buildout_config({'foobar': {'foo': str(i)}}, output)
+            except FileExistsError:
+                return 'exists'
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(generate, range(32)))
+        # a single generation wins, the other ones see its file
+        assert results.count('created') == 1
+        assert results.count('exists') == 31
+
+    def test_atomic_write__failure(self, tmpdir):
+        from buildstrap.utils import atomic_write
+        target = tmpdir.join('buildout.cfg')
+        target.write('previous')
+        with pytest.raises(RuntimeError):
+            with atomic_write(str(target)) as f:
+                f.write('partial')
+                raise RuntimeError()
+        assert target.read() == 'previous'
+        assert tmpdir.listdir() == [target]
+
+    def test_configparser(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from configparser import ConfigParser
+        configs = [config for name, config in sorted(unit_config_list.items())
+                   if not name.startswith('config_debug_')]
+
+        def render(i):
+            config = configs[i % len(configs)]
+            with ListBuildout.generate_context():
+                parser = ConfigParser()
+                parser.read_dict(config.internal)
+                content = io.StringIO()
+                parser.write(content)
+            return content.getvalue() == config.output
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            assert all(executor.map(render, range(200)))
+
 class TestFun_test_buildstrap(MockupsMixin):
-    def test_buildstrap(self, capsys):
+    def test_buildstrap(self, capsys, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
         with self.mocked_buildout() as buildout_mock:
             for name, config in unit_config_list.items():
                 with self.mocked_os_path_exists(config.args['--output'], True):
@@ -864,3 +1344,41 @@ class TestFun_test_buildstrap(MockupsMixin):
                             assert buf.getvalue() == config.output
 
 
+
+    def test_buildstrap__fingerprint(self, capsys, monkeypatch, tmpdir):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.join('requirements.txt').write('docopt\n')
+        tmpdir.mkdir('bin')
+        args = dict(unit_config_list['config_run_min'].args, **{'--output': 'buildout.cfg', '--force': True})
+        with self.mocked_buildout() as buildout_mock:
+            assert buildstrap(args) == 0
+            assert buildout_mock.ran == True
+            assert tmpdir.join('var', '.buildstrap-state.json').exists()
+
+            buildout_mock.ran = False
+            assert buildstrap(args) == 0
+            assert buildout_mock.ran == False
+            assert 'skipping buildout' in capsys.readouterr()[1]
+
+            assert buildstrap(dict(args, **{'--always-run': True})) == 0
+            assert buildout_mock.ran == True
+
+            for change in [lambda: tmpdir.join('requirements.txt').write('docopt\npytest\n'),
+                           lambda: tmpdir.join('setup.py').write('from setuptools import setup\n'),
+                           lambda: args.update({'--interpreter': 'python3'})]:
+                buildout_mock.ran = False
+                change()
+                assert buildstrap(args) == 0
+                assert buildout_mock.ran == True
+
+            buildout_mock.ran = False
+            tmpdir.join('bin').remove()
+            assert buildstrap(args) == 0
+            assert buildout_mock.ran == True
+
+            # files that are not UTF-8 are fingerprinted as well
+            for path in ('requirements.txt', 'setup.py'):
+                buildout_mock.ran = False
+                tmpdir.join(path).write_binary('# caf\xe9\ndocopt\n'.encode('latin-1'))
+                assert buildstrap(args) == 0
+                assert buildout_mock.ran == True
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import importlib.util
+
+import pytest
+
+from buildstrap import bytecode
+from buildstrap.bytecode import *
+from buildstrap import buildstrap as buildstrap_module
+
+
+@pytest.fixture
+def environment(tmpdir):
+    egg = tmpdir.join('var', 'eggs', 'foo-1.0-py3.egg').ensure(dir=True)
+    egg.join('foo', '__init__.py').ensure().write('x = 1\n')
+    egg.join('foo', 'py2.py').write('print "python 2"\n')
+    src = tmpdir.join('src')
+    src.join('bar', '__init__.py').ensure().write('y = 2\n')
+    src.join('bar.egg-info', 'top_level.txt').ensure().write('bar\n')
+    src.join('.tox', 'lib.py').ensure().write('z = 3\n')
+    src.join('var', 'eggs', 'other.py').ensure().write('z = 3\n')
+    develop_eggs = tmpdir.join('var', 'develop-eggs').ensure(dir=True)
+    develop_eggs.join('bar.egg-link').write('{}\n.'.format(src))
+    develop_eggs.join('missing.egg-link').write('{}\n.'.format(tmpdir.join('missing')))
+    return tmpdir
+
+def test_develop_paths(environment):
+    assert develop_paths(str(environment.join('var', 'develop-eggs'))) == [str(environment.join('src', 'bar'))]
+    assert develop_paths(str(environment.join('nowhere'))) == []
+
+def test_egg_packages(tmpdir):
+    # src layout: the egg-info and the packages are within src, SOURCES.txt is relative to setup.py
+    src = tmpdir.join('src')
+    src.join('foo', '__init__.py').ensure().write('x = 1\n')
+    src.join('foo_cli.py').write('x = 1\n')
+    src.join('foo.egg-info', 'SOURCES.txt').ensure().write(
+            'setup.py\nsrc/foo/__init__.py\nsrc/foo_cli.py\nsrc/foo.egg-info/PKG-INFO\n')
+    assert egg_packages(str(src)) == [str(src.join('foo', '__init__.py')), str(src.join('foo_cli.py'))]
+    src.join('foo.egg-info', 'top_level.txt').write('foo\nfoo_cli\n')
+    assert egg_packages(str(src)) == [str(src.join('foo')), str(src.join('foo_cli.py'))]
+    assert egg_packages(str(tmpdir)) == []
+
+def test_source_files(environment):
+    roots = [str(environment.join('var', 'eggs')), str(environment.join('src'))]
+    files = source_files(roots + roots, [str(environment.join('src', 'var'))])
+    assert sorted(os.path.relpath(f, str(environment)) for f in files) == [
+        'src/bar/__init__.py', 'var/eggs/foo-1.0-py3.egg/foo/__init__.py', 'var/eggs/foo-1.0-py3.egg/foo/py2.py']
+
+def test_is_current(tmpdir, monkeypatch):
+    source = tmpdir.join('mod.py')
+    source.write('x = 1\n')
+    assert not is_current(str(source))
+    assert compile_file(str(source)) is None
+    assert is_current(str(source))
+    source.write('x = 22\n')
+    assert not is_current(str(source))
+    # hash based bytecode, as written when SOURCE_DATE_EPOCH is set
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '0')
+    assert compile_file(str(source)) is None
+    assert open(importlib.util.cache_from_source(str(source)), 'rb').read(8)[4] & 0b1
+    assert is_current(str(source))
+
+@pytest.mark.parametrize('threshold', [0, POOL_THRESHOLD])
+def test_precompile(environment, monkeypatch, threshold):
+    monkeypatch.setattr(bytecode, 'POOL_THRESHOLD', threshold)
+    roots = [str(environment.join('var', 'eggs')), str(environment.join('src'))]
+    excluded = [str(environment.join('src', 'var'))]
+    assert precompile(roots, excluded, jobs=2) == {'compiled': 2, 'current': 0, 'failed': 1}
+    assert environment.join('src', 'bar', '__pycache__').check(dir=True)
+    assert not environment.join('src', 'var', 'eggs', '__pycache__').check()
+    assert precompile(roots, excluded, jobs=2) == {'compiled': 0, 'current': 2, 'failed': 1}
+    environment.join('src', 'bar', '__init__.py').write('y = 42\n')
+    assert precompile(roots, excluded, jobs=2) == {'compiled': 1, 'current': 1, 'failed': 1}
+
+def test_precompile__executable(environment):
+    roots = [str(environment.join('var', 'eggs')), str(environment.join('src'))]
+    excluded = [str(environment.join('src', 'var'))]
+    assert precompile(roots, excluded, executable=sys.executable) == {'compiled': 2, 'current': 0, 'failed': 1}
+    assert precompile(roots, excluded) == {'compiled': 0, 'current': 2, 'failed': 1}
+
+@pytest.mark.parametrize('no_compile', [False, True])
+def test_run_buildout(environment, monkeypatch, capsys, no_compile):
+    monkeypatch.chdir(environment)
+    environment.join('src', 'tests', 'test_bar.py').ensure().write('import bar\n')
+    environment.join('requirements.txt').write('docopt\n')
+    monkeypatch.setattr(buildstrap_module, 'buildout', lambda args: environment.join('bin').ensure(dir=True))
+    args = {
+        'run': True, 'show': False, 'debug': False, 'generate': False,
+        '<package>': 'foo', '<requirements>': ['requirements.txt'],
+        '--part': [], '--interpreter': None, '--config': '', '--output': 'buildout.cfg',
+        '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+        '--force': False, '--verbose': 1, '--no-compile': no_compile,
+    }
+    assert buildstrap_module.buildstrap(args) == 0
+    compiled = environment.join('var', 'eggs', 'foo-1.0-py3.egg', 'foo', '__pycache__').check(dir=True)
+    assert compiled != no_compile
+    # only the developed package is compiled, not the rest of its checkout
+    assert ('Bytecode: compiled 2 files, 0 already current, 1 failed' in capsys.readouterr()[1]) != no_compile
+    assert not environment.join('src', 'tests', '__pycache__').check()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import os
+import time
+import threading
+
+import pytest
+
+from buildstrap.eggs import *
+from buildstrap.utils import file_lock
+
+
+def make_script(bin_path, name, eggs):
+    bin_path.join(name).write('\n'.join([
+        '#!/usr/bin/python',
+        'import sys',
+        'sys.path[0:0] = [',
+    ] + ["  '{}',".format(egg) for egg in eggs] + [
+        '  ]',
+    ]))
+
+def test_eggs_directory(tmpdir):
+    path = str(tmpdir.join('eggs'))
+    # zc.buildout >= 5 installs the eggs within a versioned subdirectory
+    assert eggs_directory(path) == str(tmpdir.join('eggs', 'v5'))
+    assert eggs_directory(path, {'eggs-directory-version': ''}) == path
+    assert eggs_directory(path, {'eggs-directory-version': 'v6'}) == str(tmpdir.join('eggs', 'v6'))
+    abi_path = eggs_directory(path, {'abi-tag-eggs': 'true'})
+    assert os.path.dirname(abi_path) == str(tmpdir.join('eggs', 'v5'))
+    assert os.path.basename(abi_path).startswith('cp')
+
+class TestClass__EggsCache:
+    def test_session(self, tmpdir):
+        cache = EggsCache(str(tmpdir.join('eggs')))
+        bin_path = tmpdir.mkdir('bin')
+        eggs = tmpdir.join('eggs', 'v5')
+        assert cache.eggs_path == str(eggs)
+
+        # first run installs both eggs
+        with cache.session(str(bin_path)):
+            eggs.join('foo-1.0-py3.egg').ensure(dir=True).join('foo.py').write('x' * 100)
+            eggs.join('bar-1.0-py3.egg').write('y' * 50)
+            make_script(bin_path, 'foo', [eggs.join('foo-1.0-py3.egg'), eggs.join('bar-1.0-py3.egg')])
+        assert cache.last_run['installed_eggs'] == 2
+        assert cache.last_run['installed_bytes'] == 150
+        assert cache.last_run['reused_eggs'] == 0
+        assert cache.last_run['saved_seconds'] == 0
+
+        # second run, another project reusing one of them
+        other_bin_path = tmpdir.mkdir('other_bin')
+        with cache.session(str(other_bin_path)):
+            make_script(other_bin_path, 'bar', [eggs.join('bar-1.0-py3.egg'), '/elsewhere/qux.egg'])
+        assert cache.last_run['installed_eggs'] == 0
+        assert cache.last_run['reused_eggs'] == 1
+        assert cache.last_run['reused_bytes'] == 50
+        assert cache.last_run['saved_seconds'] >= 0
+        assert format_run(cache.last_run).startswith('Shared eggs: reused 1 eggs (50B, about ')
+
+        stats = cache.load_stats()
+        assert stats['runs'] == 2
+        assert stats['reused_bytes'] == 50
+        assert stats['installed_bytes'] == 150
+        assert 'saved_seconds' in stats
+
+    def test_session__failure(self, tmpdir):
+        cache = EggsCache(str(tmpdir.join('eggs')))
+        with pytest.raises(SystemExit):
+            with cache.session(str(tmpdir.join('bin'))):
+                raise SystemExit(1)
+        assert cache.load_stats() == {}
+        assert cache.last_run is None
+        # lock has been released
+        with file_lock(str(tmpdir.join('eggs', EggsCache.lock_name))):
+            pass
+
+    def test_session__concurrent(self, tmpdir):
+        cache_path = str(tmpdir.join('eggs'))
+        spans = []
+
+        def run():
+            with EggsCache(cache_path).session(str(tmpdir.join('bin'))):
+                start = time.time()
+                time.sleep(0.1)
+                spans.append((start, time.time()))
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        spans.sort()
+        assert len(spans) == 3
+        # the runs are not serialized, only the installation of eggs is
+        assert any(a[1] > b[0] for a, b in zip(spans, spans[1:]))
+        assert EggsCache(cache_path).load_stats()['runs'] == 3
+
+class TestFun__install_lock:
+    def test_install_lock(self, tmpdir, monkeypatch):
+        import fcntl
+        import zc.buildout.easy_install
+
+        lock_path = str(tmpdir.mkdir('eggs').join(EggsCache.lock_name))
+        held = []
+        def is_held():
+            with open(lock_path, 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return True
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                return False
+        def mock_install(*args, **kwargs):
+            held.append(is_held())
+            # nested calls do not lock again
+            return zc.buildout.easy_install.build()
+        def mock_build(*args, **kwargs):
+            held.append(is_held())
+        monkeypatch.setattr(zc.buildout.easy_install, 'install', mock_install)
+        monkeypatch.setattr(zc.buildout.easy_install, 'build', mock_build)
+
+        with install_lock(lock_path):
+            assert not is_held()
+            zc.buildout.easy_install.install()
+        assert held == [True, True]
+        assert zc.buildout.easy_install.install is mock_install
+        assert zc.buildout.easy_install.build is mock_build
+
+    def test_locked_buildout_script(self):
+        compile(LOCKED_BUILDOUT_SCRIPT, 'script', 'exec')
+
+class TestFun__format_size:
+    def test_format_size(self):
+        assert format_size(12) == '12B'
+        assert format_size(2048) == '2.0KiB'
+        assert format_size(3 * 1024 ** 3) == '3.0GiB'
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import io
+import json
+
+import pytest
+
+from collections import OrderedDict
+
+from buildstrap.formats import *
+from buildstrap.buildstrap import ListBuildout, buildstrap
+
+
+def parts():
+    return OrderedDict([
+        ('buildout', OrderedDict([('newest', 'false'), ('Parts', ListBuildout(['foo']))])),
+        ('foo', OrderedDict([('recipe', 'zc.recipe.egg'), ('eggs', ListBuildout(['a', 'b']))])),
+    ])
+
+def test_section_records():
+    assert list(section_records(parts())) == [
+        {'version': 1, 'section': 'buildout', 'options': {'newest': 'false', 'Parts': ['foo']}},
+        {'version': 1, 'section': 'foo', 'options': {'recipe': 'zc.recipe.egg', 'eggs': ['a', 'b']}},
+    ]
+    assert list(section_records(parts(), rendered=True))[1] == {
+        'version': 1, 'section': 'foo', 'options': {'recipe': 'zc.recipe.egg', 'eggs': 'a\nb'}}
+    assert list(section_records(parts(), rendered=True))[0]['options'] == {'newest': 'false', 'parts': 'foo'}
+
+def test_write_jsonl():
+    out = io.StringIO()
+    write_parts(parts(), out, 'jsonl', 'debug')
+    lines = out.getvalue().splitlines()
+    assert [json.loads(line) for line in lines] == list(section_records(parts()))
+
+def test_write_json():
+    out = io.StringIO()
+    write_parts(parts(), out, 'json', 'show')
+    assert json.loads(out.getvalue()) == {
+        'version': 1, 'action': 'show', 'sections': list(section_records(parts(), rendered=True))}
+
+def test_write_json__empty():
+    out = io.StringIO()
+    write_json({}, out, 'debug')
+    assert json.loads(out.getvalue()) == {'version': 1, 'action': 'debug', 'sections': []}
+
+def test_unsupported():
+    with pytest.raises(ValueError):
+        write_parts(parts(), io.StringIO(), 'xml', 'show')
+
+@pytest.mark.parametrize('action', ['debug', 'show'])
+def test_buildstrap__format(action, capsys):
+    args = {
+        'run': False, 'show': action == 'show', 'debug': action == 'debug', 'generate': False,
+        '<package>': 'foo', '<requirements>': ['requirements.txt'],
+        '--part': [], '--interpreter': None, '--config': '', '--output': 'buildout.cfg',
+        '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+        '--force': False, '--verbose': 0, '--format': 'jsonl',
+    }
+    assert buildstrap(args) == 0
+    records = [json.loads(line) for line in capsys.readouterr()[0].splitlines()]
+    assert [record['section'] for record in records] == ['buildout', 'foo']
+    eggs = records[1]['options']['eggs']
+    assert eggs == (['${buildout:requirements-eggs}', 'foo'] if action == 'debug'
+                    else '${buildout:requirements-eggs}\nfoo')
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+'''Import time benchmark of the buildstrap command line
+
+Runs each action through ``python -X importtime`` and checks that actions not
+running buildout never load the heavy dependencies, and that the overall import
+time of the command stays within budget.
+'''
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules only the ``run`` action (or ``--version``) is allowed to load
+HEAVY_MODULES = ('zc.buildout', 'zc.buildout.buildout', 'zc.buildout.configparser', 'pkg_resources')
+
+# cumulative import time budget for ``buildstrap.buildstrap``, in microseconds.
+# Eagerly importing zc.buildout and pkg_resources costs several hundred milliseconds,
+# so this is far above the lazy cost while still catching a regression.
+IMPORT_BUDGET_US = 100000
+
+def importtime(args, cwd):
+    '''Runs the buildstrap command line under ``-X importtime``
+
+    Returns:
+        tuple of the process result, and a dict of imported module name to
+        cumulative import time in microseconds
+    '''
+    code = 'import sys; sys.argv = ["buildstrap"] + sys.argv[1:]; from buildstrap.buildstrap import run; run()'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code] + args,
+            cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+    modules = {}
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(cumulative)
+    return res, modules
+
+@pytest.mark.parametrize('action', ['generate', 'show', 'debug'])
+def test_importtime__actions(action, tmpdir):
+    res, modules = importtime(['-f', action, 'foo', 'requirements.txt'], str(tmpdir))
+    assert res.returncode == 0, res.stderr
+    assert 'buildstrap.buildstrap' in modules
+    for name in HEAVY_MODULES:
+        assert name not in modules, '{} loaded by the {} action'.format(name, action)
+    assert modules['buildstrap.buildstrap'] < IMPORT_BUDGET_US
+
+def test_importtime__version(tmpdir):
+    res, modules = importtime(['--version'], str(tmpdir))
+    assert res.returncode == 0, res.stderr
+    assert res.stdout.startswith('Buildstrap v')
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import json
+import asyncio
+
+import pytest
+
+from buildstrap import aio
+from buildstrap import matrix as matrix_module
+from buildstrap.matrix import *
+from buildstrap.aio import parse_args
+from buildstrap.buildstrap import build_part_buildout, buildstrap, project_paths
+
+
+def test_interpreters():
+    assert interpreters(None) == []
+    assert interpreters('python3.12') == ['python3.12']
+    assert interpreters('python3.11, /usr/bin/python3.12,') == ['python3.11', '/usr/bin/python3.12']
+    assert interpreter_name('/usr/bin/python3.12') == 'python3.12'
+    assert interpreter_name('pypy 3') == 'pypy_3'
+
+def test_interpreter_args():
+    args = parse_args(['run', '-i', 'python3.11,/usr/bin/python3.12', 'foo', 'requirements.txt'])
+    assert args['--interpreter'] == 'python3.11,/usr/bin/python3.12'
+    derived = interpreter_args(args, '/usr/bin/python3.12')
+    assert derived['--interpreter'] == 'python3.12'
+    assert derived['--executable'] == '/usr/bin/python3.12'
+    assert derived['--output'] == 'buildout-python3.12.cfg'
+    assert derived['--env'] == 'var/python3.12'
+    assert derived['--bin'] == 'bin/python3.12'
+    assert derived['--installed'] == 'var/python3.12/.installed.cfg'
+    assert args['--output'] == 'buildout.cfg'
+
+def test_build_part_buildout__installed_path():
+    assert 'installed' not in build_part_buildout()['buildout']
+    assert build_part_buildout(installed_path='var/.installed.cfg')['buildout']['installed'] == \
+            '${buildout:directory}/var/.installed.cfg'
+    assert build_part_buildout(installed_path='/tmp/installed.cfg')['buildout']['installed'] == '/tmp/installed.cfg'
+    assert project_paths('/foo/buildout.cfg')['installed'] == '/foo/.installed.cfg'
+    assert project_paths('/foo/buildout.cfg', installed_path='var/.installed.cfg')['installed'] == \
+            '/foo/var/.installed.cfg'
+
+def test_generate(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    args = parse_args(['generate', '-i', 'python3.11,python3.12', 'foo', 'requirements.txt'])
+    assert buildstrap(args) == 0
+    assert not tmpdir.join('buildout.cfg').check()
+    for name in ('python3.11', 'python3.12'):
+        config = tmpdir.join('buildout-{}.cfg'.format(name)).read()
+        assert 'interpreter = {}\n'.format(name) in config
+        assert 'bin-directory = ${{buildout:directory}}/bin/{}\n'.format(name) in config
+        assert 'parts-directory = ${{buildout:directory}}/var/{}/parts\n'.format(name) in config
+        assert 'installed = ${{buildout:directory}}/var/{}/.installed.cfg\n'.format(name) in config
+
+def test_generate__paths(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    args = parse_args(['generate', '-i', '/usr/bin/python3.11,/opt/python/bin/python3.12', 'foo', 'requirements.txt'])
+    assert buildstrap(args) == 0
+    for name in ('python3.11', 'python3.12'):
+        config = tmpdir.join('buildout-{}.cfg'.format(name)).read()
+        interpreter = [line for line in config.splitlines() if line.startswith('interpreter =')]
+        assert interpreter == ['interpreter = {}'.format(name)]
+        assert '/' not in interpreter[0] and os.sep not in interpreter[0]
+
+def test_lock():
+    args = parse_args(['lock', '-i', 'python3.11,python3.12', 'foo', 'requirements.txt'])
+    assert matrix(args) == 1
+
+
+async def mock_check_interpreter(interpreter):
+    pass
+
+def test_check_interpreter(tmpdir):
+    asyncio.run(check_interpreter(sys.executable))
+    with pytest.raises(RuntimeError, match='cannot run'):
+        asyncio.run(check_interpreter(str(tmpdir.join('nowhere'))))
+    python = tmpdir.join('python')
+    python.write('#!/bin/sh\nexit 1\n')
+    python.chmod(0o755)
+    with pytest.raises(RuntimeError, match='cannot import zc.buildout'):
+        asyncio.run(check_interpreter(str(python)))
+
+def test_build_matrix(monkeypatch):
+    monkeypatch.setattr(matrix_module, 'check_interpreter', mock_check_interpreter)
+    running = []
+    peak = []
+    async def mock_buildstrap_async(args, output):
+        running.append(args['--interpreter'])
+        peak.append(len(running))
+        output('building\n')
+        await asyncio.sleep(0.01)
+        running.remove(args['--interpreter'])
+        if args['--interpreter'] == 'python3.10':
+            raise RuntimeError('no such interpreter')
+        return 1 if args['--interpreter'] == 'python3.11' else 0
+    monkeypatch.setattr(matrix_module, 'buildstrap_async', mock_buildstrap_async)
+    lines = []
+    monkeypatch.setattr(matrix_module, 'print_output', lines.append)
+
+    args = parse_args(['run', '-i', 'python3.10,python3.11,python3.12', 'foo', 'requirements.txt'])
+    results = asyncio.run(build_matrix(args, jobs=2))
+    assert max(peak) == 2
+    assert [r[0]['--interpreter'] for r in results] == ['python3.10', 'python3.11', 'python3.12']
+    assert [r[1] if isinstance(r[1], int) else str(r[1]) for r in results] == ['no such interpreter', 1, 0]
+    assert sorted(lines) == ['python3.10: building\n', 'python3.11: building\n', 'python3.12: building\n']
+
+    out = io.StringIO()
+    assert report(results, out) == 2
+    report_lines = out.getvalue().splitlines()
+    assert report_lines[0].startswith('failed    python3.10: no such interpreter (')
+    assert report_lines[1].startswith('failed    python3.11: exit code 1 (')
+    assert report_lines[2].startswith('ok        python3.12 (buildout-python3.12.cfg, ')
+    assert report_lines[3] == '3 interpreters, 1 succeeded, 2 failed'
+
+def test_build_matrix__executable(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('requirements.txt').write('docopt\n')
+    executables = []
+    for name in ('pya', 'pyb'):
+        tmpdir.join(name).mksymlinkto(sys.executable)
+        executables.append(str(tmpdir.join(name)))
+    commands = []
+    async def mock_run_process(command, output=None):
+        commands.append(command)
+        return 0
+    monkeypatch.setattr(aio, 'run_process', mock_run_process)
+
+    args = parse_args(['run', '--no-compile', '-i', ','.join(executables), 'foo', 'requirements.txt'])
+    results = asyncio.run(build_matrix(args, jobs=2))
+    assert [r[1] for r in results] == [0, 0]
+    # each build runs buildout with its own interpreter
+    assert sorted((command[0], command[-1]) for command in commands) == [
+            (executables[0], 'buildout-pya.cfg'), (executables[1], 'buildout-pyb.cfg')]
+    for name, executable in zip(('pya', 'pyb'), executables):
+        state = json.loads(tmpdir.join('var', name, '.buildstrap-state.json').read())
+        assert state['fingerprint']['interpreter'] == [executable, sys.version]
+
+def test_matrix__run(monkeypatch, capsys):
+    monkeypatch.setattr(matrix_module, 'check_interpreter', mock_check_interpreter)
+    async def mock_buildstrap_async(args, output):
+        return 0
+    monkeypatch.setattr(matrix_module, 'buildstrap_async', mock_buildstrap_async)
+    args = parse_args(['run', '-j', '1', '-i', 'python3.11,python3.12', 'foo', 'requirements.txt'])
+    assert buildstrap(args) == 0
+    assert '2 interpreters, 2 succeeded, 0 failed' in capsys.readouterr()[0]
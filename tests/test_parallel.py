@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import asyncio
+import subprocess
+
+import pytest
+
+from buildstrap.buildstrap import ListBuildout, project_paths
+from buildstrap.parallel import *
+
+
+RECIPE = '\n'.join([
+    'import os, json, time',
+    'class Recipe:',
+    '    def __init__(self, buildout, name, options):',
+    '        self.buildout, self.name, self.options = buildout, name, options',
+    '    def install(self):',
+    '        start = time.time()',
+    '        time.sleep(float(self.options.get("sleep", "0")))',
+    '        path = os.path.join(self.buildout["buildout"]["bin-directory"], self.name)',
+    '        with open(path, "w") as f:',
+    '            f.write(self.options["content"])',
+    '        with open(os.path.join(self.buildout["buildout"]["directory"], "runs.log"), "a") as f:',
+    '            f.write(json.dumps({"part": self.name, "start": start, "end": time.time()}) + "\\n")',
+    '        return [path]',
+    '    update = install',
+])
+
+CONFIG = '\n'.join([
+    '[buildout]',
+    'develop = recipe',
+    'parts = a b c',
+    'eggs-directory = var/eggs',
+    'develop-eggs-directory = var/develop-eggs',
+    'parts-directory = var/parts',
+    'offline = true',
+    '',
+    '[a]',
+    'recipe = fakerecipe',
+    'sleep = 0.5',
+    'content = a',
+    '',
+    '[b]',
+    'recipe = fakerecipe',
+    'content = b ${a:content}',
+    '',
+    '[c]',
+    'recipe = fakerecipe',
+    'sleep = 0.5',
+    'content = c',
+    '',
+])
+
+
+def test_part_dependencies():
+    parts = {
+        'buildout': {'parts': ListBuildout(['a', 'b', 'c', 'd'])},
+        'a': {'recipe': 'r'},
+        'b': {'recipe': 'r', 'x': '${a:x} ${:y} ${buildout:directory}'},
+        'c': {'recipe': 'r', 'x': ListBuildout(['${settings:x}', 'y'])},
+        'd': {'recipe': 'r', '<part-dependencies>': 'e'},
+        'e': {'recipe': 'r'},
+        'settings': {'x': '${b:x}'},
+    }
+    dependencies = part_dependencies(parts)
+    assert dependencies == {'a': set(), 'b': {'a'}, 'c': {'b'}, 'd': {'e'}, 'e': set()}
+    assert install_order(dependencies) == ['a', 'e', 'b', 'd', 'c']
+
+def test_install_order__circular():
+    with pytest.raises(ValueError):
+        install_order({'a': {'b'}, 'b': {'a'}, 'c': set()})
+
+def test_installed_roundtrip(tmpdir):
+    sections = {
+        'buildout': {'parts': 'a', 'installed_develop_eggs': ''},
+        'a': {'__buildout_installed__': '/bin/a\n/bin/b', 'eggs': '%(__buildout_space_n__)sfoo\nbar'},
+    }
+    path = str(tmpdir.join('.installed.cfg'))
+    write_installed(path, sections, ['a'])
+    assert read_installed(path) == sections
+    assert read_installed(str(tmpdir.join('nothing.cfg'))) == {}
+
+
+@pytest.fixture
+def project(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    recipe = tmpdir.mkdir('recipe')
+    recipe.join('setup.py').write('\n'.join([
+        'from setuptools import setup',
+        "setup(name='fakerecipe', version='1.0', py_modules=['fakerecipe'],",
+        "      entry_points={'zc.buildout': ['default = fakerecipe:Recipe']})",
+    ]))
+    recipe.join('fakerecipe.py').write(RECIPE)
+    tmpdir.join('buildout.cfg').write(CONFIG)
+    return tmpdir
+
+def test_install_parts(project):
+    from zc.buildout.configparser import parse
+    with open(str(project.join('buildout.cfg'))) as f:
+        parts = parse(f, 'buildout.cfg')
+    paths = project_paths('buildout.cfg', env_path='var')
+    lines = []
+    assert asyncio.run(install_parts('buildout.cfg', parts, paths, jobs=2,
+                                     output=lambda part, line: lines.append((part, line)))) == ['a', 'c', 'b']
+    assert project.join('bin', 'b').read() == 'b a'
+    runs = {}
+    for line in project.join('runs.log').readlines():
+        run = json.loads(line)
+        runs.setdefault(run['part'], run)
+    # a and c installed concurrently, b once a was installed
+    assert runs['c']['start'] < runs['a']['end'] and runs['a']['start'] < runs['c']['end']
+    assert runs['b']['start'] >= runs['a']['end']
+    assert not project.join('var', 'parallel').exists()
+
+    installed = read_installed(str(project.join('.installed.cfg')))
+    assert installed['buildout']['parts'] == 'a c b'
+    assert 'fakerecipe' in installed['buildout']['installed_develop_eggs']
+
+    # buildout takes over from the merged installation, only updating the parts
+    output = subprocess.run([sys.executable, '-c', 'import sys; from zc.buildout.buildout import main; main(sys.argv[1:])',
+                             '-c', 'buildout.cfg'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True).stdout
+    assert 'Updating a.' in output and 'Updating b.' in output and 'Updating c.' in output
+    assert 'Installing' not in output
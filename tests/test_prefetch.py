@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import threading
+from functools import partial
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+from buildstrap.prefetch import *
+from buildstrap.requirements import resolve_requirements
+
+
+DISTS = [
+    'foo-1.0-py3-none-any.whl',
+    'foo-1.0.tar.gz',
+    'foo-2.0.tar.gz',
+    'Bar_Baz-0.1.zip',
+    'qux-1.0-py2.7.egg',
+    'qux-0.9-cp27-cp27mu-manylinux1_x86_64.whl',
+]
+
+def make_dists(path):
+    for fname in DISTS:
+        path.join(fname).write(fname)
+    return path
+
+def make_requirements(tmpdir, *lines):
+    tmpdir.join('requirements.txt').write('\n'.join(lines))
+    return resolve_requirements([str(tmpdir.join('requirements.txt'))]).requirements
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def index_server(tmpdir):
+    '''Serves a PEP 503 simple index stand-in from a local directory'''
+    dists = make_dists(tmpdir.mkdir('packages'))
+    simple = tmpdir.mkdir('simple')
+    for name in ('foo', 'bar-baz', 'qux'):
+        links = ''.join('<a href="../../packages/{0}#sha256=0">{0}</a>'.format(f) for f in DISTS
+                        if parse_dist(f)[0] == name)
+        simple.mkdir(name).join('index.html').write('<html><body>{}</body></html>'.format(links))
+    server = HTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=str(tmpdir)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/simple/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+class TestFun__parse_dist:
+    def test_parse_dist(self):
+        assert parse_dist('foo-1.0-py3-none-any.whl') == ('foo', '1.0', 'foo-1.0-py3-none-any.whl')
+        assert parse_dist('/a/Bar_Baz-0.1.zip') == ('bar-baz', '0.1', 'Bar_Baz-0.1.zip')
+        assert parse_dist('http://a/b/qux-1.0-py2.7.egg') == ('qux', '1.0', 'qux-1.0-py2.7.egg')
+        assert parse_dist('README.txt') is None
+
+class TestFun__select_dist:
+    def test_select_dist(self, tmpdir):
+        reqs = make_requirements(tmpdir, 'foo', 'foo-bar', 'bar.baz', 'qux')
+        assert select_dist(reqs['foo'], DISTS) == ('foo-2.0.tar.gz', 'foo-2.0.tar.gz')
+        assert select_dist(reqs['foo-bar'], DISTS) is None
+        assert select_dist(reqs['bar-baz'], DISTS) == ('Bar_Baz-0.1.zip', 'Bar_Baz-0.1.zip')
+        assert select_dist(reqs['qux'], DISTS) is None
+
+    def test_select_dist__specifiers(self, tmpdir):
+        reqs = make_requirements(tmpdir, 'foo<2')
+        assert select_dist(reqs['foo'], DISTS) == ('foo-1.0-py3-none-any.whl', 'foo-1.0-py3-none-any.whl')
+
+class TestClass__Prefetcher:
+    def test_prefetch__find_links(self, tmpdir):
+        dists = make_dists(tmpdir.mkdir('dists'))
+        reqs = make_requirements(tmpdir, 'foo<2', 'bar_baz', 'missing')
+        dest = tmpdir.join('cache', 'dist')
+        prefetcher = Prefetcher(str(dest), find_links=[str(dists)], index_url=None, jobs=2)
+        assert prefetcher.prefetch(reqs.values()) == {
+                'foo': 'fetched', 'bar_baz': 'fetched', 'missing': 'missing'}
+        assert sorted(dest.listdir()) == [dest.join('Bar_Baz-0.1.zip'), dest.join('foo-1.0-py3-none-any.whl')]
+        assert dest.join('foo-1.0-py3-none-any.whl').read() == 'foo-1.0-py3-none-any.whl'
+        assert prefetcher.prefetch(reqs.values())['foo'] == 'cached'
+
+    def test_prefetch__installed(self, tmpdir):
+        dists = make_dists(tmpdir.mkdir('dists'))
+        eggs = tmpdir.mkdir('eggs')
+        eggs.mkdir('foo-1.0-py3.11.egg')
+        reqs = make_requirements(tmpdir, 'foo<2')
+        prefetcher = Prefetcher(str(tmpdir.join('dist')), str(eggs), [str(dists)], None)
+        assert prefetcher.prefetch(reqs.values()) == {'foo': 'installed'}
+
+    def test_prefetch__http_index(self, tmpdir, index_server):
+        reqs = make_requirements(tmpdir, 'foo', 'Bar.Baz')
+        dest = tmpdir.join('dist')
+        prefetcher = Prefetcher(str(dest), index_url=index_server, jobs=4)
+        assert prefetcher.prefetch(reqs.values()) == {'foo': 'fetched', 'Bar.Baz': 'fetched'}
+        assert dest.join('foo-2.0.tar.gz').read() == 'foo-2.0.tar.gz'
+
+    def test_prefetch__file_index(self, tmpdir, index_server):
+        reqs = make_requirements(tmpdir, 'foo<2')
+        dest = tmpdir.join('dist')
+        prefetcher = Prefetcher(str(dest), index_url='file://' + str(tmpdir.join('simple')))
+        assert prefetcher.prefetch(reqs.values()) == {'foo': 'fetched'}
+        assert dest.join('foo-1.0-py3-none-any.whl').exists()
+
+class TestFun__prefetch:
+    def test_prefetch(self, tmpdir):
+        make_dists(tmpdir.mkdir('wheels'))
+        tmpdir.join('requirements.txt').write('-f ./wheels\nfoo\n')
+        resolved = resolve_requirements([str(tmpdir.join('requirements.txt'))])
+        paths = {'root': str(tmpdir), 'src': str(tmpdir), 'env': str(tmpdir.join('var')), 'bin': str(tmpdir.join('bin'))}
+        assert prefetch(resolved, paths, index_url='file://' + str(tmpdir.join('nowhere'))) == {'foo': 'fetched'}
+        assert tmpdir.join('var', 'downloads', 'dist', 'foo-2.0.tar.gz').exists()
+
+    def test_prefetch__installed(self, tmpdir):
+        make_dists(tmpdir.mkdir('wheels'))
+        tmpdir.join('requirements.txt').write('-f ./wheels\nfoo\n')
+        resolved = resolve_requirements([str(tmpdir.join('requirements.txt'))])
+        paths = {'root': str(tmpdir), 'src': str(tmpdir), 'env': str(tmpdir.join('var')), 'bin': str(tmpdir.join('bin'))}
+        # buildout installs the eggs within a versioned subdirectory of the eggs directory
+        tmpdir.join('var', 'eggs', 'v5', 'foo-1.0-py3.11.egg').ensure(dir=True)
+        assert prefetch(resolved, paths, index_url=None) == {'foo': 'installed'}
+        assert prefetch(resolved, paths, index_url=None, options={'eggs-directory-version': ''}) == {'foo': 'fetched'}
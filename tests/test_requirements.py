@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+import pytest
+
+from buildstrap.requirements import *
+
+
+class TestFun__normalize_name:
+    def test_normalize_name(self):
+        assert normalize_name('Zope.Interface') == 'zope-interface'
+        assert normalize_name('zc__buildout') == 'zc-buildout'
+        assert normalize_name('pytest-cov') == 'pytest-cov'
+
+class TestFun__satisfies:
+    def test_satisfies(self):
+        assert satisfies('1.0', '==', '1') is True
+        assert satisfies('1.0', '!=', '1.0') is False
+        assert satisfies('1.2', '<', '1.10') is True
+        assert satisfies('2.0', '>=', '2') is True
+        assert satisfies('1.4.5', '~=', '1.4.2') is True
+        assert satisfies('1.5', '~=', '1.4.2') is False
+        assert satisfies('1.4.5', '==', '1.4.*') is True
+        assert satisfies('1.5', '==', '1.4.*') is False
+        assert satisfies('dev', '<', '1.0') is None
+
+class TestFun__resolve_requirements:
+    def test_resolve(self, tmpdir):
+        tmpdir.join('requirements.txt').write('\n'.join([
+            '# main requirements',
+            'docopt',
+            'zc.buildout>=2.5 # buildout',
+            'Requests[security] >= 2.0, <3',
+            'pywin32; sys_platform == "win32"',
+            '-r requirements-test.txt',
+            '',
+        ]))
+        tmpdir.join('requirements-test.txt').write('\n'.join([
+            '--index-url https://pypi.example.org/simple',
+            '-f ./wheels',
+            'pytest \\',
+            '   ==3.0.0',
+            'requests[socks]',
+            'zc_buildout<3',
+            '-e git+https://github.com/guyzmo/git-repo#egg=git-repo',
+            '-r requirements.txt',
+        ]))
+        res = resolve_requirements([str(tmpdir.join('requirements.txt'))])
+        assert res.eggs == [
+            'docopt',
+            'zc.buildout>=2.5,<3',
+            'Requests[security,socks]>=2.0,<3',
+            'pytest==3.0.0',
+            'git-repo',
+        ]
+        assert res.vcs == ['git+https://github.com/guyzmo/git-repo#egg=git-repo']
+        assert res.files == [str(tmpdir.join('requirements.txt')), str(tmpdir.join('requirements-test.txt'))]
+        assert res.index_url == 'https://pypi.example.org/simple'
+        assert res.find_links == ['./wheels']
+
+    def test_resolve__constraints(self, tmpdir):
+        tmpdir.join('constraints.txt').write('docopt==0.6.2\nunused==1.0\n')
+        tmpdir.join('requirements.txt').write('-c constraints.txt\ndocopt\n')
+        res = resolve_requirements([str(tmpdir.join('requirements.txt'))])
+        assert res.eggs == ['docopt==0.6.2']
+        assert list(res.constraints) == ['unused']
+
+    def test_resolve__conflicting_pins(self, tmpdir):
+        tmpdir.join('a.txt').write('docopt==0.6.2\n')
+        tmpdir.join('b.txt').write('DocOpt==0.6.1\n')
+        with pytest.raises(RequirementConflict) as err:
+            resolve_requirements([str(tmpdir.join('a.txt')), str(tmpdir.join('b.txt'))])
+        assert 'b.txt:1' in str(err.value)
+
+    def test_resolve__conflicting_range(self, tmpdir):
+        tmpdir.join('a.txt').write('docopt<0.6\n')
+        tmpdir.join('b.txt').write('docopt==0.6.2\n')
+        with pytest.raises(RequirementConflict):
+            resolve_requirements([str(tmpdir.join('a.txt')), str(tmpdir.join('b.txt'))])
+
+    def test_resolve__invalid(self, tmpdir):
+        tmpdir.join('a.txt').write('docopt=>0.6\n')
+        with pytest.raises(ValueError):
+            resolve_requirements([str(tmpdir.join('a.txt'))])
+
+    def test_resolve__missing(self, tmpdir):
+        tmpdir.join('a.txt').write('-r missing.txt\n')
+        with pytest.raises(FileNotFoundError):
+            resolve_requirements([str(tmpdir.join('a.txt'))])
+        assert requirements_files([str(tmpdir.join('a.txt'))]) == [
+                str(tmpdir.join('a.txt')), str(tmpdir.join('missing.txt'))]
+
+    def test_resolve__hashes(self, tmpdir):
+        tmpdir.join('requirements.txt').write('\n'.join([
+            'docopt==0.6.2 \\',
+            '    --hash=sha256:49b3a825280bd66b3aa83585ef59c4a8c82f2c8a522dbe754a8bc8d08c85c491 \\',
+            '    --hash=sha256:0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef',
+            'zc.buildout>=2.5 --global-option="--quiet"',
+            '',
+        ]))
+        res = resolve_requirements([str(tmpdir.join('requirements.txt'))])
+        assert res.eggs == ['docopt==0.6.2', 'zc.buildout>=2.5']
+
+    def test_resolve__direct_reference(self, tmpdir):
+        tmpdir.join('requirements.txt').write('\n'.join([
+            'git-repo @ git+https://github.com/guyzmo/git-repo@v1.10',
+            'foo[bar] @ https://example.org/foo-1.0.tar.gz#sha256=abcd',
+            'pywin32 @ https://example.org/pywin32.whl ; sys_platform == "win32"',
+            '-c constraints.txt',
+            '',
+        ]))
+        tmpdir.join('constraints.txt').write('bar @ https://example.org/bar.tar.gz\n')
+        res = resolve_requirements([str(tmpdir.join('requirements.txt'))])
+        assert res.vcs == [
+            'git+https://github.com/guyzmo/git-repo@v1.10#egg=git-repo',
+            'https://example.org/foo-1.0.tar.gz#sha256=abcd&egg=foo',
+        ]
+        assert res.eggs == ['git-repo', 'foo[bar]']
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import os
+import threading
+
+import pytest
+
+from buildstrap.server import *
+
+
+@pytest.fixture
+def daemon(tmpdir):
+    daemon = Daemon()
+    daemon.bind(str(tmpdir.join('run', 'buildstrap.sock')))
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join()
+
+@pytest.fixture
+def project(tmpdir):
+    project = tmpdir.mkdir('project')
+    project.join('requirements.txt').write('docopt\n')
+    return project
+
+
+def test_default_socket_path(monkeypatch):
+    monkeypatch.setenv('BUILDSTRAP_SOCKET', '/tmp/foo.sock')
+    assert default_socket_path() == '/tmp/foo.sock'
+    monkeypatch.delenv('BUILDSTRAP_SOCKET')
+    monkeypatch.setenv('XDG_RUNTIME_DIR', '/run/user/1000')
+    assert default_socket_path() == '/run/user/1000/buildstrap.sock'
+
+def test_forward__no_daemon(tmpdir):
+    assert forward(['show', 'foo', 'requirements.txt'], str(tmpdir.join('nothing.sock'))) is None
+    # stale socket file, left by a daemon that did not exit cleanly
+    tmpdir.join('stale.sock').write('')
+    assert forward(['show', 'foo', 'requirements.txt'], str(tmpdir.join('stale.sock'))) is None
+
+def test_forward__show(daemon, project, capsys):
+    response = forward(['show', 'foo', 'requirements.txt'], daemon.path, str(project))
+    assert response['code'] == 0
+    assert response['stdout'].startswith('[buildout]\n')
+    assert 'package = foo\n' in response['stdout']
+    assert capsys.readouterr() == ('', '')
+
+def test_forward__generate(daemon, project):
+    cwd = os.getcwd()
+    response = forward(['generate', 'foo', 'requirements.txt'], daemon.path, str(project))
+    assert response['code'] == 0
+    assert project.join('buildout.cfg').exists()
+    assert os.getcwd() == cwd
+    response = forward(['generate', 'bar', 'requirements.txt'], daemon.path, str(project))
+    assert response['code'] == 1
+    assert 'file already exists' in response['stderr']
+
+def test_forward__fallback(daemon, project):
+    assert forward(['run', 'foo', 'requirements.txt'], daemon.path, str(project)) is None
+    assert forward(['batch', 'manifest.json'], daemon.path, str(project)) is None
+    assert not project.join('buildout.cfg').exists()
+
+def test_forward__usage(daemon, project):
+    response = forward(['--help'], daemon.path, str(project), prog='bs')
+    assert response['code'] == 0
+    assert 'Usage: bs ' in response['stdout']
+    response = forward(['--unknown'], daemon.path, str(project))
+    assert response['code'] == 1
+    assert 'Usage:' in response['stderr']
+
+def test_forward__concurrent(daemon, tmpdir):
+    from concurrent.futures import ThreadPoolExecutor
+    projects = []
+    for i in range(10):
+        project = tmpdir.mkdir('project{}'.format(i))
+        project.join('requirements.txt').write('docopt\n')
+        projects.append(project)
+    def show(i):
+        return forward(['show', 'foo{}'.format(i), 'requirements.txt'], daemon.path, str(projects[i % 10]))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for i, response in enumerate(executor.map(show, range(40))):
+            assert 'package = foo{}\n'.format(i) in response['stdout']
+
+def test_bind__already_running(daemon):
+    with pytest.raises(RuntimeError):
+        Daemon().bind(daemon.path)
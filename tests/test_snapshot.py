@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import io
+import os
+import gzip
+
+import pytest
+
+from buildstrap.snapshot import *
+from buildstrap.aio import parse_args
+
+
+def test_parallel_gzip_writer(monkeypatch):
+    monkeypatch.setattr(ParallelGzipWriter, 'block_size', 1000)
+    data = os.urandom(5000) + b'x' * 20000 + b'tail'
+    out = io.BytesIO()
+    writer = ParallelGzipWriter(out, jobs=2)
+    for i in range(0, len(data), 777):
+        writer.write(data[i:i + 777])
+    writer.close()
+    assert gzip.decompress(out.getvalue()) == data
+
+def test_parallel_gzip_writer__empty():
+    out = io.BytesIO()
+    ParallelGzipWriter(out).close()
+    assert gzip.decompress(out.getvalue()) == b''
+
+def test_parse_args():
+    args = parse_args(['snapshot', 'save', '-p', 'pytest', 'foo', 'requirements.txt'])
+    assert args['snapshot'] and args['save'] and not args['restore']
+    assert args['<package>'] == 'foo'
+    assert args['--part'] == ['pytest']
+    assert args['<requirements>'] == ['requirements.txt']
+
+
+@pytest.fixture
+def project(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('requirements.txt').write('docopt\n')
+    egg = tmpdir.join('var', 'eggs', 'docopt-0.6.2-py3.egg').ensure(dir=True)
+    egg.join('docopt.py').write('# docopt\n')
+    os.link(str(egg.join('docopt.py')), str(egg.join('linked.py')))
+    tmpdir.join('var', 'parallel', 'work.cfg').ensure()
+    tmpdir.join('bin').ensure(dir=True).join('foo').write('#!/usr/bin/python\n')
+    tmpdir.join('.installed.cfg').write('[buildout]\nparts = foo\n')
+    args = parse_args(['snapshot', 'save', 'foo', 'requirements.txt'])
+    args['--snapshots'] = str(tmpdir.join('snapshots'))
+    return tmpdir, args
+
+def test_save_restore(project, capsys):
+    tmpdir, args = project
+    assert save(args) == 0
+    archives = tmpdir.join('snapshots').listdir()
+    assert len(archives) == 1
+    assert archives[0].basename.startswith('foo-') and archives[0].basename.endswith('.tar.gz')
+    assert save(args) == 0
+    assert 'already saved' in capsys.readouterr()[1]
+
+    tmpdir.join('var').remove()
+    tmpdir.join('bin', 'foo').write('changed')
+    tmpdir.join('.installed.cfg').remove()
+    args.update({'save': False, 'restore': True})
+    assert snapshot(args) == 0
+    egg = tmpdir.join('var', 'eggs', 'docopt-0.6.2-py3.egg')
+    assert egg.join('docopt.py').read() == '# docopt\n'
+    assert egg.join('docopt.py').stat().ino == egg.join('linked.py').stat().ino
+    assert not tmpdir.join('var', 'parallel').check()
+    assert tmpdir.join('bin', 'foo').read() == '#!/usr/bin/python\n'
+    assert tmpdir.join('.installed.cfg').read() == '[buildout]\nparts = foo\n'
+    assert sorted(p.basename for p in tmpdir.listdir()) == [
+        '.installed.cfg', 'bin', 'requirements.txt', 'snapshots', 'var']
+
+def test_restore__other_inputs(project, capsys):
+    tmpdir, args = project
+    assert save(args) == 0
+    tmpdir.join('requirements.txt').write('docopt\npytest\n')
+    args.update({'save': False, 'restore': True})
+    assert restore(args) == 1
+    assert 'No snapshot' in capsys.readouterr()[1]
+
+def test_snapshot_key(project):
+    tmpdir, args = project
+    paths = paths_from_args(args)
+    key = snapshot_key(args, paths)
+    # comments within the requirements do not matter
+    tmpdir.join('requirements.txt').write('# the requirements\ndocopt\n')
+    assert snapshot_key(args, paths) == key
+    args['--part'] = ['pytest']
+    assert snapshot_key(args, paths) != key
+    args['--part'] = []
+    args['--interpreter'] = 'python3.12'
+    assert snapshot_key(args, paths) != key
+
+def test_save__no_env(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    args = parse_args(['snapshot', 'save', 'foo', 'requirements.txt'])
+    assert save(args) == 1
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import zipfile
+import subprocess
+
+import pytest
+
+from buildstrap.eggs import eggs_directory
+from buildstrap.store import *
+from buildstrap.utils import link_file
+from buildstrap import buildstrap as buildstrap_module
+
+TAG = 'py{}.{}'.format(*sys.version_info[:2])
+
+def make_egg(eggs_path, name='foo-1.0', content='x = 1\n', requires=()):
+    # the layout of an egg buildout unpacks from a wheel
+    egg = eggs_path.join('{}-{}.egg'.format(name, TAG)).ensure(dir=True)
+    egg.join(name.split('-')[0], '__init__.py').ensure().write(content)
+    egg.join('{}.dist-info'.format(name), 'METADATA').ensure().write(''.join(
+        ['Metadata-Version: 2.1\n', 'Name: {}\n'.format(name.split('-')[0]), 'Version: {}\n'.format(name.split('-')[1])]
+        + ['Requires-Dist: {}\n'.format(r) for r in requires]))
+    return egg
+
+def make_script(bin_path, *eggs):
+    # the sys.path set up by the scripts buildout generates
+    bin_path.ensure(dir=True).join('py').write('import sys\nsys.path[0:0] = [\n{}  ]\n'.format(
+        ''.join("  '{}',\n".format(egg) for egg in eggs)))
+
+def eggs_dir(env):
+    return env.join('eggs', 'v5')
+
+def test_content_hash(tmpdir):
+    egg = make_egg(tmpdir.mkdir('a'))
+    digest = content_hash(str(egg))
+    egg.join('foo', '__pycache__', '__init__.cpython.pyc').ensure().write('bytecode')
+    assert content_hash(str(egg)) == digest
+    assert content_hash(str(make_egg(tmpdir.mkdir('b')))) == digest
+    assert content_hash(str(make_egg(tmpdir.mkdir('c'), content='x = 2\n'))) != digest
+
+def test_link_file(tmpdir, monkeypatch):
+    src = tmpdir.join('src')
+    src.write('content')
+    assert link_file(str(src), str(tmpdir.join('hard'))) == 'hardlink'
+    assert tmpdir.join('hard').stat().ino == src.stat().ino
+
+    def no_link(src, dst):
+        raise OSError('cross device link')
+    monkeypatch.setattr(os, 'link', no_link)
+    assert link_file(str(src), str(tmpdir.join('other'))) in ('reflink', 'copy')
+    assert tmpdir.join('other').read() == 'content'
+
+def test_parse_egg_name():
+    assert parse_egg_name('Foo_Bar-1.0-py3.11-linux-x86_64.egg') == ('foo-bar', '1.0', 'py3.11')
+    assert parse_egg_name('foo-1.0-py3.11.egg') == ('foo', '1.0', 'py3.11')
+    assert parse_egg_name('foo.egg-link') is None
+
+def test_egg_requirements(tmpdir):
+    egg = make_egg(tmpdir, 'foo-1.0', requires=['bar>=1.0', 'baz; extra == "test"',
+                                                'qux; python_version < "3"'])
+    assert [r.egg for r in egg_requirements(str(egg))] == ['bar>=1.0']
+    assert [r.egg for r in egg_requirements(str(egg), ['test'])] == ['bar>=1.0', 'baz']
+
+    egg = tmpdir.mkdir('setuptools').join('foo-1.0-{}.egg'.format(TAG))
+    egg.join('EGG-INFO', 'requires.txt').ensure().write('bar\n\n[test]\nbaz\n\n[:python_version < "3"]\nqux\n')
+    assert [r.egg for r in egg_requirements(str(egg))] == ['bar']
+    assert [r.egg for r in egg_requirements(str(egg), ['test'])] == ['bar', 'baz']
+
+    zipped = tmpdir.join('zipped.egg')
+    with zipfile.ZipFile(str(zipped), 'w') as z:
+        z.writestr('EGG-INFO/requires.txt', 'bar<2\n')
+    assert [r.egg for r in egg_requirements(str(zipped))] == ['bar<2']
+    assert egg_requirements(str(tmpdir.join('nothing'))) == []
+
+def test_session(tmpdir):
+    egg_store = EggStore(str(tmpdir.join('store')))
+    env1, env2 = tmpdir.mkdir('env1'), tmpdir.mkdir('env2')
+    eggs1, eggs2 = eggs_dir(env1), eggs_dir(env2)
+
+    # first environment installs eggs, added to the store
+    with egg_store.session(str(eggs1), str(env1.join('bin')), ['foo']):
+        foo = make_egg(eggs1, requires=['bar>=2'])
+        make_egg(eggs1, 'bar-2.0')
+        make_egg(eggs1, 'baz-1.0')
+    assert egg_store.last_run == {'linked_eggs': 0, 'added_eggs': 3, 'deduplicated_eggs': 0}
+    digest = egg_store.load_index()['eggs']['foo-1.0-{}.egg'.format(TAG)]
+    stored = tmpdir.join('store', 'objects', digest[:2], digest)
+    assert stored.join('foo', '__init__.py').stat().ino == foo.join('foo', '__init__.py').stat().ino
+
+    # second environment gets the eggs it requires linked, along with their dependencies
+    with egg_store.session(str(eggs2), str(env2.join('bin')), ['foo<2']):
+        assert sorted(p.basename for p in eggs2.listdir()) == ['bar-2.0-{}.egg'.format(TAG), 'foo-1.0-{}.egg'.format(TAG)]
+        linked = eggs2.join('foo-1.0-{}.egg'.format(TAG))
+        assert linked.join('foo', '__init__.py').stat().ino == foo.join('foo', '__init__.py').stat().ino
+        # an egg installed on its own, already within the store
+        eggs2.join('bar-2.0-{}.egg'.format(TAG)).remove()
+        make_egg(eggs2, 'bar-2.0')
+    assert egg_store.last_run == {'linked_eggs': 2, 'added_eggs': 0, 'deduplicated_eggs': 1}
+    bar1, bar2 = (eggs.join('bar-2.0-{}.egg'.format(TAG), 'bar', '__init__.py') for eggs in (eggs1, eggs2))
+    assert bar1.stat().ino == bar2.stat().ino
+
+    # eggs not matching the specifiers or the python version are not linked
+    other = tmpdir.mkdir('other')
+    other.join('baz-1.0-py2.7.egg').write('zipped egg')
+    egg_store.checkin(str(other))
+    eggs3 = eggs_dir(tmpdir.join('env3'))
+    assert egg_store.checkout(str(eggs3), ['foo>=2', 'baz']) == 1
+    assert [p.basename for p in eggs3.listdir()] == ['baz-1.0-{}.egg'.format(TAG)]
+
+    assert sorted(env['eggs'] for env in egg_store.load_index()['envs']) == [str(eggs1), str(eggs2)]
+
+def test_session__failure(tmpdir):
+    egg_store = EggStore(str(tmpdir.join('store')))
+    eggs = eggs_dir(tmpdir.mkdir('env'))
+    with pytest.raises(RuntimeError):
+        with egg_store.session(str(eggs), str(tmpdir.join('env', 'bin'))):
+            make_egg(eggs)
+            raise RuntimeError()
+    assert egg_store.load_index()['eggs'] == {}
+
+def test_gc(tmpdir):
+    egg_store = EggStore(str(tmpdir.join('store')))
+    env1, env2 = tmpdir.mkdir('env1'), tmpdir.mkdir('env2')
+    eggs1, eggs2 = eggs_dir(env1), eggs_dir(env2)
+    with egg_store.session(str(eggs1), str(env1.join('bin'))):
+        foo = make_egg(eggs1)
+        bar = make_egg(eggs1, 'bar-2.0', 'y' * 1000)
+        make_script(env1.join('bin'), foo, bar)
+    with egg_store.session(str(eggs2), str(env2.join('bin')), ['foo']):
+        make_script(env2.join('bin'), eggs2.join(foo.basename))
+
+    # still used by the first environment's scripts
+    assert egg_store.gc() == (0, 0)
+    env1.remove()
+    removed, freed = egg_store.gc()
+    assert removed == 1
+    assert freed >= 1000
+    assert list(egg_store.load_index()['eggs']) == ['foo-1.0-{}.egg'.format(TAG)]
+    assert egg_store.load_index()['envs'] == [{'eggs': str(eggs2), 'bin': str(env2.join('bin'))}]
+
+    # the dropped egg does not come back
+    with egg_store.session(str(eggs2), str(env2.join('bin')), ['foo', 'bar']):
+        pass
+    assert egg_store.last_run['linked_eggs'] == 0
+
+    # an egg the scripts do not use anymore is dropped, even if still within the eggs directory
+    env2.join('bin', 'py').remove()
+    assert egg_store.gc()[0] == 1
+    assert eggs2.join(foo.basename).check()
+    env2.remove()
+    assert egg_store.gc() == (0, 0)
+    assert all(p.listdir() == [] for p in tmpdir.join('store', 'objects').listdir())
+
+def test_buildstrap__store(tmpdir, monkeypatch, capsys):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('requirements.txt').write('docopt\n')
+    def mock_buildout(args):
+        egg = eggs_dir(tmpdir.join('var')).join('docopt-0.6.2-{}.egg'.format(TAG))
+        if not egg.check():
+            make_egg(eggs_dir(tmpdir.join('var')), 'docopt-0.6.2')
+        make_script(tmpdir.join('bin'), egg)
+    monkeypatch.setattr(buildstrap_module, 'buildout', mock_buildout)
+    args = {
+        'run': True, 'show': False, 'debug': False, 'generate': False,
+        '<package>': 'foo', '<requirements>': ['requirements.txt'],
+        '--part': [], '--interpreter': None, '--config': '', '--output': 'buildout.cfg',
+        '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+        '--force': False, '--verbose': 1, '--store': str(tmpdir.join('store')),
+    }
+    assert buildstrap_module.buildstrap(args) == 0
+    assert 'Egg store: linked 0 eggs, added 1 eggs' in capsys.readouterr()[1]
+
+    args['store'] = True
+    args['run'] = False
+    assert buildstrap_module.buildstrap(args) == 0
+    assert 'Dropped 0 eggs' in capsys.readouterr()[1]
+
+    # another checkout of the project gets the egg linked
+    tmpdir.join('var').remove()
+    args.update({'store': False, 'run': True, '--always-run': True})
+    assert buildstrap_module.buildstrap(args) == 0
+    assert 'Egg store: linked 1 eggs, added 0 eggs' in capsys.readouterr()[1]
+
+
+RECIPE = '\n'.join([
+    'import zc.buildout.easy_install',
+    'class Recipe:',
+    '    def __init__(self, buildout, name, options):',
+    '        self.buildout, self.options = buildout, options',
+    '    def install(self):',
+    '        options = self.buildout["buildout"]',
+    '        working_set = zc.buildout.easy_install.install(',
+    '            self.options["eggs"].split(), options["eggs-directory"], links=options["find-links"].split(),',
+    '            index=options["index"], newest=False)',
+    '        return zc.buildout.easy_install.scripts(',
+    '            [("py", "sys", "exit")], working_set, options["executable"], options["bin-directory"])',
+    '    update = install',
+])
+
+def make_wheel(path, name, version, requires=()):
+    info = '{}-{}.dist-info'.format(name, version)
+    with zipfile.ZipFile(str(path.join('{}-{}-py3-none-any.whl'.format(name, version))), 'w') as wheel:
+        wheel.writestr('{}/__init__.py'.format(name), 'x = 1\n')
+        wheel.writestr(info + '/METADATA', 'Metadata-Version: 2.1\nName: {}\nVersion: {}\n{}'.format(
+            name, version, ''.join('Requires-Dist: {}\n'.format(r) for r in requires)))
+        wheel.writestr(info + '/WHEEL', 'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n')
+        wheel.writestr(info + '/RECORD', '')
+
+def test_session__buildout(tmpdir):
+    dists = tmpdir.mkdir('dists')
+    make_wheel(dists, 'foo', '1.0')
+    make_wheel(dists, 'bar', '2.0', ['foo>=1.0'])
+    make_wheel(dists, 'baz', '1.0')
+    egg_store = EggStore(str(tmpdir.join('store')))
+
+    def run(name, eggs, find_links):
+        project = tmpdir.mkdir(name)
+        project.mkdir('recipe').join('eggrecipe.py').write(RECIPE)
+        project.join('recipe', 'setup.py').write(
+            "from setuptools import setup\n"
+            "setup(name='eggrecipe', version='1.0', py_modules=['eggrecipe'],\n"
+            "      entry_points={'zc.buildout': ['default = eggrecipe:Recipe']})\n")
+        project.join('buildout.cfg').write('\n'.join([
+            '[buildout]', 'develop = recipe', 'parts = a', 'eggs-directory = var/eggs',
+            'develop-eggs-directory = var/develop-eggs', 'parts-directory = var/parts',
+            'find-links = {}'.format(find_links), 'index = file://{}'.format(tmpdir.join('nowhere')),
+            'newest = false', '', '[a]', 'recipe = eggrecipe', 'eggs = {}'.format(' '.join(eggs)), '']))
+        with egg_store.session(eggs_directory(str(project.join('var', 'eggs'))), str(project.join('bin')), eggs):
+            subprocess.run([sys.executable, '-c', 'import sys; from zc.buildout.buildout import main; main(sys.argv[1:])',
+                            '-c', str(project.join('buildout.cfg'))], cwd=str(project), check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return project
+
+    first = run('first', ['bar', 'baz'], dists)
+    assert egg_store.last_run['added_eggs'] == 3
+    # without any distribution to install from, the eggs come from the store
+    second = run('second', ['bar'], tmpdir.join('nodists'))
+    assert egg_store.last_run == {'linked_eggs': 2, 'added_eggs': 0, 'deduplicated_eggs': 0}
+    assert 'bar-2.0' in second.join('bin', 'py').read()
+    assert not any(p.basename.startswith('baz') for p in second.join('var', 'eggs').visit('*.egg'))
+
+    # baz is only used by the first project
+    first.join('bin', 'py').remove()
+    assert egg_store.gc()[0] == 1
+    assert sorted(n.split('-')[0] for n in egg_store.load_index()['eggs']) == ['bar', 'foo']
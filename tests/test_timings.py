@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import io
+import json
+import pstats
+
+from buildstrap.timings import *
+from buildstrap.timings import _current
+from buildstrap import buildstrap as buildstrap_module
+
+
+class TestClass__Timings:
+    def test_phases(self):
+        timings = Timings()
+        with timings.phase('a'):
+            with timings.phase('b'):
+                pass
+            with timings.phase('b'):
+                pass
+        with timings.phase('c'):
+            pass
+        phases = timings.report()['phases']
+        assert [p['phase'] for p in phases] == ['a', 'a/b', 'c']
+        assert [p['calls'] for p in phases] == [1, 2, 1]
+        assert all(p['wall'] >= 0 and p['cpu'] >= 0 for p in phases)
+        assert phases[0]['wall'] >= phases[1]['wall']
+
+    def test_phases__error(self):
+        timings = Timings()
+        try:
+            with timings.phase('a'):
+                raise ValueError()
+        except ValueError:
+            pass
+        with timings.phase('b'):
+            pass
+        assert [p['phase'] for p in timings.report()['phases']] == ['a', 'b']
+
+
+def test_timed__inactive():
+    assert _current.get() is None
+    with timed('anything'):
+        pass
+    assert _current.get() is None
+
+def test_instrument__timings():
+    stream = io.StringIO()
+    with instrument(timings=True, stream=stream) as timings:
+        with timed('a'):
+            with timed('b'):
+                pass
+    assert _current.get() is None
+    report = json.loads(stream.getvalue())
+    assert [p['phase'] for p in report['phases']] == ['buildstrap', 'buildstrap/a', 'buildstrap/a/b']
+    assert report == timings.report()
+
+def test_instrument__profile(tmpdir):
+    stream = io.StringIO()
+    profile = str(tmpdir.join('buildstrap.prof'))
+    with instrument(profile=profile, stream=stream) as timings:
+        sorted(range(1000))
+    assert timings is None
+    assert stream.getvalue() == ''
+    stats = pstats.Stats(profile)
+    assert any(name == "<built-in method builtins.sorted>" for _, _, name in stats.stats)
+
+def test_buildout_phases():
+    import zc.buildout.buildout
+    import zc.buildout.easy_install
+    originals = (zc.buildout.buildout.Buildout._install, zc.buildout.easy_install.install)
+    with buildout_phases():
+        assert zc.buildout.buildout.Buildout._install is not originals[0]
+        assert zc.buildout.easy_install.install is not originals[1]
+    assert (zc.buildout.buildout.Buildout._install, zc.buildout.easy_install.install) == originals
+
+def test_buildstrap__timings(capsys, monkeypatch, tmpdir):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(buildstrap_module, 'buildout', lambda args: None)
+    tmpdir.join('requirements.txt').write('docopt\n')
+    args = {
+        'run': True, 'show': False, 'debug': False, 'generate': False, 'batch': False,
+        '<package>': 'buildstrap', '<requirements>': ['requirements.txt'], '<manifest>': None,
+        '--part': [], '--interpreter': None, '--config': None,
+        '--output': 'buildout.cfg', '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+        '--force': True, '--verbose': 0, '--timings': True,
+        '--profile': str(tmpdir.join('buildstrap.prof')),
+    }
+    assert buildstrap_module.buildstrap(args) == 0
+    report = json.loads(capsys.readouterr()[1].splitlines()[-1])
+    phases = [p['phase'] for p in report['phases']]
+    for phase in ['buildstrap', 'buildstrap/parts', 'buildstrap/parts/templates', 'buildstrap/generate',
+                  'buildstrap/run', 'buildstrap/run/fingerprint', 'buildstrap/run/buildout']:
+        assert phase in phases
+    assert tmpdir.join('buildstrap.prof').exists()
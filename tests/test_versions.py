@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import pytest
+
+import zc.buildout.easy_install
+
+from buildstrap.versions import *
+from buildstrap import buildstrap as buildstrap_module
+from buildstrap.buildstrap import build_part_buildout, build_parts_from_args
+
+
+def test_read_write_lock(tmpdir):
+    path = str(tmpdir.join('versions.cfg'))
+    assert read_lock(path) == {}
+    write_lock(path, {'zc.buildout': '2.13.3', 'Docopt': '0.6.2', 'pytest': '7.0'})
+    assert tmpdir.join('versions.cfg').read() == '\n'.join([
+        HEADER + '[versions]',
+        'docopt = 0.6.2',
+        'pytest = 7.0',
+        'zc.buildout = 2.13.3',
+        '', ''])
+    assert list(read_lock(path).items()) == [('docopt', '0.6.2'), ('pytest', '7.0'), ('zc.buildout', '2.13.3')]
+
+def test_merge_versions():
+    assert list(merge_versions({'docopt': '0.6.1'}, [('Docopt', '0.6.2'), ('pytest', '7.0')]).items()) == [
+        ('docopt', '0.6.1'), ('pytest', '7.0')]
+    assert list(merge_versions({'zc.buildout': '6.0.0'}, [('zc-buildout', '5.0'), ('Zc_Buildout', '4.0')]).items()) == [
+        ('zc.buildout', '6.0.0')]
+
+def test_build_part_buildout__versions_file():
+    assert 'extends' not in build_part_buildout()['buildout']
+    assert build_part_buildout(versions_file='versions.cfg')['buildout']['extends'] == 'versions.cfg'
+
+
+@pytest.fixture
+def project(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('requirements.txt').write('docopt\n')
+    picks = {}
+    runs = []
+    def mock_buildout(args):
+        zc.buildout.easy_install.Installer._picked_versions.update(picks)
+        tmpdir.join('bin').ensure(dir=True)
+        runs.append(tmpdir.join('buildout.cfg').read())
+    monkeypatch.setattr(buildstrap_module, 'buildout', mock_buildout)
+    args = {
+        'run': False, 'show': False, 'debug': False, 'generate': False, 'batch': False, 'watch': False,
+        'serve': False, 'lock': True,
+        '<package>': 'foo', '<requirements>': ['requirements.txt'], '<manifest>': None,
+        '--part': [], '--interpreter': None, '--config': str(tmpdir.join('config')),
+        '--output': 'buildout.cfg', '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+        '--force': False, '--verbose': 0, '--versions': 'versions.cfg', '--update-lock': False,
+    }
+    return tmpdir, args, picks, runs
+
+def test_lock(project, capsys):
+    tmpdir, args, picks, runs = project
+    picks.update({'docopt': '0.6.2', 'zc.buildout': '2.13.3'})
+    assert buildstrap_module.buildstrap(args) == 0
+    assert len(runs) == 1
+    assert 'extends' not in runs[0]
+    assert read_lock(str(tmpdir.join('versions.cfg'))) == {'docopt': '0.6.2', 'zc.buildout': '2.13.3'}
+    assert 'extends = versions.cfg' in tmpdir.join('buildout.cfg').read()
+
+    # the configuration extending the pins is up to date
+    args.update({'lock': False, 'run': True})
+    assert buildstrap_module.buildstrap(args) == 0
+    assert len(runs) == 1
+    assert 'skipping buildout' in capsys.readouterr()[1]
+
+    # updating the pins makes the next run happen
+    tmpdir.join('versions.cfg').write('[versions]\ndocopt = 0.6.1\n')
+    assert buildstrap_module.buildstrap(args) == 0
+    assert len(runs) == 2
+    assert 'extends = versions.cfg' in runs[1]
+
+def test_lock__keeps_pins(project):
+    tmpdir, args, picks, runs = project
+    tmpdir.join('versions.cfg').write('[versions]\ndocopt = 0.6.1\n')
+    picks.update({'pytest': '7.0'})
+    assert buildstrap_module.buildstrap(args) == 0
+    assert 'extends = versions.cfg' in runs[0]
+    assert read_lock(str(tmpdir.join('versions.cfg'))) == {'docopt': '0.6.1', 'pytest': '7.0'}
+
+def test_lock__update(project):
+    tmpdir, args, picks, runs = project
+    tmpdir.join('versions.cfg').write('[versions]\ndocopt = 0.6.1\n')
+    picks.update({'docopt': '0.6.2'})
+    args.update({'lock': False, 'run': True, '--update-lock': True})
+    assert 'extends' in build_parts_from_args(dict(args, **{'--update-lock': False}))['buildout']
+    assert buildstrap_module.buildstrap(args) == 0
+    assert 'extends' not in runs[0]
+    assert read_lock(str(tmpdir.join('versions.cfg'))) == {'docopt': '0.6.2'}
+    assert 'extends = versions.cfg' in tmpdir.join('buildout.cfg').read()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import os
+import time
+import threading
+
+import pytest
+
+from buildstrap.watch import *
+from buildstrap import buildstrap as buildstrap_module
+
+
+def test_relevant():
+    files, dirs = {'/p/requirements.txt', '/p/setup.py'}, {'/c'}
+    assert relevant('/p/requirements.txt', files, dirs)
+    assert relevant('/c', files, dirs)
+    assert relevant('/c/pytest.part.cfg', files, dirs)
+    assert relevant('/c/templates.bundle', files, dirs)
+    assert not relevant('/c/.pytest.part.cfg.swp', files, dirs)
+    assert not relevant('/p/buildout.cfg', files, dirs)
+
+def test_watched_paths(tmpdir):
+    tmpdir.join('requirements.txt').write('-r requirements-test.txt\ndocopt\n')
+    tmpdir.join('requirements-test.txt').write('pytest\n')
+    args = {'--output': str(tmpdir.join('buildout.cfg')), '--root': None, '--src': None,
+            '--env': 'var', '--bin': 'bin', '<requirements>': ['requirements.txt'],
+            '--config': str(tmpdir.join('config'))}
+    files, dirs = watched_paths(args)
+    assert files == {str(tmpdir.join(f)) for f in ['requirements.txt', 'requirements-test.txt', 'setup.py']}
+    assert str(tmpdir.join('config')) in dirs
+    assert len(dirs) == 2
+
+
+@pytest.fixture(params=['polling', 'inotify'])
+def watcher(request):
+    if request.param == 'polling':
+        return PollingWatcher(0.01)
+    if not InotifyWatcher.available():
+        pytest.skip('inotify is not available')
+    return InotifyWatcher()
+
+def test_watcher(watcher, tmpdir):
+    requirements = tmpdir.join('requirements.txt')
+    requirements.write('docopt\n')
+    config = tmpdir.join('config')
+    files, dirs = {str(requirements)}, {str(config)}
+    try:
+        assert watcher.changes(files, dirs, 0.05) == set()
+
+        requirements.write('docopt\npytest\n')
+        assert str(requirements) in watcher.changes(files, dirs, 1)
+
+        # templates directory created later on, then templates added within
+        config.ensure(dir=True)
+        assert str(config) in watcher.changes(files, dirs, 1)
+        config.join('pytest.part.cfg').write('[pytest]\n')
+        assert str(config.join('pytest.part.cfg')) in watcher.changes(files, dirs, 1)
+
+        # files replaced by a rename
+        tmpdir.join('.requirements.txt.tmp').write('pytest\n')
+        os.rename(str(tmpdir.join('.requirements.txt.tmp')), str(requirements))
+        assert str(requirements) in watcher.changes(files, dirs, 1)
+
+        # unrelated files are ignored
+        tmpdir.join('buildout.cfg').write('')
+        assert watcher.changes(files, dirs, 0.05) == set()
+    finally:
+        watcher.close()
+
+
+def test_watch(tmpdir, monkeypatch, capsys):
+    monkeypatch.chdir(tmpdir)
+    runs = []
+    def mock_buildout(args):
+        tmpdir.join('bin').ensure(dir=True)
+        runs.append(tmpdir.join('buildout.cfg').read())
+    monkeypatch.setattr(buildstrap_module, 'buildout', mock_buildout)
+    tmpdir.join('requirements.txt').write('docopt\n')
+    config = tmpdir.mkdir('config')
+    config.join('pytest.part.cfg').write('[pytest]\nrecipe = zc.recipe.egg\n')
+    config.join('sphinx.part.cfg').write('[sphinx]\nrecipe = zc.recipe.egg\n')
+    args = {
+        'run': False, 'show': False, 'debug': False, 'generate': False, 'batch': False, 'watch': True,
+        '<package>': 'foo', '<requirements>': ['requirements.txt'], '<manifest>': None,
+        '--part': ['pytest'], '--interpreter': None, '--config': str(config),
+        '--output': 'buildout.cfg', '--root': None, '--src': None, '--env': 'var', '--bin': 'bin',
+        '--force': False, '--verbose': 0, '--debounce': '0.1',
+    }
+    stop = threading.Event()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(watch(args, PollingWatcher(0.01), stop)))
+    thread.start()
+    def wait_for(count):
+        deadline = time.monotonic() + 5
+        while len(runs) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.3)
+    try:
+        wait_for(1)
+        assert len(runs) == 1
+
+        # a burst of changes is debounced into a single run
+        for i in range(5):
+            tmpdir.join('requirements.txt').write('docopt\n' + 'pytest\n' * i)
+            time.sleep(0.02)
+        wait_for(2)
+        assert len(runs) == 2
+
+        # a used template changes the configuration
+        config.join('pytest.part.cfg').write('[pytest]\nrecipe = zc.recipe.egg\neggs = pytest\n')
+        wait_for(3)
+        assert len(runs) == 3
+        assert 'eggs = pytest' in runs[-1]
+
+        # an unused template does not change anything
+        config.join('sphinx.part.cfg').write('[sphinx]\nrecipe = zc.recipe.egg\neggs = sphinx\n')
+        wait_for(4)
+        assert len(runs) == 3
+    finally:
+        stop.set()
+        thread.join()
+    assert result == [0]
+    assert 'skipping buildout' in capsys.readouterr()[1]